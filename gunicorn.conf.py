@@ -0,0 +1,78 @@
+"""Configuración de gunicorn para producción (`gunicorn -c gunicorn.conf.py shopproject.wsgi`).
+
+Con `preload_app` Django y la aplicación se cargan una sola vez en el proceso
+maestro; los workers se crean con fork y comparten esas páginas de memoria
+(copy-on-write), así que arrancan al instante y cada uno solo añade su memoria
+privada. Valores ajustables por variables de entorno.
+"""
+import gc
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+preload_app = True
+
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 20
+keepalive = 5
+
+# Reciclar workers de vez en cuando acota fugas de memoria; el jitter evita
+# que todos se reinicien a la vez
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = 100
+
+# El heartbeat de los workers en memoria en lugar de en disco
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+# Ninguna consulta de una petición debería pasar de este límite (solo
+# PostgreSQL, ver _postgres_profile en settings). Se fija aquí porque los
+# ajustes se cargan después, y así no afecta a los comandos de manage.py
+os.environ.setdefault('DB_STATEMENT_TIMEOUT_MS', str(min(timeout, 30) * 1000))
+
+# Sin REDIS_URL cada worker tiene su propia caché: una escritura solo purgaría
+# las respuestas cacheadas del worker que la hace y los demás seguirían
+# sirviendo precio y stock antiguos. Con varios workers, la caché de
+# respuestas queda desactivada salvo que se pida expresamente
+if workers > 1 and not os.environ.get('REDIS_URL'):
+    os.environ.setdefault('RESPONSE_CACHE_ENABLED', 'False')
+
+accesslog = '-'
+errorlog = '-'
+
+
+def when_ready(server):
+    # Con varios workers, la caché en memoria de cada proceso no propaga la
+    # invalidación del catálogo ni los eventos de stock a los demás
+    from myshop.cache import shared_cache_warning
+    warning = shared_cache_warning(server.num_workers)
+    if warning:
+        server.log.warning(warning)
+
+    # El índice de sugerencias se construye una vez aquí y los workers lo
+    # heredan (compartido) con el fork
+    from myshop import search_index
+    try:
+        search_index.warm()
+    except Exception:
+        server.log.exception('No se pudo precargar el índice de búsqueda')
+
+    # No heredar conexiones abiertas durante la carga de la aplicación, ni el
+    # pool de psycopg con sus hilos: cada worker crea el suyo al conectar
+    from django.db import connections
+    connections.close_all()
+    for connection in connections.all(initialized_only=True):
+        if connection.vendor == 'postgresql' and connection.settings_dict['OPTIONS'].get('pool'):
+            connection.close_pool()
+    # Mover los objetos ya creados a la generación permanente: el GC de los
+    # workers no los recorre, así que no se tocan sus páginas y siguen compartidas
+    gc.freeze()
+
+
+def worker_exit(server, worker):
+    # No perder los contadores de popularidad pendientes al reciclar un worker
+    from myshop.popularity import flush
+    flush()
@@ -1,7 +1,14 @@
 from django.contrib import admin
+from django.contrib import messages
 from django.contrib.admin import AdminSite
+from django.db import IntegrityError
+from django.db.models import Count, Sum
 from django.utils.html import format_html
-from .models import Product, Cart, CartItem, Order, OrderItem, Review
+from .inventory import adjust_stock, cancel_orders
+from .models import (
+    Product, Cart, CartItem, Order, OrderItem, Review, StockMovement, ArchivedOrder,
+    CustomerSegment, CohortRetention, PriceRule, PriceHistory,
+)
 
 AdminSite.site_header = "Administración de la Tienda 3D"
 AdminSite.site_title = "Panel de Control - Tienda 3D"
@@ -20,7 +27,7 @@ class ProductAdmin(admin.ModelAdmin):
             'fields': ('name', 'description', 'price', 'image_url')
         }),
         ('Categorización', {
-            'fields': ('category', 'is_active')
+            'fields': ('category',)
         }),
         ('Inventario', {
             'fields': ('stock',)
@@ -38,6 +45,19 @@ class ProductAdmin(admin.ModelAdmin):
         return 'Sin reseñas'
     rating_display.short_description = 'Valoración'
 
+    def save_model(self, request, obj, form, change):
+        # Los cambios de stock de un producto existente se registran como
+        # ajuste en el libro mayor en lugar de reescribir la columna
+        if change and 'stock' in form.changed_data:
+            delta = obj.stock - form.initial['stock']
+            other_fields = [name for name in form.changed_data if name != 'stock']
+            if other_fields:
+                obj.save(update_fields=other_fields)
+            adjust_stock(obj, delta, note=f'Ajuste desde el admin por {request.user.username}')
+            obj.refresh_from_db(fields=['stock'])
+        else:
+            super().save_model(request, obj, form, change)
+
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
@@ -51,7 +71,14 @@ class OrderAdmin(admin.ModelAdmin):
     list_filter = ('status', 'created_at')
     search_fields = ('user__username', 'shipping_address')
     readonly_fields = ('user', 'total', 'created_at')
+    list_select_related = ('user',)
     inlines = (OrderItemInline,)
+    actions = ('cancel_selected',)
+
+    @admin.action(description='Cancelar y devolver el stock')
+    def cancel_selected(self, request, queryset):
+        # Pedido a pedido: un update() masivo no devolvería el stock
+        self.message_user(request, f'{cancel_orders(queryset)} pedido(s) cancelados.')
 
     def save_model(self, request, obj, form, change):
         # Si el estado del pedido ha cambiado, enviar notificación
@@ -67,6 +94,173 @@ class OrderAdmin(admin.ModelAdmin):
             super().save_model(request, obj, form, change)
 
 
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'status', 'total', 'created_at', 'archived_at')
+    list_filter = ('status',)
+    search_fields = ('=id', 'user__username')
+    list_select_related = ('user',)
+    readonly_fields = ('id', 'user', 'status', 'total', 'created_at', 'archived_at', 'detail')
+    fields = readonly_fields
+    actions = ('restore',)
+
+    def detail(self, obj):
+        return format_html(
+            '{}<br>{}<br>{}',
+            obj.shipping_address, obj.phone,
+            ', '.join(f'{line.quantity}x {line.product.name} (${line.price})' for line in obj.lines),
+        )
+    detail.short_description = 'Detalle'
+
+    @admin.action(description='Restaurar a pedidos activos')
+    def restore(self, request, queryset):
+        from .archive import restore_order
+        restored = 0
+        for archived in queryset:
+            try:
+                restore_order(archived)
+            except IntegrityError:
+                self.message_user(request, f'No se pudo restaurar el pedido {archived.id}.', messages.ERROR)
+            else:
+                restored += 1
+        self.message_user(request, f'{restored} pedido(s) restaurados.')
+
+    # Archivo de solo lectura: se modifica con archive_orders/restore_orders
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(StockMovement)
+class StockMovementAdmin(admin.ModelAdmin):
+    list_display = ('product', 'kind', 'quantity', 'order', 'created_at')
+    list_filter = ('kind', 'created_at')
+    search_fields = ('product__name', 'note')
+    list_select_related = ('product', 'order')
+    raw_id_fields = ('product', 'order')
+
+    # Libro mayor de solo inserción: sin edición ni borrado
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(PriceRule)
+class PriceRuleAdmin(admin.ModelAdmin):
+    list_display = ('name', 'kind', 'value', 'category', 'name_contains', 'starts_at', 'ends_at', 'rule_status')
+    list_filter = ('kind', 'category')
+    search_fields = ('name',)
+    readonly_fields = ('applied_at', 'reverted_at')
+    actions = ('apply_now', 'revert_now')
+
+    def get_readonly_fields(self, request, obj=None):
+        # Una regla aplicada solo admite cambiar su fin (para alargar o acortar la oferta)
+        if obj is not None and obj.applied_at:
+            return [field.name for field in obj._meta.fields if field.name != 'ends_at']
+        return self.readonly_fields
+
+    def rule_status(self, obj):
+        return obj.status
+    rule_status.short_description = 'Estado'
+
+    @admin.action(description='Aplicar ahora')
+    def apply_now(self, request, queryset):
+        from .pricing import apply_rule
+        for rule in queryset.filter(applied_at__isnull=True, reverted_at__isnull=True):
+            self.message_user(request, f'"{rule}": {apply_rule(rule)} producto(s) cambiados.')
+
+    @admin.action(description='Revertir ahora')
+    def revert_now(self, request, queryset):
+        from .pricing import revert_rule
+        for rule in queryset.filter(applied_at__isnull=False, reverted_at__isnull=True):
+            restored, skipped = revert_rule(rule)
+            message = f'"{rule}": {restored} producto(s) restaurados.'
+            if skipped:
+                message += f' {skipped} conservan un precio cambiado después de la regla.'
+            self.message_user(request, message, messages.WARNING if skipped else messages.SUCCESS)
+
+
+@admin.register(PriceHistory)
+class PriceHistoryAdmin(admin.ModelAdmin):
+    list_display = ('product', 'rule', 'old_price', 'new_price')
+    list_filter = ('rule',)
+    search_fields = ('product__name',)
+    list_select_related = ('product', 'rule')
+
+    # Lo escriben apply_rule/revert_rule (myshop/pricing.py); borrarlo impediría revertir
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+class ReadOnlyAnalyticsAdmin(admin.ModelAdmin):
+    """Resultados de `manage.py analyze_customers`: solo lectura."""
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(CustomerSegment)
+class CustomerSegmentAdmin(ReadOnlyAnalyticsAdmin):
+    list_display = ('user', 'segment', 'recency_days', 'frequency', 'monetary', 'rfm', 'last_order_at')
+    list_filter = ('segment', 'r_score', 'f_score', 'm_score')
+    search_fields = ('user__username', 'user__email')
+    list_select_related = ('user',)
+
+    def rfm(self, obj):
+        return f'{obj.r_score}{obj.f_score}{obj.m_score}'
+    rfm.short_description = 'RFM'
+
+    def changelist_view(self, request, extra_context=None):
+        summary = (
+            CustomerSegment.objects.order_by().values('segment')
+            .annotate(customers=Count('id'), revenue=Sum('monetary'))
+        )
+        labels = dict(CustomerSegment.SEGMENT_CHOICES)
+        extra_context = {
+            **(extra_context or {}),
+            'segment_summary': [{**row, 'label': labels.get(row['segment'], row['segment'])} for row in summary],
+        }
+        return super().changelist_view(request, extra_context)
+
+
+@admin.register(CohortRetention)
+class CohortRetentionAdmin(ReadOnlyAnalyticsAdmin):
+    list_display = ('cohort', 'months_since', 'customers', 'retained', 'rate_display')
+    list_filter = ('cohort',)
+
+    def rate_display(self, obj):
+        return f'{obj.rate:.1%}'
+    rate_display.short_description = 'Retención'
+
+    def changelist_view(self, request, extra_context=None):
+        # Matriz cohorte x meses (las cohortes de los últimos dos años)
+        rows = {}
+        max_months = 0
+        for cell in CohortRetention.objects.order_by('-cohort', 'months_since')[:24 * 25]:
+            rows.setdefault(cell.cohort, {})[cell.months_since] = cell
+            max_months = max(max_months, cell.months_since)
+        months = list(range(max_months + 1))
+        matrix = [
+            (cohort, cells[0].customers if 0 in cells else 0, [cells.get(month) for month in months])
+            for cohort, cells in sorted(rows.items())
+        ]
+        extra_context = {**(extra_context or {}), 'cohort_months': months, 'cohort_matrix': matrix}
+        return super().changelist_view(request, extra_context)
+
+
 @admin.register(Review)
 class ReviewAdmin(admin.ModelAdmin):
     list_display = ('product', 'user', 'rating', 'created_at')
@@ -0,0 +1,165 @@
+"""Analítica de clientes por lotes: segmentos RFM y retención por cohortes.
+
+Los pedidos (`Order` y `ArchivedOrder`, sin los cancelados) se leen en
+bloques de `chunk_size` filas con solo tres columnas (usuario, fecha, total) y
+cada bloque se reduce con pandas a agregados por cliente (primer y último
+pedido, número de pedidos, importe) y a pares únicos (cliente, mes). La memoria
+depende del número de clientes, no del de pedidos.
+
+Las puntuaciones R, F y M (1 a 5) son quintiles por percentil y el segmento
+sale de combinarlas. Los resultados sustituyen por completo a los de la
+ejecución anterior en `CustomerSegment` y `CohortRetention`, que se
+consultan en el admin.
+
+pandas y numpy están en requirements-tools.txt: no hacen falta en el servidor web.
+"""
+from datetime import date, datetime, timezone as dt_timezone
+from itertools import islice
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ArchivedOrder, CohortRetention, CustomerSegment, Order
+
+_NS_PER_DAY = 86_400 * 10**9
+
+
+def _segment_rules(r, f, frequency):
+    """(segmento, condición) en orden de prioridad; el resto son 'lost'."""
+    return [
+        ('champions', (r >= 4) & (f >= 4)),
+        ('loyal', (r >= 3) & (f >= 3)),
+        ('new', (r >= 4) & (frequency == 1)),
+        ('potential', r >= 3),
+        ('at_risk', f >= 3),
+        ('hibernating', r == 2),
+    ]
+
+
+def _require_pandas():
+    try:
+        import numpy
+        import pandas
+    except ImportError as exc:
+        raise ImportError('La analítica de clientes necesita pandas y numpy: pip install -r requirements-tools.txt') from exc
+    return numpy, pandas
+
+
+def _order_chunks(chunk_size):
+    """Bloques de (user_id, created_at, total) de los pedidos activos y archivados."""
+    for model in (Order, ArchivedOrder):
+        rows = (
+            model.objects.exclude(status='cancelled').order_by()
+            .values_list('user_id', 'created_at', 'total')
+            .iterator(chunk_size=chunk_size)
+        )
+        while chunk := list(islice(rows, chunk_size)):
+            yield chunk
+
+
+def _reduce_chunk(pd, rows, tz_name):
+    frame = pd.DataFrame.from_records(rows, columns=['user_id', 'created_at', 'total'])
+    created = pd.to_datetime(frame['created_at'], utc=True)
+    local = created.dt.tz_convert(tz_name)
+    frame['ts'] = created.dt.as_unit('ns').astype('int64')
+    frame['total'] = frame['total'].astype('float64')
+    users = frame.groupby('user_id').agg(
+        first=('ts', 'min'), last=('ts', 'max'), frequency=('ts', 'size'), monetary=('total', 'sum'),
+    )
+    months = pd.DataFrame({
+        'user_id': frame['user_id'],
+        'month': local.dt.year * 12 + local.dt.month - 1,
+    }).drop_duplicates()
+    return users, months
+
+
+def _merge(pd, users, months, chunk_users, chunk_months):
+    if users is None:
+        return chunk_users, chunk_months
+    users = pd.concat([users, chunk_users]).groupby(level=0).agg(
+        {'first': 'min', 'last': 'max', 'frequency': 'sum', 'monetary': 'sum'}
+    )
+    months = pd.concat([months, chunk_months], ignore_index=True).drop_duplicates()
+    return users, months
+
+
+def _score(np, values):
+    """Quintil (1 a 5) por percentil; los empates reciben la puntuación más baja del grupo.
+
+    Así los muchos clientes con un solo pedido no suben a un quintil intermedio.
+    """
+    return np.ceil(values.rank(method='min', pct=True) * 5).clip(1, 5).astype('int64')
+
+
+def rfm_segments(np, users, now):
+    recency = (int(now.timestamp() * 10**9) - users['last']) // _NS_PER_DAY
+    result = users.assign(
+        recency_days=recency.clip(lower=0).astype('int64'),
+        r_score=_score(np, -recency),
+        f_score=_score(np, users['frequency']),
+        m_score=_score(np, users['monetary']),
+    )
+    rules = _segment_rules(result['r_score'], result['f_score'], result['frequency'])
+    result['segment'] = np.select([condition for _, condition in rules], [name for name, _ in rules], 'lost')
+    return result
+
+
+def cohort_matrix(pd, months):
+    """DataFrame (cohort, months_since, customers, retained, rate) a partir de pares (cliente, mes)."""
+    cohort = months.groupby('user_id')['month'].transform('min')
+    active = months.assign(cohort=cohort, months_since=months['month'] - cohort)
+    matrix = active.groupby(['cohort', 'months_since']).size().rename('retained').reset_index()
+    sizes = matrix.loc[matrix['months_since'] == 0].set_index('cohort')['retained']
+    matrix['customers'] = matrix['cohort'].map(sizes)
+    matrix['rate'] = matrix['retained'] / matrix['customers']
+    return matrix
+
+
+def compute(chunk_size=50000):
+    """Lee los pedidos por bloques y devuelve (segmentos, cohortes, pedidos leídos)."""
+    np, pd = _require_pandas()
+    tz_name = timezone.get_current_timezone_name()
+    users = months = None
+    orders = 0
+    for rows in _order_chunks(chunk_size):
+        orders += len(rows)
+        users, months = _merge(pd, users, months, *_reduce_chunk(pd, rows, tz_name))
+    if users is None:
+        return None, None, 0
+    return rfm_segments(np, users, timezone.now()), cohort_matrix(pd, months), orders
+
+
+def _month_start(month):
+    return date(int(month) // 12, int(month) % 12 + 1, 1)
+
+
+def save(segments, cohorts, batch_size=2000):
+    """Sustituye los resultados anteriores por los nuevos en una transacción."""
+    now = timezone.now()
+
+    def aware(ns):
+        return datetime.fromtimestamp(ns / 10**9, tz=dt_timezone.utc)
+
+    with transaction.atomic():
+        CustomerSegment.objects.all().delete()
+        CohortRetention.objects.all().delete()
+        if segments is None:
+            return
+        rows = segments.itertuples()
+        while batch := list(islice(rows, batch_size)):
+            CustomerSegment.objects.bulk_create([
+                CustomerSegment(
+                    user_id=row.Index, segment=row.segment, recency_days=row.recency_days,
+                    frequency=row.frequency, monetary=round(row.monetary, 2),
+                    r_score=row.r_score, f_score=row.f_score, m_score=row.m_score,
+                    first_order_at=aware(row.first), last_order_at=aware(row.last), computed_at=now,
+                )
+                for row in batch
+            ])
+        CohortRetention.objects.bulk_create([
+            CohortRetention(
+                cohort=_month_start(row.cohort), months_since=row.months_since,
+                customers=row.customers, retained=row.retained, rate=row.rate, computed_at=now,
+            )
+            for row in cohorts.itertuples()
+        ], batch_size=batch_size)
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class MyshopConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'myshop'
+
+    def ready(self):
+        # Registrar los receptores de señales
+        from . import signals  # noqa: F401
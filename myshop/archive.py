@@ -0,0 +1,114 @@
+"""Archivo de pedidos históricos.
+
+Los pedidos `delivered`/`cancelled` anteriores a una fecha se mueven por lotes
+de `Order`/`OrderItem` a `ArchivedOrder` (una fila por pedido con el detalle
+comprimido). Así las tablas calientes y sus índices se mantienen pequeños.
+Cada lote es una transacción independiente: el proceso puede interrumpirse y
+volver a lanzarse sin perder ni duplicar pedidos.
+
+Los movimientos de stock del pedido se conservan (`order` queda a NULL) y
+guardan el número de pedido en `note` si no tenían nota. Al restaurar el
+pedido se vuelven a enlazar por esa nota, para que una nueva cancelación vea
+la devolución que ya se hizo y no devuelva el stock dos veces.
+"""
+import json
+from datetime import datetime
+
+from django.db import transaction
+from django.db.models import CharField, Value
+from django.db.models.functions import Cast, Concat
+
+from .models import ArchivedOrder, Order, OrderItem, StockMovement
+
+ARCHIVABLE_STATUSES = ('delivered', 'cancelled')
+
+
+def _serialize(order):
+    return {
+        'shipping_address': order.shipping_address,
+        'phone': order.phone,
+        'customer_name': order.customer_name,
+        'customer_email': order.customer_email,
+        'updated_at': order.updated_at.isoformat(),
+        'items': [
+            {
+                'product_id': item.product_id,
+                'product_name': item.product.name,
+                'quantity': item.quantity,
+                'price': str(item.price),
+            }
+            for item in order.items.all()
+        ],
+    }
+
+
+def _movement_note(order_id):
+    return f'Pedido #{order_id}'
+
+
+def archive_batch(order_ids, before, statuses=ARCHIVABLE_STATUSES):
+    """Archiva los pedidos indicados en una transacción. Devuelve (pedidos, bytes JSON, bytes comprimidos).
+
+    Los filtros se repiten al bloquear las filas: un pedido que cambió de
+    estado desde que se eligió el lote (p. ej. reabierto en el admin) se queda.
+    """
+    with transaction.atomic():
+        orders = list(
+            Order.objects.select_for_update()
+            .filter(pk__in=order_ids, status__in=statuses, created_at__lt=before).order_by()
+            .prefetch_related('items__product')
+        )
+        if not orders:
+            return 0, 0, 0
+        archived, raw_size = [], 0
+        for order in orders:
+            data = _serialize(order)
+            payload = ArchivedOrder.pack(data)
+            raw_size += len(json.dumps(data, separators=(',', ':')).encode('utf-8'))
+            archived.append(ArchivedOrder(
+                id=order.id, user_id=order.user_id, status=order.status,
+                total=order.total, created_at=order.created_at, payload=payload,
+            ))
+        ArchivedOrder.objects.bulk_create(archived)
+        ids = [order.id for order in orders]
+        StockMovement.objects.filter(order_id__in=ids, note='').update(
+            note=Concat(Value(_movement_note('')), Cast('order_id', CharField()))
+        )
+        Order.objects.filter(pk__in=ids).delete()
+    return len(archived), raw_size, sum(len(a.payload) for a in archived)
+
+
+def archive_orders(before, statuses=ARCHIVABLE_STATUSES, batch_size=500):
+    """Archiva por lotes los pedidos anteriores a `before`; genera el resultado de cada lote."""
+    candidates = Order.objects.filter(status__in=statuses, created_at__lt=before).order_by('id')
+    last_id = 0
+    while True:
+        ids = list(candidates.filter(id__gt=last_id).values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return
+        last_id = ids[-1]
+        yield archive_batch(ids, before, statuses)
+
+
+def restore_order(archived):
+    """Devuelve un pedido archivado a las tablas `Order`/`OrderItem` con su id original."""
+    data = archived.data
+    with transaction.atomic():
+        # bulk_create: sin señales (no debe repetirse la devolución de stock)
+        Order.objects.bulk_create([Order(
+            id=archived.id, user_id=archived.user_id, status=archived.status, total=archived.total,
+            shipping_address=data['shipping_address'], phone=data['phone'],
+            customer_name=archived.customer_name, customer_email=archived.customer_email,
+        )])
+        # auto_now_add/auto_now pisan las fechas al insertar: se restauran aparte
+        Order.objects.filter(pk=archived.id).update(
+            created_at=archived.created_at, updated_at=datetime.fromisoformat(data['updated_at']),
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(order_id=archived.id, product_id=line.product_id, quantity=line.quantity, price=line.price)
+            for line in archived.lines
+        ])
+        StockMovement.objects.filter(order__isnull=True, note=_movement_note(archived.id)).update(
+            order_id=archived.id, note='',
+        )
+        archived.delete()
@@ -0,0 +1,59 @@
+import re
+from pathlib import Path
+
+from django.conf import settings
+
+
+# Archivos fuente (relativos a static/) que forman cada bundle
+DEFAULT_BUNDLES = {
+    'dist/shop.min.css': ['css/style.css'],
+    'dist/shop.min.js': ['js/cart.js', 'js/search.js', 'js/live.js'],
+}
+
+_CSS_COMMENT_RE = re.compile(r'/\*.*?\*/', re.S)
+_CSS_SPACE_RE = re.compile(r'\s+')
+_CSS_PUNCT_RE = re.compile(r'\s*([{};,>])\s*')
+_JS_BLOCK_COMMENT_RE = re.compile(r'/\*.*?\*/', re.S)
+_JS_LINE_COMMENT_RE = re.compile(r'^\s*//.*$', re.M)
+
+
+def minify_css(source):
+    """Minificador conservador: elimina comentarios y espacios redundantes."""
+    css = _CSS_COMMENT_RE.sub('', source)
+    css = _CSS_SPACE_RE.sub(' ', css)
+    css = _CSS_PUNCT_RE.sub(r'\1', css)
+    return css.replace(';}', '}').strip()
+
+
+def minify_js(source):
+    """Minificador conservador para JS: quita comentarios e indentación.
+
+    No renombra ni reordena nada, por lo que no necesita un parser; conserva
+    los saltos de línea para no depender de la inserción automática de ';'.
+    """
+    js = _JS_BLOCK_COMMENT_RE.sub('', source)
+    js = _JS_LINE_COMMENT_RE.sub('', js)
+    lines = (line.strip() for line in js.splitlines())
+    return '\n'.join(line for line in lines if line)
+
+
+def build_bundles(source_dir=None, bundles=None):
+    """Concatena y minifica los bundles dentro de `source_dir` (static/).
+
+    Devuelve una lista de tuplas (bundle, bytes_originales, bytes_minificados).
+    El fingerprint y la compresión gzip/brotli los añade después
+    `collectstatic` con el storage de WhiteNoise.
+    """
+    source_dir = Path(source_dir or settings.STATICFILES_DIRS[0])
+    bundles = bundles or getattr(settings, 'ASSET_BUNDLE_SOURCES', DEFAULT_BUNDLES)
+    results = []
+    for bundle, sources in bundles.items():
+        minify = minify_css if bundle.endswith('.css') else minify_js
+        contents = [(source_dir / name).read_text(encoding='utf-8') for name in sources]
+        original = '\n'.join(contents)
+        minified = '\n'.join(minify(content) for content in contents)
+        target = source_dir / bundle
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_text(minified + '\n', encoding='utf-8')
+        results.append((bundle, len(original.encode('utf-8')), len(minified.encode('utf-8'))))
+    return results
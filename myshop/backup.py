@@ -0,0 +1,171 @@
+"""Copias de seguridad en caliente de la base SQLite.
+
+`online_backup` usa la API de backup de sqlite3 en pasos de pocas páginas:
+
+- En modo WAL la conexión de origen abre una transacción de lectura durante
+  toda la copia, que obtiene así una foto consistente sin bloquear a los
+  escritores (escriben en el WAL) y sin reinicios.
+- En modo rollback journal el bloqueo compartido solo se mantiene durante cada
+  paso y se duerme entre pasos para que los `checkout` en curso confirmen.
+  Pero cada escritura de otra conexión reinicia la copia desde el principio;
+  con escrituras continuas no terminaría nunca. Tras `max_restarts` reinicios
+  se copia el resto de una vez, con una espera acotada para los escritores.
+
+Mientras dura la copia, un hilo mide cuánto tardaría un escritor en obtener
+el bloqueo exclusivo (`BEGIN EXCLUSIVE` + `ROLLBACK`, sin modificar nada para
+no reiniciar la copia). Los pasos de la copia duran milisegundos, así que la
+sonda espera como mucho `PROBE_TIMEOUT`: si no obtiene el bloqueo en ese
+tiempo lo tiene una transacción de otro escritor (o la copia forzada en un
+solo paso) y se cuenta aparte, en `contended`, en lugar de como espera.
+"""
+import gzip
+import shutil
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+SNAPSHOT_PREFIX = 'db-'
+PROBE_TIMEOUT = 1.0
+
+
+@dataclass
+class BackupResult:
+    path: Path
+    size: int
+    seconds: float
+    journal_mode: str = ''
+    steps: int = 0
+    restarts: int = 0
+    forced: bool = False
+    stalls: list = field(default_factory=list)
+    contended: int = 0
+
+    @property
+    def throughput(self):
+        """MiB/s copiados (incluidas las pausas entre pasos)."""
+        return self.size / 1024 / 1024 / self.seconds if self.seconds else 0.0
+
+    @property
+    def max_stall(self):
+        return max(self.stalls, default=0.0)
+
+
+class WriterStallProbe(threading.Thread):
+    """Mide periódicamente la espera de un escritor por el bloqueo exclusivo."""
+
+    def __init__(self, path, interval=0.02, timeout=PROBE_TIMEOUT):
+        super().__init__(name='backup-stall-probe', daemon=True)
+        self.path = str(path)
+        self.interval = interval
+        self.timeout = timeout
+        self.stalls = []
+        self.contended = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        try:
+            while not self._stop_event.wait(self.interval):
+                started = time.perf_counter()
+                try:
+                    connection.execute('BEGIN EXCLUSIVE')
+                except sqlite3.OperationalError:
+                    # Otro escritor real tenía la base: no es espera causada por la copia
+                    self.contended += 1
+                    continue
+                self.stalls.append(time.perf_counter() - started)
+                connection.execute('ROLLBACK')
+        finally:
+            connection.close()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def online_backup(source, destination, pages=256, sleep=0.05, probe=True, max_restarts=3):
+    """Copia `source` en `destination` por pasos de `pages` páginas."""
+    result = BackupResult(path=Path(destination), size=0, seconds=0.0)
+    remaining_before = None
+
+    def progress(status, remaining, total):
+        nonlocal remaining_before
+        result.steps += 1
+        # Sin reinicios `remaining` siempre baja: cada paso copia páginas
+        if remaining_before is not None and remaining >= remaining_before:
+            result.restarts += 1
+            if result.restarts > max_restarts:
+                raise _TooManyRestarts
+        remaining_before = remaining
+        if remaining and sleep:
+            # Fuera del paso no hay bloqueo: los escritores avanzan aquí
+            time.sleep(sleep)
+
+    stall_probe = WriterStallProbe(source) if probe else None
+    src = sqlite3.connect(str(source), timeout=60, isolation_level=None)
+    dst = sqlite3.connect(str(destination))
+    result.journal_mode = src.execute('PRAGMA journal_mode').fetchone()[0].lower()
+    started = time.perf_counter()
+    if stall_probe:
+        stall_probe.start()
+    try:
+        if result.journal_mode == 'wal':
+            # Foto consistente: la lectura abierta fija el estado de la base
+            src.execute('BEGIN')
+            src.execute('SELECT count(*) FROM sqlite_master').fetchone()
+        try:
+            src.backup(dst, pages=pages, progress=progress)
+        except _TooManyRestarts:
+            result.forced = True
+            src.backup(dst, pages=-1)
+        if src.in_transaction:
+            src.execute('COMMIT')
+    finally:
+        result.seconds = time.perf_counter() - started
+        if stall_probe:
+            stall_probe.stop()
+            result.stalls = stall_probe.stalls
+            result.contended = stall_probe.contended
+        dst.close()
+        src.close()
+    result.size = Path(destination).stat().st_size
+    return result
+
+
+def integrity_check(path):
+    """Resultado de `PRAGMA integrity_check` ('ok' si la copia es válida)."""
+    connection = sqlite3.connect(str(path))
+    try:
+        rows = connection.execute('PRAGMA integrity_check').fetchall()
+    finally:
+        connection.close()
+    return '\n'.join(row[0] for row in rows)
+
+
+def compress(path):
+    """Comprime `path` a `path.gz` y borra el original."""
+    target = path.with_name(path.name + '.gz')
+    partial = target.with_name(target.name + '.part')
+    with open(path, 'rb') as src, gzip.open(partial, 'wb', compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    partial.replace(target)
+    path.unlink()
+    return target
+
+
+def snapshots(directory):
+    return sorted(Path(directory).glob(f'{SNAPSHOT_PREFIX}*.sqlite3*'))
+
+
+def prune(directory, keep):
+    """Borra las copias más antiguas y deja las `keep` más recientes."""
+    old = [path for path in snapshots(directory) if not path.name.endswith('.part')][:-keep or None]
+    for path in old:
+        path.unlink()
+    return old
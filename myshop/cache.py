@@ -0,0 +1,196 @@
+"""Caché HTTP de respuestas completas para las páginas públicas del catálogo.
+
+Solo se cachean peticiones GET/HEAD de visitantes anónimos sin mensajes
+pendientes. La clave combina la vista, los parámetros de consulta normalizados,
+el estado de autenticación, las cabeceras indicadas en `Vary` (salvo `Cookie`,
+que se sustituye por el estado de autenticación) y un contador de generación
+que se incrementa con cada escritura de `Product`/`Review`.
+
+Protección contra estampidas: solo una petición (la que obtiene el lock en la
+caché) regenera una entrada; el resto sirve la versión anterior mientras está
+dentro de la ventana stale-while-revalidate, o espera brevemente a que la
+entrada aparezca.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import cc_delim_re
+from django.utils.http import urlencode
+
+GENERATION_KEY = 'shop:catalog:generation'
+KEY_PREFIX = 'shop:resp'
+# Backends cuyo contenido no ven los demás procesos
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def cache_is_shared():
+    """True si la caché por defecto es la misma para todos los procesos (Redis, memcached...)."""
+    return settings.CACHES['default']['BACKEND'] not in LOCAL_CACHE_BACKENDS
+
+
+def shared_cache_warning(workers):
+    """Aviso para el arranque si varios workers van a tener cada uno su propia caché."""
+    if workers > 1 and not cache_is_shared():
+        return (
+            f'{workers} workers con la caché {settings.CACHES["default"]["BACKEND"]}: cada proceso '
+            'tiene la suya. La caché de respuestas está desactivada '
+            f'(RESPONSE_CACHE_ENABLED={_setting("RESPONSE_CACHE_ENABLED", True)}), el stock en vivo '
+            'funciona por sondeo y los límites de peticiones se cuentan por worker. Define REDIS_URL.'
+        )
+    return None
+
+
+def catalog_generation():
+    """Generación actual del catálogo (se crea en 1 si no existe)."""
+    return cache.get_or_set(GENERATION_KEY, 1, None)
+
+
+def bump_catalog_generation():
+    """Invalida de golpe todas las respuestas cacheadas del catálogo."""
+    try:
+        return cache.incr(GENERATION_KEY)
+    except ValueError:
+        # La clave expiró o nunca se creó: cualquier valor nuevo sirve
+        cache.add(GENERATION_KEY, 2, None)
+        return cache.get(GENERATION_KEY)
+
+
+def _normalized_query(request, params):
+    """Parámetros permitidos, sin vacíos y en orden estable."""
+    items = []
+    for name in sorted(params):
+        value = request.GET.get(name, '').strip()
+        if value:
+            items.append((name, value))
+    return urlencode(items)
+
+
+def _vary_headers(response):
+    if not response.has_header('Vary'):
+        return []
+    headers = (h.strip().lower() for h in cc_delim_re.split(response['Vary']))
+    # `Cookie` se reemplaza por el estado de autenticación de la clave
+    return sorted({h for h in headers if h and h != 'cookie'})
+
+
+def _entry_key(base, vary_headers, request):
+    values = '|'.join(
+        request.META.get('HTTP_' + header.upper().replace('-', '_'), '')
+        for header in vary_headers
+    )
+    digest = hashlib.md5(values.encode(), usedforsecurity=False).hexdigest()
+    return f'{base}:{digest}'
+
+
+def _is_cacheable_request(request):
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if request.user.is_authenticated:
+        return False
+    # Un mensaje pendiente se mostraría (y consumiría) desde una página cacheada
+    return not len(messages.get_messages(request))
+
+
+def _is_cacheable_response(request, response):
+    if response.status_code != 200 or response.streaming or response.cookies:
+        return False
+    # La plantilla pidió un token CSRF: la página depende del visitante
+    if request.META.get('CSRF_COOKIE_NEEDS_UPDATE'):
+        return False
+    cache_control = response.get('Cache-Control', '')
+    return 'private' not in cache_control and 'no-store' not in cache_control
+
+
+def _serialize(response, ttl):
+    return {
+        'content': response.content,
+        'status': response.status_code,
+        'headers': [(k, v) for k, v in response.items() if k.lower() != 'set-cookie'],
+        'fresh_until': time.time() + ttl,
+    }
+
+
+def _build_response(entry, state):
+    response = HttpResponse(entry['content'], status=entry['status'])
+    for header, value in entry['headers']:
+        response[header] = value
+    response['X-Cache'] = state
+    return response
+
+
+def cache_response(timeout=None, stale=None, params=()):
+    """Decorador de vistas con caché de respuesta para visitantes anónimos.
+
+    `timeout` es el tiempo (s) en que una entrada está fresca; durante los
+    `stale` segundos siguientes se sigue sirviendo mientras una sola petición
+    la regenera. `params` son los parámetros GET que forman parte de la clave
+    (el resto se ignora).
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def _wrapped(request, *args, **kwargs):
+            if not _setting('RESPONSE_CACHE_ENABLED', True) or not _is_cacheable_request(request):
+                return view_func(request, *args, **kwargs)
+
+            ttl = timeout if timeout is not None else _setting('RESPONSE_CACHE_TIMEOUT', 60)
+            stale_ttl = stale if stale is not None else _setting('RESPONSE_CACHE_STALE', 300)
+            lock_timeout = _setting('RESPONSE_CACHE_LOCK_TIMEOUT', 10)
+
+            view_key = f'{view_func.__module__}.{view_func.__qualname__}'
+            path_hash = hashlib.md5(
+                f'{request.path}?{_normalized_query(request, params)}'.encode(), usedforsecurity=False
+            ).hexdigest()
+            vary_key = f'{KEY_PREFIX}:vary:{view_key}:{path_hash}'
+            cached = cache.get_many([GENERATION_KEY, vary_key])
+            generation = cached.get(GENERATION_KEY) or catalog_generation()
+            vary_headers = cached.get(vary_key, [])
+            base = f'{KEY_PREFIX}:{generation}:{view_key}:anon:{path_hash}'
+            key = _entry_key(base, vary_headers, request)
+            lock_key = f'{key}:lock'
+
+            def regenerate():
+                response = view_func(request, *args, **kwargs)
+                if _is_cacheable_response(request, response):
+                    headers = _vary_headers(response)
+                    if headers != vary_headers:
+                        cache.set(vary_key, headers, None)
+                    cache.set(_entry_key(base, headers, request), _serialize(response, ttl), ttl + stale_ttl)
+                response['X-Cache'] = 'MISS'
+                return response
+
+            entry = cache.get(key)
+            if entry is not None and entry['fresh_until'] > time.time():
+                return _build_response(entry, 'HIT')
+
+            if cache.add(lock_key, 1, lock_timeout):
+                try:
+                    return regenerate()
+                finally:
+                    cache.delete(lock_key)
+
+            if entry is not None:
+                # Otra petición ya está regenerando: servir la copia anterior
+                return _build_response(entry, 'STALE')
+
+            # Fallo en frío con otra petición regenerando: esperar su resultado
+            deadline = time.monotonic() + _setting('RESPONSE_CACHE_LOCK_WAIT', 2)
+            while time.monotonic() < deadline:
+                time.sleep(0.05)
+                entry = cache.get(key)
+                if entry is not None:
+                    return _build_response(entry, 'HIT')
+            return regenerate()
+        return _wrapped
+    return decorator
@@ -0,0 +1,225 @@
+"""Feed de cambios de stock y precio de los productos.
+
+Las escrituras (`inventory.record_movements`, que cubre checkout, cancelaciones
+y ajustes del admin, y cualquier `Product.save()`) llaman a `publish_products`
+tras confirmar la transacción. Se lee el estado actual de esos productos en
+una consulta y se publica un evento ligero por producto a través del broker
+(`CHANGEFEED_BROKER`):
+
+- `CacheBroker` (por defecto): los eventos se guardan en la caché compartida
+  (Redis en producción) con un número de secuencia. Un único hilo por proceso
+  consulta la secuencia cada `CHANGEFEED_POLL_INTERVAL` segundos y reparte los
+  eventos nuevos; cuesta lo mismo con 1 que con 500 páginas abiertas.
+  Con la caché en memoria de cada proceso no hay feed: un evento solo llegaría
+  a las páginas conectadas al worker que hizo la escritura, así que no se
+  publica nada y `/products/stream/` pasa a modo sondeo (ver `live`).
+- `InProcessBroker`: reparte en el acto dentro del proceso. Sirve para tests y
+  para desarrollo con un solo proceso.
+
+Cada página abierta (`/products/stream/`, server-sent events) se suscribe a
+sus productos y recibe los eventos por una cola en memoria.
+"""
+import json
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router
+from django.utils.module_loading import import_string
+
+from .cache import cache_is_shared
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+SEQUENCE_KEY = 'shop:feed:seq'
+EVENT_KEY = 'shop:feed:event:{}'
+
+
+class Subscription:
+    """Cola de eventos de una conexión SSE para un conjunto de productos."""
+
+    def __init__(self, hub, product_ids, maxsize=100):
+        self.hub = hub
+        self.product_ids = frozenset(product_ids)
+        self.queue = queue.Queue(maxsize=maxsize)
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # Cliente lento: se descarta el evento más antiguo
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                pass
+            self.queue.put_nowait(event)
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class Hub:
+    """Reparte los eventos del proceso entre las suscripciones abiertas."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_product = defaultdict(set)
+
+    def subscribe(self, product_ids):
+        subscription = Subscription(self, product_ids)
+        with self._lock:
+            for product_id in subscription.product_ids:
+                self._by_product[product_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for product_id in subscription.product_ids:
+                subscribers = self._by_product.get(product_id)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._by_product[product_id]
+
+    def dispatch(self, events):
+        for event in events:
+            with self._lock:
+                subscribers = list(self._by_product.get(event['id'], ()))
+            for subscription in subscribers:
+                subscription.put(event)
+
+    def __len__(self):
+        with self._lock:
+            return len(set().union(*self._by_product.values())) if self._by_product else 0
+
+
+class InProcessBroker:
+    live = True
+
+    def __init__(self, hub):
+        self.hub = hub
+
+    def publish(self, events):
+        self.hub.dispatch(events)
+
+    def start(self):
+        pass
+
+
+class CacheBroker:
+    """Broker sobre la caché de Django: un hilo por proceso sondea la secuencia."""
+
+    def __init__(self, hub):
+        self.hub = hub
+        self.poll_interval = getattr(settings, 'CHANGEFEED_POLL_INTERVAL', 0.5)
+        self.event_ttl = getattr(settings, 'CHANGEFEED_EVENT_TTL', 60)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._last_seen = None
+        # Sin caché compartida los eventos no saldrían del proceso que escribe
+        self.live = cache_is_shared()
+
+    def publish(self, events):
+        if not self.live:
+            return
+        for event in events:
+            try:
+                seq = cache.incr(SEQUENCE_KEY)
+            except ValueError:
+                cache.add(SEQUENCE_KEY, 0, None)
+                seq = cache.incr(SEQUENCE_KEY)
+            cache.set(EVENT_KEY.format(seq), event, self.event_ttl)
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._last_seen = cache.get(SEQUENCE_KEY, 0)
+                self._thread = threading.Thread(target=self._run, name='changefeed', daemon=True)
+                self._thread.start()
+
+    def poll(self):
+        """Reparte los eventos publicados desde la última consulta."""
+        seq = cache.get(SEQUENCE_KEY, 0)
+        if seq < self._last_seen:
+            # La caché se vació: empezar de nuevo
+            self._last_seen = seq
+        if seq == self._last_seen:
+            return 0
+        keys = [EVENT_KEY.format(n) for n in range(self._last_seen + 1, seq + 1)]
+        found = cache.get_many(keys)
+        self._last_seen = seq
+        self.hub.dispatch([found[key] for key in keys if key in found])
+        return len(found)
+
+    def _run(self):
+        while True:
+            time.sleep(self.poll_interval)
+            if not len(self.hub):
+                continue
+            try:
+                self.poll()
+            except Exception:
+                logger.exception('Error al leer el feed de cambios')
+
+
+hub = Hub()
+_broker = None
+_broker_path = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker, _broker_path
+    path = getattr(settings, 'CHANGEFEED_BROKER', 'myshop.changefeed.CacheBroker')
+    with _broker_lock:
+        if path != _broker_path:
+            _broker, _broker_path = import_string(path)(hub), path
+        return _broker
+
+
+def streaming_enabled():
+    """True si los eventos publicados llegan a todos los procesos."""
+    return get_broker().live
+
+
+def snapshot(product_ids):
+    """Estado actual (stock y precio) de los productos, en una consulta."""
+    # De la base principal: una réplica podría no tener aún la escritura
+    products = Product.objects.using(router.db_for_write(Product)).filter(pk__in=product_ids)
+    return [
+        {'id': product_id, 'stock': stock, 'price': str(price)}
+        for product_id, stock, price in products.values_list('id', 'stock', 'price')
+    ]
+
+
+def publish_products(product_ids):
+    """Publica el estado actual de los productos indicados (llamar tras el commit)."""
+    product_ids = list(product_ids)
+    if not product_ids:
+        return
+    try:
+        get_broker().publish(snapshot(product_ids))
+    except Exception:
+        # El feed es informativo: nunca debe romper un checkout
+        logger.exception('No se pudieron publicar cambios de productos')
+
+
+def subscribe(product_ids):
+    broker = get_broker()
+    broker.start()
+    return hub.subscribe(product_ids)
+
+
+def format_event(event):
+    return f'event: product\ndata: {json.dumps(event)}\n\n'
@@ -0,0 +1,93 @@
+"""Agrupación de clics repetidos en "Añadir al carrito".
+
+La primera petición de un usuario para un producto escribe en la base de
+datos y abre una ventana de `CART_ADD_COALESCE_WINDOW` segundos. Las
+peticiones idénticas dentro de esa ventana solo incrementan un contador en la
+caché; ese delta se aplica en una única escritura la próxima vez que se lee o
+modifica el carrito (`flush_pending_cart_adds`).
+
+Solo se activa con una caché compartida entre procesos (Redis): con la caché
+en memoria de cada worker, la siguiente petición del usuario puede caer en otro
+proceso que no ve los clics acumulados, y la caché local descarta entradas al
+llenarse. Por eso `CART_ADD_COALESCE_WINDOW` es 0 por defecto.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+
+from .cache import cache_is_shared
+from .models import CartItem
+
+KEY_PREFIX = 'shop:cartadd'
+# Un delta que nadie aplica (carrito vaciado por otra vía) no queda para siempre
+PENDING_TTL = 24 * 60 * 60
+
+
+def _pending_key(user_id, product_id):
+    return f'{KEY_PREFIX}:pending:{user_id}:{product_id}'
+
+
+def _window_key(user_id, product_id):
+    return f'{KEY_PREFIX}:window:{user_id}:{product_id}'
+
+
+def _count_key(user_id):
+    return f'{KEY_PREFIX}:count:{user_id}'
+
+
+def coalescing_window():
+    """Segundos de la ventana; 0 si la caché no es compartida entre procesos."""
+    if not cache_is_shared():
+        return 0
+    return getattr(settings, 'CART_ADD_COALESCE_WINDOW', 0)
+
+
+def coalesce_cart_add(user_id, product_id):
+    """Devuelve True si la petición quedó absorbida en el buffer de la caché."""
+    if not coalescing_window() or not cache.get(_window_key(user_id, product_id)):
+        return False
+    key = _pending_key(user_id, product_id)
+    if not cache.add(key, 1, PENDING_TTL):
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Expiró entre add() e incr(): escribir directamente en la base
+            return False
+    return True
+
+
+def open_cart_add_window(user_id, product_id, cart_items):
+    """Tras una escritura real, agrupar los clics idénticos de los próximos segundos."""
+    window = coalescing_window()
+    if window:
+        cache.set_many({_window_key(user_id, product_id): 1, _count_key(user_id): cart_items}, window)
+
+
+def buffered_cart_items(user_id):
+    """Total de unidades estimado para responder sin consultar la base."""
+    try:
+        return cache.incr(_count_key(user_id))
+    except ValueError:
+        return None
+
+
+def flush_pending_cart_adds(user_id):
+    """Aplica a la base los incrementos acumulados del usuario.
+
+    Solo se acumulan clics sobre productos que ya están en el carrito (el
+    primero abre la ventana tras crear la línea), así que basta con mirar las
+    claves de sus líneas. Si la línea desapareció (producto borrado o quitado
+    del carrito), su delta se descarta.
+    """
+    if not coalescing_window():
+        return
+    product_ids = list(CartItem.objects.filter(cart__user_id=user_id).values_list('product_id', flat=True))
+    keys = {_pending_key(user_id, product_id): product_id for product_id in product_ids}
+    for key, quantity in cache.get_many(list(keys)).items():
+        if not quantity:
+            continue
+        # decr en lugar de delete: no perder clics que lleguen mientras tanto
+        cache.decr(key, quantity)
+        CartItem.objects.filter(cart__user_id=user_id, product_id=keys[key]).update(
+            quantity=F('quantity') + quantity
+        )
@@ -0,0 +1,6 @@
+from django.conf import settings
+
+
+def assets(request):
+    """Indica a las plantillas si deben usar los bundles minificados."""
+    return {'use_asset_bundles': getattr(settings, 'ASSET_BUNDLES', False)}
@@ -0,0 +1,205 @@
+"""Feed de productos (CSV) y sitemap generados de forma incremental.
+
+Los productos se reparten en shards por rango de id (`FEEDS_SHARD_SIZE` ids
+por shard, como mucho 50 000: el límite de URLs por sitemap). El número de
+filas del CSV queda acotado por ese mismo tamaño de shard; el límite de 50 MiB
+sin comprimir solo existe para el sitemap, cuyas líneas tienen un tamaño fijo. Para cada shard
+se escriben, en streaming y con gzip, `sitemap-NNNN.xml.gz` y
+`feed-NNNN.csv.gz` en `FEEDS_DIR`, y `sitemap.xml` es el índice.
+
+`manifest.json` guarda por shard el número de productos, la suma de sus ids y
+el `updated_at` más reciente. En cada ejecución una sola consulta agrupada
+calcula esos valores y solo se reescriben los shards que cambiaron: altas,
+bajas o productos modificados. Los archivos conservan como fecha de
+modificación la del último cambio de sus productos, y `feed_file` la envía
+como `Last-Modified` sin tocar el ORM.
+"""
+import csv
+import gzip
+import json
+import mimetypes
+import os
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.db.models import Count, F, Max, Sum
+from django.http import FileResponse, Http404
+from django.views.decorators.http import condition
+
+from .models import Product
+
+MANIFEST = 'manifest.json'
+SITEMAP_INDEX = 'sitemap.xml'
+# Límites del protocolo de sitemaps para un archivo sin comprimir
+MAX_SITEMAP_BYTES = 50 * 1024 * 1024
+MAX_SITEMAP_URLS = 50000
+FEED_COLUMNS = ('id', 'title', 'description', 'link', 'image_link', 'price', 'availability', 'product_type')
+
+
+def feeds_dir():
+    return Path(getattr(settings, 'FEEDS_DIR', Path(settings.BASE_DIR) / 'feeds'))
+
+
+def _base_url():
+    return getattr(settings, 'SITE_URL', 'http://localhost:8000').rstrip('/')
+
+
+def shard_stats(shard_size):
+    """{shard: {'count', 'id_sum', 'updated_at'}} en una consulta agrupada."""
+    rows = (
+        Product.objects.order_by()
+        .annotate(shard=F('id') / shard_size).values('shard')
+        .annotate(count=Count('id'), id_sum=Sum('id'), updated_at=Max('updated_at'))
+    )
+    return {
+        row['shard']: {'count': row['count'], 'id_sum': row['id_sum'], 'updated_at': row['updated_at'].isoformat()}
+        for row in rows
+    }
+
+
+class _ShardFile:
+    """Archivo de texto con gzip; con `max_bytes`, controla el tamaño sin comprimir."""
+
+    def __init__(self, path, max_bytes=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.partial = path.with_name(path.name + '.part')
+        self._raw = open(self.partial, 'wb')
+        # mtime=0: el mismo contenido produce exactamente los mismos bytes
+        self._gzip = gzip.GzipFile(fileobj=self._raw, mode='wb', mtime=0)
+        self.size = 0
+
+    def write(self, text):
+        data = text.encode('utf-8')
+        self.size += len(data)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            raise ValueError(f'{self.path.name} supera los 50 MiB: reduce FEEDS_SHARD_SIZE')
+        self._gzip.write(data)
+
+    def close(self):
+        self._gzip.close()
+        self._raw.close()
+
+    def discard(self):
+        """Cierra y borra el temporal: el archivo publicado anterior sigue en su sitio."""
+        self.close()
+        self.partial.unlink(missing_ok=True)
+
+    def publish(self, modified):
+        """Fija la fecha de modificación al último cambio y sustituye el archivo."""
+        timestamp = modified.timestamp()
+        os.utime(self.partial, (timestamp, timestamp))
+        self.partial.replace(self.path)
+
+
+def _write_shard(directory, shard, shard_size, modified):
+    """Reescribe el sitemap y el feed CSV de un shard recorriendo sus productos una vez."""
+    base = _base_url()
+    currency = getattr(settings, 'FEEDS_CURRENCY', 'USD')
+    products = (
+        Product.objects.filter(id__gte=shard * shard_size, id__lt=(shard + 1) * shard_size)
+        .order_by('id')
+        .values_list('id', 'name', 'description', 'price', 'stock', 'category', 'image_url', 'updated_at')
+    )
+    sitemap = _ShardFile(directory / f'sitemap-{shard:04d}.xml.gz', max_bytes=MAX_SITEMAP_BYTES)
+    feed = _ShardFile(directory / f'feed-{shard:04d}.csv.gz')
+    # Si algo falla no quedan .part a medio escribir
+    try:
+        writer = csv.writer(feed)
+        writer.writerow(FEED_COLUMNS)
+        sitemap.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                      '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+        for product_id, name, description, price, stock, category, image_url, updated_at in products.iterator(chunk_size=2000):
+            link = base + Product.url_for(product_id)
+            sitemap.write(f'<url><loc>{escape(link)}</loc><lastmod>{updated_at.date().isoformat()}</lastmod></url>\n')
+            writer.writerow((
+                product_id, name, description, link, image_url, f'{price} {currency}',
+                'in stock' if stock > 0 else 'out of stock', category,
+            ))
+        sitemap.write('</urlset>\n')
+    except BaseException:
+        sitemap.discard()
+        feed.discard()
+        raise
+    sitemap.close()
+    feed.close()
+    sitemap.publish(modified)
+    feed.publish(modified)
+
+
+def _write_index(directory, manifest):
+    base = _base_url()
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>',
+             '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">']
+    for shard, stats in sorted(manifest['shards'].items(), key=lambda item: int(item[0])):
+        lines.append(f'<sitemap><loc>{escape(base)}/sitemap-{int(shard):04d}.xml.gz</loc>'
+                     f'<lastmod>{stats["updated_at"]}</lastmod></sitemap>')
+    lines.append('</sitemapindex>\n')
+    partial = directory / f'{SITEMAP_INDEX}.part'
+    partial.write_text('\n'.join(lines), encoding='utf-8')
+    partial.replace(directory / SITEMAP_INDEX)
+
+
+def build_feeds(full=False):
+    """Regenera los shards que cambiaron. Devuelve (reescritos, sin cambios, eliminados)."""
+    directory = feeds_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    shard_size = min(getattr(settings, 'FEEDS_SHARD_SIZE', 10000), MAX_SITEMAP_URLS)
+    manifest_path = directory / MANIFEST
+    try:
+        previous = json.loads(manifest_path.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        previous = {}
+    if previous.get('shard_size') != shard_size or previous.get('base_url') != _base_url():
+        full = True
+    old_shards = {} if full else previous.get('shards', {})
+
+    current = shard_stats(shard_size)
+    rewritten, unchanged = [], []
+    for shard, stats in sorted(current.items()):
+        files_exist = all((directory / name).is_file()
+                          for name in (f'sitemap-{shard:04d}.xml.gz', f'feed-{shard:04d}.csv.gz'))
+        if old_shards.get(str(shard)) == stats and files_exist:
+            unchanged.append(shard)
+            continue
+        _write_shard(directory, shard, shard_size, datetime.fromisoformat(stats['updated_at']))
+        rewritten.append(shard)
+
+    removed = [int(shard) for shard in previous.get('shards', {}) if int(shard) not in current]
+    for shard in removed:
+        for name in (f'sitemap-{shard:04d}.xml.gz', f'feed-{shard:04d}.csv.gz'):
+            (directory / name).unlink(missing_ok=True)
+
+    manifest = {
+        'shard_size': shard_size,
+        'base_url': _base_url(),
+        'shards': {str(shard): stats for shard, stats in current.items()},
+    }
+    if rewritten or removed or not (directory / SITEMAP_INDEX).is_file():
+        _write_index(directory, manifest)
+    manifest_path.write_text(json.dumps(manifest, indent=1), encoding='utf-8')
+    return rewritten, unchanged, removed
+
+
+def _last_modified(request, filename):
+    try:
+        return datetime.fromtimestamp((feeds_dir() / filename).stat().st_mtime, tz=dt_timezone.utc)
+    except OSError:
+        return None
+
+
+@condition(last_modified_func=_last_modified)
+def feed_file(request, filename):
+    """Sirve un archivo de FEEDS_DIR (las URLs solo admiten nombres generados)."""
+    path = feeds_dir() / filename
+    if not path.is_file():
+        raise Http404
+    if filename.endswith('.gz'):
+        content_type = 'application/gzip'
+    else:
+        content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    response = FileResponse(path.open('rb'), content_type=content_type)
+    response['Cache-Control'] = f'public, max-age={getattr(settings, "FEEDS_MAX_AGE", 3600)}'
+    return response
@@ -0,0 +1,110 @@
+"""Movimientos de inventario sobre el libro mayor `StockMovement`.
+
+Todas las variaciones de stock pasan por `record_movements`: inserta los
+movimientos con `bulk_create` y aplica el delta a `Product.stock` con un
+UPDATE atómico (`stock = stock + delta`) que solo toca esa columna. Las
+ventas usan además un UPDATE condicional (`WHERE stock >= cantidad`): si otra
+compra se llevó las unidades entre la comprobación y la escritura, no se
+actualiza ninguna fila y se lanza `InsufficientStock`, que deshace la
+transacción en lugar de dejar el stock en negativo.
+
+Las cancelaciones devuelven el stock desde la señal `post_save` de `Order`.
+`Order.objects.filter(...).update(status='cancelled')` no emite señales y, por
+tanto, no devuelve nada: las cancelaciones masivas pasan por `cancel_orders`.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Now
+
+from . import changefeed
+from .cache import bump_catalog_generation
+from .models import Product, StockMovement
+
+
+class InsufficientStock(Exception):
+    """Una salida dejaría el stock de un producto en negativo."""
+
+    def __init__(self, product_id):
+        super().__init__(product_id)
+        self.product_id = product_id
+
+
+def record_movements(movements, allow_negative=True):
+    """Registra los movimientos y actualiza el saldo cacheado de cada producto.
+
+    Con `allow_negative=False`, una salida mayor que el stock actual lanza
+    `InsufficientStock` (y no se registra nada).
+    """
+    movements = [movement for movement in movements if movement.quantity]
+    if not movements:
+        return []
+
+    deltas = defaultdict(int)
+    for movement in movements:
+        deltas[movement.product_id] += movement.quantity
+
+    with transaction.atomic():
+        created = StockMovement.objects.bulk_create(movements)
+        # Siempre en el mismo orden, para que dos compras no se bloqueen mutuamente
+        for product_id, delta in sorted(deltas.items()):
+            products = Product.objects.filter(pk=product_id)
+            if delta < 0 and not allow_negative:
+                products = products.filter(stock__gte=-delta)
+            if not products.update(stock=F('stock') + delta, updated_at=Now()):
+                if delta < 0 and not allow_negative:
+                    raise InsufficientStock(product_id)
+
+    # `update()` no emite señales: invalidar las páginas que muestran el stock
+    # y avisar a las páginas abiertas
+    transaction.on_commit(bump_catalog_generation)
+    transaction.on_commit(lambda: changefeed.publish_products(deltas))
+    return created
+
+
+def record_sale(order, items):
+    """Salida de stock por las líneas (`OrderItem`) de un pedido."""
+    return record_movements(
+        [StockMovement(product_id=item.product_id, kind='sale', quantity=-item.quantity, order=order)
+         for item in items],
+        allow_negative=False,
+    )
+
+
+def return_order_stock(order):
+    """Devuelve al stock lo vendido en un pedido cancelado (una sola vez)."""
+    with transaction.atomic():
+        if StockMovement.objects.filter(order=order, kind='return').exists():
+            return []
+        return record_movements(
+            StockMovement(product_id=item.product_id, kind='return', quantity=item.quantity, order=order)
+            for item in order.items.all()
+        )
+
+
+def cancel_orders(orders):
+    """Cancela los pedidos uno a uno para que cada uno devuelva su stock.
+
+    Devuelve el número de pedidos cancelados.
+    """
+    cancelled = 0
+    with transaction.atomic():
+        for order in orders.exclude(status='cancelled').select_for_update():
+            order.status = 'cancelled'
+            order.save(update_fields=['status', 'updated_at'])
+            cancelled += 1
+    return cancelled
+
+
+def adjust_stock(product, delta, kind='adjustment', note=''):
+    """Ajuste manual (admin) o reposición de un producto."""
+    return record_movements([StockMovement(product=product, kind=kind, quantity=delta, note=note)])
+
+
+def ledger_totals():
+    """Saldo de cada producto según el libro mayor, en una sola consulta agrupada."""
+    return dict(
+        StockMovement.objects.order_by().values('product')
+        .annotate(total=Sum('quantity')).values_list('product', 'total')
+    )
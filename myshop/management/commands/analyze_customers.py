@@ -0,0 +1,38 @@
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+
+from myshop import analytics
+
+
+class Command(BaseCommand):
+    help = 'Calcula los segmentos RFM de clientes y la retención por cohortes (requiere pandas).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=50000, help='Pedidos leídos por bloque.')
+
+    def handle(self, *args, **options):
+        try:
+            analytics._require_pandas()
+        except ImportError as exc:
+            raise CommandError(str(exc))
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        segments, cohorts, orders = analytics.compute(chunk_size=options['chunk_size'])
+        analytics.save(segments, cohorts)
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        tracemalloc.stop()
+
+        if segments is None:
+            self.stdout.write(self.style.WARNING('No hay pedidos que analizar.'))
+            return
+        counts = segments['segment'].value_counts()
+        for segment, label in analytics.CustomerSegment.SEGMENT_CHOICES:
+            self.stdout.write(f'  {label:<14} {counts.get(segment, 0):>8}')
+        self.stdout.write(self.style.SUCCESS(
+            f'{orders} pedido(s), {len(segments)} cliente(s), {cohorts["cohort"].nunique()} cohorte(s) '
+            f'en {elapsed:.2f} s (pico de memoria {peak:.1f} MiB).'
+        ))
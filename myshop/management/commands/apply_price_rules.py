@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from myshop import pricing
+from myshop.models import PriceRule
+
+
+class Command(BaseCommand):
+    help = ('Aplica las reglas de precios cuyo inicio ha llegado y revierte las que han terminado '
+            '(programar cada pocos minutos).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Solo muestra lo que haría.')
+        parser.add_argument('--revert', type=int, metavar='RULE_ID', help='Revierte ahora una regla aplicada.')
+
+    def handle(self, *args, **options):
+        if options['revert'] is not None:
+            try:
+                rule = PriceRule.objects.get(pk=options['revert'])
+            except PriceRule.DoesNotExist:
+                raise CommandError(f'No existe la regla {options["revert"]}.')
+            if not rule.applied_at or rule.reverted_at:
+                raise CommandError(f'La regla "{rule}" no está aplicada.')
+            if not options['dry_run']:
+                restored, skipped = pricing.revert_rule(rule)
+                self._report(rule, 'revert', restored, skipped)
+            return
+
+        if options['dry_run']:
+            to_apply, to_revert = pricing.due_rules(timezone.now())
+            for rule in to_revert:
+                self.stdout.write(f'Revertiría "{rule}" ({rule.history.count()} productos)')
+            for rule in to_apply:
+                self.stdout.write(f'Aplicaría "{rule}" a {pricing.rule_products(rule).count()} productos')
+            return
+
+        results = pricing.run_schedule()
+        for result in results:
+            self._report(*result)
+        if not results:
+            self.stdout.write('No hay reglas pendientes.')
+
+    def _report(self, rule, action, changed, skipped):
+        if action == 'apply':
+            self.stdout.write(self.style.SUCCESS(f'Aplicada "{rule}": {changed} productos'))
+        else:
+            message = f'Revertida "{rule}": {changed} productos'
+            if skipped:
+                message += f' ({skipped} conservan un precio cambiado después)'
+            self.stdout.write(self.style.SUCCESS(message))
@@ -0,0 +1,40 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from myshop.archive import ARCHIVABLE_STATUSES, archive_orders
+from myshop.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Mueve los pedidos entregados/cancelados antiguos a ArchivedOrder, por lotes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before-days', type=int, default=365,
+                            help='Archivar pedidos creados hace más de N días (por defecto 365).')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--status', action='append', choices=ARCHIVABLE_STATUSES,
+                            help='Estados a archivar (repetible). Por defecto: delivered y cancelled.')
+        parser.add_argument('--dry-run', action='store_true', help='Solo contar los pedidos candidatos.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size debe ser mayor que 0.')
+        before = timezone.now() - timedelta(days=options['before_days'])
+        statuses = options['status'] or ARCHIVABLE_STATUSES
+
+        if options['dry_run']:
+            count = Order.objects.filter(status__in=statuses, created_at__lt=before).count()
+            self.stdout.write(f'{count} pedido(s) anteriores a {before:%Y-%m-%d} se archivarían.')
+            return
+
+        orders = raw = compressed = 0
+        for batch_orders, batch_raw, batch_compressed in archive_orders(before, statuses, options['batch_size']):
+            orders += batch_orders
+            raw += batch_raw
+            compressed += batch_compressed
+            self.stdout.write(f'  lote de {batch_orders} pedido(s) archivado')
+
+        ratio = f' (JSON {raw / 1024:.1f} KiB -> {compressed / 1024:.1f} KiB)' if orders else ''
+        self.stdout.write(self.style.SUCCESS(f'{orders} pedido(s) archivados{ratio}.'))
@@ -0,0 +1,81 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils import timezone
+
+from myshop import backup
+
+
+class Command(BaseCommand):
+    help = ('Copia en caliente de la base SQLite (API de backup por pasos), verificada con '
+            'PRAGMA integrity_check, comprimida y con retención de copias antiguas.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+        parser.add_argument('--source', help='Archivo SQLite a copiar (por defecto, el de --database).')
+        parser.add_argument('--output-dir', default=None,
+                            help='Directorio de las copias (por defecto settings.BACKUP_DIR).')
+        parser.add_argument('--pages', type=int, default=256, help='Páginas copiadas por paso.')
+        parser.add_argument('--sleep', type=float, default=0.05, help='Pausa entre pasos, en segundos.')
+        parser.add_argument('--max-restarts', type=int, default=3,
+                            help='Reinicios tolerados (modo rollback journal) antes de copiar el resto de una vez.')
+        parser.add_argument('--keep', type=int, default=getattr(settings, 'BACKUP_KEEP', 14),
+                            help='Copias a conservar; 0 para no borrar ninguna.')
+        parser.add_argument('--no-compress', action='store_true')
+        parser.add_argument('--no-probe', action='store_true', help='No medir la espera de los escritores.')
+
+    def handle(self, *args, **options):
+        source = options['source']
+        if source is None:
+            db = connections[options['database']].settings_dict
+            if db['ENGINE'] != 'django.db.backends.sqlite3':
+                raise CommandError('backup_db solo sirve para SQLite; use las herramientas del motor (p. ej. pg_dump).')
+            source = db['NAME']
+        source = Path(source)
+        if not source.is_file():
+            raise CommandError(f'No existe la base {source}.')
+        if options['pages'] < 1:
+            raise CommandError('--pages debe ser mayor que 0.')
+
+        output_dir = Path(options['output_dir'] or getattr(settings, 'BACKUP_DIR', Path(settings.BASE_DIR) / 'backups'))
+        output_dir.mkdir(parents=True, exist_ok=True)
+        name = f'{backup.SNAPSHOT_PREFIX}{timezone.now():%Y%m%d-%H%M%S}.sqlite3'
+        partial = output_dir / f'{name}.part'
+
+        try:
+            result = backup.online_backup(
+                source, partial, pages=options['pages'], sleep=options['sleep'],
+                probe=not options['no_probe'], max_restarts=options['max_restarts'],
+            )
+            check = backup.integrity_check(partial)
+            if check != 'ok':
+                raise CommandError(f'La copia no pasó PRAGMA integrity_check:\n{check}')
+            target = partial.replace(output_dir / name)
+            if not options['no_compress']:
+                target = backup.compress(target)
+        finally:
+            partial.unlink(missing_ok=True)
+
+        mib = result.size / 1024 / 1024
+        self.stdout.write(
+            f'{mib:.1f} MiB en {result.seconds:.2f} s ({result.throughput:.1f} MiB/s), '
+            f'{result.steps} paso(s), {result.restarts} reinicio(s), journal_mode={result.journal_mode}'
+        )
+        if result.forced:
+            self.stdout.write(self.style.WARNING(
+                'Demasiados reinicios por escrituras concurrentes: el resto se copió en un solo paso. '
+                'Con PRAGMA journal_mode=WAL la copia no se reinicia ni bloquea a los escritores.'
+            ))
+        if not options['no_probe']:
+            self.stdout.write(
+                f'Espera máxima de un escritor: {result.max_stall * 1000:.1f} ms '
+                f'({len(result.stalls)} sondeos; {result.contended} sin bloqueo en '
+                f'{backup.PROBE_TIMEOUT:g} s por otro escritor o la copia forzada)'
+            )
+        if options['keep']:
+            for path in backup.prune(output_dir, options['keep']):
+                self.stdout.write(f'  eliminada {path.name}')
+        size = target.stat().st_size / 1024 / 1024
+        self.stdout.write(self.style.SUCCESS(f'Copia verificada: {target} ({size:.1f} MiB)'))
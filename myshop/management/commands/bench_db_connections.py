@@ -0,0 +1,95 @@
+import statistics
+import time
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.core.signals import request_finished, request_started
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+
+from myshop.models import Product
+
+MODES = ('per-request', 'persistent', 'pool')
+
+
+class Command(BaseCommand):
+    help = ('Mide el coste de conexión por petición: una consulta barata (como la de add_to_cart) '
+            'entre las señales de inicio y fin de petición, con conexión nueva en cada petición, '
+            'con conexiones persistentes (CONN_MAX_AGE) y con el pool de psycopg.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+        parser.add_argument('--mode', choices=MODES, action='append',
+                            help='Modo a medir (repetible); por defecto todos los disponibles.')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        modes = options['mode'] or [
+            mode for mode in MODES if mode != 'pool' or connection.vendor == 'postgresql'
+        ]
+        if 'pool' in modes:
+            if connection.vendor != 'postgresql':
+                raise CommandError('El pool solo existe para PostgreSQL (psycopg 3).')
+            try:
+                import psycopg_pool  # noqa: F401
+            except ImportError:
+                raise CommandError('El modo pool necesita psycopg[pool].')
+
+        original = {
+            'CONN_MAX_AGE': connection.settings_dict['CONN_MAX_AGE'],
+            'OPTIONS': dict(connection.settings_dict['OPTIONS']),
+        }
+        product_id = Product.objects.using(options['database']).values_list('id', flat=True).first() or 0
+        self.stdout.write(f'{options["requests"]} peticiones contra {connection.vendor} ({connection.settings_dict["NAME"]}):')
+        try:
+            for mode in modes:
+                self._configure(connection, mode, original)
+                self._run(connection, mode, options['requests'], product_id, options['database'])
+        finally:
+            self._configure(connection, None, original)
+
+    def _configure(self, connection, mode, original):
+        connection.close()
+        if connection.vendor == 'postgresql' and connection.settings_dict['OPTIONS'].get('pool'):
+            connection.close_pool()
+        options = dict(original['OPTIONS'])
+        options.pop('pool', None)
+        if mode is None:
+            options, max_age = original['OPTIONS'], original['CONN_MAX_AGE']
+        elif mode == 'per-request':
+            max_age = 0
+        elif mode == 'persistent':
+            max_age = 600
+        else:
+            options['pool'] = {'min_size': 1, 'max_size': 2}
+            max_age = 0
+        connection.settings_dict['OPTIONS'] = options
+        connection.settings_dict['CONN_MAX_AGE'] = max_age
+
+    def _run(self, connection, mode, count, product_id, using):
+        opened = 0
+
+        def on_connect(sender, connection, **kwargs):
+            nonlocal opened
+            opened += 1
+
+        connection_created.connect(on_connect)
+        timings = []
+        try:
+            for _ in range(count):
+                started = time.perf_counter()
+                # Lo mismo que hace el handler de Django alrededor de cada vista:
+                # close_old_connections() al empezar y al terminar
+                request_started.send(sender=WSGIHandler)
+                Product.objects.using(using).filter(pk=product_id).values_list('stock', flat=True).first()
+                request_finished.send(sender=WSGIHandler)
+                timings.append((time.perf_counter() - started) * 1000)
+        finally:
+            connection_created.disconnect(on_connect)
+        timings.sort()
+        p95 = timings[int(len(timings) * 0.95) - 1]
+        self.stdout.write(
+            f'  {mode:<12} mediana {statistics.median(timings):7.3f} ms  p95 {p95:7.3f} ms  '
+            f'{opened:5d} conexiones abiertas'
+        )
@@ -0,0 +1,64 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from myshop.models import Product
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Prueba de carga: ráfaga de logins y de "Añadir al carrito" con y sin limitación.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--burst', type=int, default=20, help='Peticiones por ráfaga.')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic(), override_settings(ALLOWED_HOSTS=['testserver']):
+                self._run(options['burst'])
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _run(self, burst):
+        user = get_user_model().objects.create_user(username='__bench_ratelimit__', password='correcta')
+        product = Product.objects.create(name='__bench__', price=10, stock=100)
+
+        self.stdout.write(f'Ráfaga de {burst} logins con contraseña incorrecta desde una IP:')
+        for label, limits in (('sin límite', {}), ('con límite', None)):
+            cache.clear()
+            overrides = {} if limits is None else {'RATE_LIMITS': limits}
+            with override_settings(**overrides):
+                client = Client()
+                cpu, wall = time.process_time(), time.perf_counter()
+                statuses = [
+                    client.post(reverse('myshop:login'), {'username': user.username, 'password': 'mala'}).status_code
+                    for _ in range(burst)
+                ]
+                cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+            self.stdout.write(
+                f'  {label:<12} CPU {cpu:7.2f} s  total {wall:7.2f} s  '
+                f'429: {statuses.count(429)}/{burst}'
+            )
+
+        self.stdout.write(f'Ráfaga de {burst} clics en "Añadir al carrito" del mismo producto:')
+        for label, window in (('sin agrupar', 0), ('agrupados', 2)):
+            cache.clear()
+            client = Client()
+            client.force_login(user)
+            url = reverse('myshop:add_to_cart', kwargs={'product_id': product.id})
+            with override_settings(CART_ADD_COALESCE_WINDOW=window, RATE_LIMITS={}), \
+                    CaptureQueriesContext(connection) as queries:
+                for _ in range(burst):
+                    client.post(url)
+            writes = sum(1 for q in queries.captured_queries if q['sql'].startswith(('INSERT', 'UPDATE')))
+            self.stdout.write(f'  {label:<12} consultas {len(queries):4d}  escrituras {writes:4d}')
@@ -0,0 +1,84 @@
+import gc
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+COLD_WORKER = r'''
+import gc, json, os
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'shopproject.settings')
+from shopproject.wsgi import application
+gc.collect()
+with open('/proc/self/smaps_rollup') as f:
+    print(f.read())
+'''
+
+
+def parse_smaps(text):
+    """RSS y memoria privada (USS) en KiB a partir de /proc/<pid>/smaps_rollup."""
+    values = {}
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) >= 2 and parts[0].endswith(':') and parts[1].isdigit():
+            values[parts[0][:-1]] = int(parts[1])
+    return values.get('Rss', 0), values.get('Private_Clean', 0) + values.get('Private_Dirty', 0)
+
+
+class Command(BaseCommand):
+    help = ('Benchmark de arranque de workers: proceso nuevo (sin --preload) frente a fork '
+            'de un maestro con la aplicación precargada, con y sin gc.freeze().')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5)
+
+    def handle(self, *args, **options):
+        if not os.path.exists('/proc/self/smaps_rollup'):
+            raise CommandError('Este benchmark necesita Linux (/proc/self/smaps_rollup).')
+        runs = options['runs']
+
+        cold = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            result = subprocess.run([sys.executable, '-c', COLD_WORKER], capture_output=True, text=True, check=True)
+            cold.append((time.perf_counter() - start, *parse_smaps(result.stdout)))
+
+        # Maestro con la aplicación precargada (equivalente a preload_app = True)
+        from shopproject.wsgi import application  # noqa: F401
+        preload = [self._fork_worker(freeze=False) for _ in range(runs)]
+        frozen = [self._fork_worker(freeze=True) for _ in range(runs)]
+
+        self.stdout.write(f'{"worker":<32}{"listo en":>12}{"RSS":>12}{"privada":>12}')
+        for label, samples in (
+            ('proceso nuevo (sin preload)', cold),
+            ('fork con preload', preload),
+            ('fork con preload + gc.freeze', frozen),
+        ):
+            ready, rss, private = (statistics.median(column) for column in zip(*samples))
+            self.stdout.write(f'{label:<32}{ready * 1000:>9.1f} ms{rss / 1024:>8.1f} MiB{private / 1024:>8.1f} MiB')
+
+    def _fork_worker(self, freeze):
+        if freeze:
+            gc.freeze()
+        read_fd, write_fd = os.pipe()
+        start = time.perf_counter()
+        pid = os.fork()
+        if pid == 0:
+            # Worker: la primera recolección de basura es la que más páginas
+            # compartidas ensucia si los objetos no están congelados
+            os.close(read_fd)
+            gc.collect()
+            with open('/proc/self/smaps_rollup') as f:
+                rss, private = parse_smaps(f.read())
+            os.write(write_fd, json.dumps([time.perf_counter() - start, rss, private]).encode())
+            os._exit(0)
+        os.close(write_fd)
+        with os.fdopen(read_fd) as pipe:
+            sample = json.loads(pipe.read())
+        os.waitpid(pid, 0)
+        if freeze:
+            gc.unfreeze()
+        return sample
@@ -0,0 +1,84 @@
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.template import engines
+from django.template.loader import render_to_string
+from django.test import RequestFactory
+
+from myshop.models import Product, Cart, CartItem, Order, OrderItem
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Mide el tiempo de render de cada página (primer render y renders en caliente).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--products', type=int, default=12)
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        loaders = engines['django'].engine.loaders
+        self.stdout.write(f'Loaders: {loaders}')
+
+        # Los datos de ejemplo se crean dentro de una transacción que se revierte
+        try:
+            with transaction.atomic():
+                self._run(iterations, options['products'])
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _run(self, iterations, product_count):
+        user = get_user_model().objects.create_user(username='__bench_templates__', password='x')
+        products = [
+            Product.objects.create(name=f'Figura {i}', price=10 + i, stock=5, description='Pieza impresa ' * 10)
+            for i in range(product_count)
+        ]
+        cart = Cart.objects.create(user=user)
+        for product in products[:3]:
+            CartItem.objects.create(cart=cart, product=product, quantity=2)
+        order = Order.objects.create(user=user, total=60, shipping_address='Calle 1', phone='555')
+        for product in products[:3]:
+            OrderItem.objects.create(order=order, product=product, quantity=2, price=product.price)
+
+        factory = RequestFactory()
+        anonymous = factory.get('/')
+        anonymous.user = AnonymousUser()
+        authenticated = factory.get('/')
+        authenticated.user = user
+
+        pages = [
+            ('index.html', anonymous, {'products': Paginator(Product.objects.all(), 12).get_page(1), 'sort': '-created_at'}),
+            ('product_detail.html', anonymous, {'product': products[0], 'reviews': []}),
+            ('cart.html', authenticated, {'cart': cart}),
+            ('checkout.html', authenticated, {'cart': cart}),
+            ('orders.html', authenticated, {'orders': [order]}),
+            ('order_detail.html', authenticated, {'order': order}),
+        ]
+
+        self.stdout.write(f'{"plantilla":<22}{"primer render":>16}{"media":>12}{"p95":>12}')
+        for template_name, request, context in pages:
+            start = time.perf_counter()
+            render_to_string(template_name, context, request)
+            first = time.perf_counter() - start
+
+            samples = []
+            for _ in range(iterations):
+                start = time.perf_counter()
+                render_to_string(template_name, context, request)
+                samples.append(time.perf_counter() - start)
+            samples.sort()
+            p95 = samples[int(len(samples) * 0.95) - 1]
+            self.stdout.write(
+                f'{template_name:<22}{first * 1000:>13.2f} ms'
+                f'{statistics.mean(samples) * 1000:>9.2f} ms{p95 * 1000:>9.2f} ms'
+            )
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from myshop.assets import build_bundles
+
+
+class Command(BaseCommand):
+    help = 'Concatena y minifica el CSS/JS compartido en static/dist/ (ejecutar antes de collectstatic).'
+
+    def handle(self, *args, **options):
+        for bundle, original, minified in build_bundles():
+            self.stdout.write(f'{bundle}: {original} -> {minified} bytes')
+        self.stdout.write(self.style.SUCCESS(
+            'Bundles generados. Ejecuta `python manage.py collectstatic --noinput` '
+            'para añadir el hash y las versiones .gz/.br.'
+        ))
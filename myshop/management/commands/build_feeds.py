@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from myshop.feeds import build_feeds, feeds_dir
+
+
+class Command(BaseCommand):
+    help = ('Genera sitemap.xml y el feed CSV de productos en shards con gzip, '
+            'reescribiendo solo los shards con productos modificados.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Reescribir todos los shards.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        rewritten, unchanged, removed = build_feeds(full=options['full'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(rewritten)} shard(s) reescritos, {len(unchanged)} sin cambios, '
+            f'{len(removed)} eliminados en {elapsed:.2f} s ({feeds_dir()}).'
+        ))
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from myshop import profiling
+
+
+class Command(BaseCommand):
+    help = 'Genera un token firmado para perfilar peticiones con la cabecera X-Profile.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=profiling.MODES, default='sample')
+
+    def handle(self, *args, **options):
+        token = profiling.make_token(options['mode'])
+        max_age = getattr(settings, 'PROFILING_TOKEN_MAX_AGE', 3600)
+        self.stdout.write(token)
+        self.stderr.write(f'Válido durante {max_age} s. Uso: curl -H "X-Profile: {token}" <url>')
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from myshop.cache import bump_catalog_generation
+from myshop.inventory import ledger_totals
+from myshop.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Recalcula Product.stock a partir del libro mayor de movimientos de stock.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Solo informar las diferencias.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            totals = ledger_totals()
+            mismatched = [
+                (product_id, stock, totals.get(product_id, 0))
+                for product_id, stock in Product.objects.values_list('id', 'stock').iterator()
+                if stock != totals.get(product_id, 0)
+            ]
+            for product_id, stock, expected in mismatched:
+                self.stdout.write(f'Producto {product_id}: stock {stock} -> libro mayor {expected}')
+                if not options['dry_run']:
+                    Product.objects.filter(pk=product_id).update(stock=expected, updated_at=timezone.now())
+            if mismatched and not options['dry_run']:
+                transaction.on_commit(bump_catalog_generation)
+
+        self.stdout.write(self.style.SUCCESS(f'{len(mismatched)} producto(s) con diferencias.'))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from myshop.archive import restore_order
+from myshop.models import ArchivedOrder
+
+
+class Command(BaseCommand):
+    help = 'Devuelve pedidos archivados a las tablas Order/OrderItem.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('order_ids', nargs='*', type=int, help='Ids de los pedidos a restaurar.')
+        parser.add_argument('--user', help='Restaurar todos los pedidos archivados de este usuario.')
+
+    def handle(self, *args, **options):
+        if not options['order_ids'] and not options['user']:
+            raise CommandError('Indica ids de pedido o --user.')
+        archived = ArchivedOrder.objects.all()
+        if options['order_ids']:
+            archived = archived.filter(pk__in=options['order_ids'])
+        if options['user']:
+            archived = archived.filter(user__username=options['user'])
+
+        restored = failed = 0
+        for order in archived.iterator(chunk_size=200):
+            try:
+                restore_order(order)
+            except IntegrityError as exc:
+                # Producto borrado o id ocupado: se deja en el archivo
+                failed += 1
+                self.stderr.write(f'Pedido {order.id}: no se pudo restaurar ({exc}).')
+            else:
+                restored += 1
+
+        self.stdout.write(self.style.SUCCESS(f'{restored} pedido(s) restaurados, {failed} con errores.'))
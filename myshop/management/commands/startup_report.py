@@ -0,0 +1,92 @@
+import json
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+
+# Se ejecuta en procesos nuevos (uno con -X importtime y otro con
+# -X tracemalloc, para que el trazado de memoria no distorsione los tiempos):
+# mide el arranque real de un worker (django.setup() + aplicación WSGI).
+PROBE = r'''
+import json, os, sys, tracemalloc
+DEPTH = int(os.environ['STARTUP_REPORT_DEPTH'])
+
+def rss_kib():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+before = rss_kib()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'shopproject.settings')
+from django.core.wsgi import get_wsgi_application
+get_wsgi_application()
+after = rss_kib()
+
+roots = sorted((os.path.abspath(p) for p in sys.path if p), key=len, reverse=True)
+memory = {}
+stats = tracemalloc.take_snapshot().statistics('filename') if tracemalloc.is_tracing() else []
+for stat in stats:
+    filename = stat.traceback[0].filename
+    for root in roots:
+        if filename.startswith(root + os.sep):
+            parts = filename[len(root) + 1:].split(os.sep)[:DEPTH]
+            parts[-1] = parts[-1][:-3] if parts[-1].endswith('.py') else parts[-1]
+            package = '.'.join(p for p in parts if p != '__init__')
+            break
+    else:
+        package = '<otros>'
+    memory[package] = memory.get(package, 0) + stat.size
+print(json.dumps({'rss_before': before, 'rss_after': after, 'memory': memory}))
+'''
+
+IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+)\s+\|\s+\d+\s+\|\s*(\S+)$')
+
+
+class Command(BaseCommand):
+    help = ('Informe de arranque de un worker: coste acumulado de importación (-X importtime) '
+            'y memoria asignada por paquete al cargar Django y la aplicación.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=20, help='Número de módulos a mostrar.')
+        parser.add_argument('--depth', type=int, default=2,
+                            help='Componentes del nombre por los que agrupar (django.contrib = 2).')
+
+    def _probe(self, flag, depth):
+        env = dict(os.environ, STARTUP_REPORT_DEPTH=str(depth))
+        result = subprocess.run(
+            [sys.executable, '-X', flag, '-c', PROBE], capture_output=True, text=True, env=env,
+        )
+        if result.returncode != 0:
+            raise CommandError(result.stderr[-2000:])
+        return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+    def handle(self, *args, **options):
+        depth = options['depth']
+        timing, importtime = self._probe('importtime', depth)
+        allocations, _ = self._probe('tracemalloc', depth)
+
+        # La suma del tiempo propio de todos los submódulos de un grupo es su
+        # coste acumulado real (sin contar dos veces los imports anidados)
+        cost = defaultdict(int)
+        for line in importtime.splitlines():
+            match = IMPORTTIME_RE.match(line)
+            if match:
+                cost['.'.join(match.group(2).split('.')[:depth])] += int(match.group(1))
+
+        memory = allocations['memory']
+        modules = sorted(set(cost) | set(memory), key=lambda m: cost.get(m, 0), reverse=True)
+        self.stdout.write(f'{"módulo":<36}{"importación":>14}{"memoria":>14}')
+        for module in modules[:options['top']]:
+            self.stdout.write(
+                f'{module:<36}{cost.get(module, 0) / 1000:>11.1f} ms'
+                f'{memory.get(module, 0) / 1024:>10.0f} KiB'
+            )
+        self.stdout.write(
+            f'\nTotal importación: {sum(cost.values()) / 1000:.1f} ms  '
+            f'RSS del proceso: {timing["rss_before"] / 1024:.1f} -> {timing["rss_after"] / 1024:.1f} MiB'
+        )
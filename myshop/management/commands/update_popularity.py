@@ -0,0 +1,46 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, FloatField, Sum
+from django.utils import timezone
+
+from myshop import popularity
+from myshop.models import OrderItem, Product
+
+
+class Command(BaseCommand):
+    help = ('Aplica el decaimiento a Product.popularity y suma las ventas del último intervalo. '
+            'Programarlo cada --interval-hours (p. ej. con cron).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval-hours', type=float, default=24,
+                            help='Horas desde la ejecución anterior (ventana de ventas y decaimiento).')
+
+    def handle(self, *args, **options):
+        interval = timedelta(hours=options['interval_hours'])
+        half_life = timedelta(days=getattr(settings, 'POPULARITY_HALF_LIFE_DAYS', 7))
+        decay = 0.5 ** (interval / half_life)
+        sale_weight = popularity.weights()['sale']
+
+        # Eventos pendientes de este proceso (normalmente ninguno)
+        popularity.flush()
+
+        sales = dict(
+            OrderItem.objects.filter(order__created_at__gte=timezone.now() - interval)
+            .exclude(order__status='cancelled')
+            .order_by().values('product').annotate(quantity=Sum('quantity'))
+            .values_list('product', 'quantity')
+        )
+        with transaction.atomic():
+            Product.objects.update(popularity=F('popularity') * decay)
+            if sales:
+                scores = {pk: quantity * sale_weight for pk, quantity in sales.items()}
+                Product.objects.filter(pk__in=sales).update(
+                    popularity=F('popularity') + popularity.case_by_id(scores, FloatField())
+                )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Decaimiento x{decay:.4f} aplicado; ventas recientes de {len(sales)} producto(s) sumadas.'
+        ))
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.6 on 2026-10-19 13:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_opening_balances(apps, schema_editor):
+    # El stock existente pasa a ser el saldo inicial del libro mayor
+    Product = apps.get_model('myshop', 'Product')
+    StockMovement = apps.get_model('myshop', 'StockMovement')
+    StockMovement.objects.bulk_create(
+        StockMovement(product_id=product_id, kind='adjustment', quantity=stock, note='Saldo inicial')
+        for product_id, stock in Product.objects.exclude(stock=0).values_list('id', 'stock')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myshop', '0002_product_average_rating_product_category_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('sale', 'Venta'), ('restock', 'Reposición'), ('adjustment', 'Ajuste'), ('return', 'Devolución por cancelación')], max_length=20)),
+                ('quantity', models.IntegerField(help_text='Delta con signo: negativo para salidas de stock')),
+                ('note', models.CharField(blank=True, max_length=200)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to='myshop.order')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='myshop.product')),
+            ],
+            options={
+                'verbose_name': 'Movimiento de stock',
+                'verbose_name_plural': 'Movimientos de stock',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['product', 'created_at'], name='myshop_stoc_product_887024_idx')],
+            },
+        ),
+        migrations.RunPython(create_opening_balances, migrations.RunPython.noop),
+    ]
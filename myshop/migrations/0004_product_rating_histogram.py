@@ -0,0 +1,51 @@
+# Generated by Django 5.2.6 on 2026-10-19 13:36
+
+from django.db import migrations, models
+
+
+def backfill_histogram(apps, schema_editor):
+    Product = apps.get_model('myshop', 'Product')
+    Review = apps.get_model('myshop', 'Review')
+    counts = {}
+    for product_id, rating, total in (
+        Review.objects.order_by().values_list('product', 'rating').annotate(total=models.Count('id'))
+    ):
+        counts.setdefault(product_id, {})[f'rating_{rating}_count'] = total
+    for product_id, fields in counts.items():
+        Product.objects.filter(pk=product_id).update(**fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myshop', '0003_stockmovement'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_1_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_2_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_3_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_4_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_5_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_histogram, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-19 13:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myshop', '0004_product_rating_histogram'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='cart_add_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='popularity',
+            field=models.FloatField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='view_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
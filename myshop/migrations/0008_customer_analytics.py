@@ -0,0 +1,56 @@
+# Generated by Django 5.2.6 on 2026-10-19 14:04
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myshop', '0007_product_updated_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CohortRetention',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cohort', models.DateField(help_text='Primer día del mes del primer pedido')),
+                ('months_since', models.PositiveSmallIntegerField()),
+                ('customers', models.PositiveIntegerField()),
+                ('retained', models.PositiveIntegerField()),
+                ('rate', models.FloatField()),
+                ('computed_at', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Retención por cohorte',
+                'verbose_name_plural': 'Retención por cohortes',
+                'ordering': ['cohort', 'months_since'],
+                'constraints': [models.UniqueConstraint(fields=('cohort', 'months_since'), name='unique_cohort_month')],
+            },
+        ),
+        migrations.CreateModel(
+            name='CustomerSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('segment', models.CharField(choices=[('champions', 'Campeones'), ('loyal', 'Leales'), ('new', 'Nuevos'), ('potential', 'Prometedores'), ('at_risk', 'En riesgo'), ('hibernating', 'Dormidos'), ('lost', 'Perdidos')], db_index=True, max_length=20)),
+                ('recency_days', models.PositiveIntegerField()),
+                ('frequency', models.PositiveIntegerField()),
+                ('monetary', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('r_score', models.PositiveSmallIntegerField()),
+                ('f_score', models.PositiveSmallIntegerField()),
+                ('m_score', models.PositiveSmallIntegerField()),
+                ('first_order_at', models.DateTimeField()),
+                ('last_order_at', models.DateTimeField()),
+                ('computed_at', models.DateTimeField()),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='segment', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Segmento de cliente',
+                'verbose_name_plural': 'Segmentos de clientes (RFM)',
+                'ordering': ['-monetary'],
+            },
+        ),
+    ]
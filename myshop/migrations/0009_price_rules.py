@@ -0,0 +1,51 @@
+# Generated by Django 5.2.6 on 2026-10-19 14:18
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myshop', '0008_customer_analytics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('kind', models.CharField(choices=[('percent', 'Porcentaje'), ('fixed', 'Importe fijo')], default='percent', max_length=10)),
+                ('value', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('category', models.CharField(blank=True, choices=[('figure', 'Figura'), ('spare', 'Repuesto'), ('custom', 'Personalizado')], max_length=20)),
+                ('name_contains', models.CharField(blank=True, max_length=100)),
+                ('starts_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('ends_at', models.DateTimeField(blank=True, help_text='Vacío: el cambio es permanente', null=True)),
+                ('applied_at', models.DateTimeField(blank=True, editable=False, null=True)),
+                ('reverted_at', models.DateTimeField(blank=True, editable=False, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Regla de precios',
+                'verbose_name_plural': 'Reglas de precios',
+                'ordering': ['-starts_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='PriceHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('old_price', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('new_price', models.DecimalField(decimal_places=2, max_digits=8, null=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='price_history', to='myshop.product')),
+                ('rule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='history', to='myshop.pricerule')),
+            ],
+            options={
+                'verbose_name': 'Histórico de precio',
+                'verbose_name_plural': 'Histórico de precios',
+                'constraints': [models.UniqueConstraint(fields=('rule', 'product'), name='unique_rule_product')],
+            },
+        ),
+    ]
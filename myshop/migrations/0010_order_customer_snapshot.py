@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_customer(apps, schema_editor):
+    # Los pedidos anteriores toman los datos actuales del usuario: es la mejor copia disponible
+    Order = apps.get_model('myshop', 'Order')
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    for user in User.objects.filter(pk__in=Order.objects.values('user_id')).iterator(chunk_size=500):
+        name = f'{user.first_name} {user.last_name}'.strip() or user.username
+        Order.objects.filter(user=user).update(customer_name=name[:150], customer_email=user.email)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('myshop', '0009_price_rules'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='customer_email',
+            field=models.EmailField(blank=True, max_length=254),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='customer_name',
+            field=models.CharField(blank=True, max_length=150),
+        ),
+        migrations.RunPython(fill_customer, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,28 @@
-from django.db import models
+import json
+import zlib
+from decimal import Decimal
+from functools import cached_property, lru_cache
+from types import SimpleNamespace
+
+from django.db import models, transaction
+from django.db.models import Case, DecimalField, F, FloatField, When
+from django.db.models.functions import Cast, Round
 from django.contrib.auth.models import User
+from django.urls import reverse
+from django.utils import timezone
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
 
 
+_URL_SENTINEL = 987654321
+
+
+@lru_cache(maxsize=1)
+def _product_url_parts():
+    # reverse() cuesta decenas de µs: se resuelve una vez y se reutiliza la plantilla
+    return reverse('myshop:product_detail', kwargs={'product_id': _URL_SENTINEL}).split(str(_URL_SENTINEL))
+
+
 class Product(models.Model):
     CATEGORY_CHOICES = [
         ('figure', 'Figura'),
@@ -19,10 +39,73 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     average_rating = models.DecimalField(max_digits=3, decimal_places=2, default=0)
     review_count = models.IntegerField(default=0)
+    # Histograma de valoraciones (1 a 5 estrellas), mantenido por Review
+    rating_1_count = models.IntegerField(default=0)
+    rating_2_count = models.IntegerField(default=0)
+    rating_3_count = models.IntegerField(default=0)
+    rating_4_count = models.IntegerField(default=0)
+    rating_5_count = models.IntegerField(default=0)
+    # Popularidad (ver myshop/popularity.py)
+    view_count = models.PositiveIntegerField(default=0)
+    cart_add_count = models.PositiveIntegerField(default=0)
+    popularity = models.FloatField(default=0, db_index=True)
+    # Última modificación de los datos publicados (feeds y sitemap, ver
+    # myshop/feeds.py); los UPDATE por lotes de stock/precio la fijan a mano
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.name
 
+    def get_absolute_url(self):
+        return self.url_for(self.pk)
+
+    @staticmethod
+    def url_for(product_id):
+        """URL de `product_detail` por id, sin pasar por reverse() en cada llamada.
+
+        Para los listados que solo leen ids (feeds, sugerencias de búsqueda).
+        """
+        prefix, suffix = _product_url_parts()
+        return f'{prefix}{product_id}{suffix}'
+
+    @property
+    def rating_histogram(self):
+        """Lista [(estrellas, cantidad, porcentaje)] de 5 a 1 estrellas."""
+        total = self.review_count or 0
+        histogram = []
+        for stars in range(5, 0, -1):
+            count = getattr(self, f'rating_{stars}_count')
+            histogram.append((stars, count, round(100 * count / total) if total else 0))
+        return histogram
+
+    @classmethod
+    def apply_rating_delta(cls, product_id, added=None, removed=None):
+        """Actualiza histograma, contador y promedio con UPDATEs atómicos.
+
+        `added`/`removed` son las valoraciones (1-5) que entran o salen.
+        """
+        if added == removed:
+            return
+        changes = {}
+        if added is not None:
+            changes[f'rating_{added}_count'] = F(f'rating_{added}_count') + 1
+        if removed is not None:
+            changes[f'rating_{removed}_count'] = F(f'rating_{removed}_count') - 1
+        count_delta = (added is not None) - (removed is not None)
+        if count_delta:
+            changes['review_count'] = F('review_count') + count_delta
+
+        weighted = sum(Cast(F(f'rating_{stars}_count'), FloatField()) * stars for stars in range(1, 6))
+        with transaction.atomic():
+            products = cls.objects.filter(pk=product_id)
+            products.update(**changes)
+            # El promedio se calcula a partir del histograma ya actualizado
+            products.update(average_rating=Case(
+                When(review_count=0, then=0),
+                default=Round(weighted / F('review_count'), 2),
+                output_field=DecimalField(max_digits=3, decimal_places=2),
+            ))
+
     class Meta:
         verbose_name = "Producto"
         verbose_name_plural = "Productos"
@@ -77,6 +160,9 @@ class Order(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     shipping_address = models.TextField()
     phone = models.CharField(max_length=20)
+    # Copia del cliente al confirmar: el recibo no cambia si luego edita su perfil
+    customer_name = models.CharField(max_length=150, blank=True)
+    customer_email = models.EmailField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -84,10 +170,22 @@ class Order(models.Model):
         ordering = ['-created_at']
         verbose_name = 'Pedido'
         verbose_name_plural = 'Pedidos'
+        indexes = [
+            # "Mis pedidos" y la selección de pedidos a archivar
+            models.Index(fields=['user', '-created_at']),
+            models.Index(fields=['status', 'created_at']),
+        ]
 
     def __str__(self):
         return f'Pedido {self.id} de {self.user.username}'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Estado leído de la base, para detectar transiciones (p. ej. a 'cancelled')
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
+
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, related_name='items', on_delete=models.CASCADE)
@@ -126,20 +224,232 @@ class Review(models.Model):
     def __str__(self):
         return f'Valoración de {self.user.username} para {self.product.name}'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Valoración leída de la base, para actualizar el histograma al cambiarla
+        instance._loaded_rating = instance.__dict__.get('rating')
+        return instance
+
     def save(self, *args, **kwargs):
-        # Si es una nueva reseña (sin ID)
-        is_new = self.pk is None
-        
-        super().save(*args, **kwargs)
-        
-        # Actualizar promedio y contador de reseñas del producto
-        product = self.product
-        reviews = product.reviews.all()
-        
-        product.review_count = reviews.count()
-        if product.review_count > 0:
-            product.average_rating = round(sum(r.rating for r in reviews) / product.review_count, 2)
-        else:
-            product.average_rating = 0
-            
-        product.save()
+        is_new = self._state.adding
+        previous = None if is_new else getattr(self, '_loaded_rating', None)
+        self.rating = int(self.rating)
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            # Actualización incremental del histograma y del promedio del producto
+            Product.apply_rating_delta(self.product_id, added=self.rating, removed=previous)
+        self._loaded_rating = self.rating
+
+class StockMovement(models.Model):
+    """Libro mayor de inventario: solo se insertan filas, nunca se modifican.
+
+    `Product.stock` es el saldo cacheado; se mantiene aplicando los deltas de
+    cada movimiento (ver myshop/inventory.py) y puede recalcularse con
+    `python manage.py reconcile_stock`.
+    """
+    KIND_CHOICES = [
+        ('sale', 'Venta'),
+        ('restock', 'Reposición'),
+        ('adjustment', 'Ajuste'),
+        ('return', 'Devolución por cancelación'),
+    ]
+
+    product = models.ForeignKey(Product, related_name='stock_movements', on_delete=models.CASCADE)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    quantity = models.IntegerField(help_text='Delta con signo: negativo para salidas de stock')
+    order = models.ForeignKey(Order, related_name='stock_movements', null=True, blank=True, on_delete=models.SET_NULL)
+    note = models.CharField(max_length=200, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Movimiento de stock'
+        verbose_name_plural = 'Movimientos de stock'
+        ordering = ['-created_at']
+        indexes = [models.Index(fields=['product', 'created_at'])]
+
+    def __str__(self):
+        return f'{self.get_kind_display()} {self.quantity:+d} de {self.product.name}'
+
+
+class ArchivedOrder(models.Model):
+    """Pedido histórico movido fuera de `Order`/`OrderItem` (ver myshop/archive.py).
+
+    Conserva el mismo id que tenía el pedido. Las columnas sirven para listar
+    y filtrar; el resto del pedido y sus líneas van en `payload`, un JSON
+    comprimido con zlib. Las filas no se modifican: para editar un pedido hay
+    que restaurarlo antes (`manage.py restore_orders`).
+    """
+    # Mismo tamaño que el id de Order (BigAutoField)
+    id = models.PositiveBigIntegerField(primary_key=True, help_text='Id original del pedido')
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    total = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    payload = models.BinaryField()
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = 'Pedido archivado'
+        verbose_name_plural = 'Pedidos archivados'
+        indexes = [models.Index(fields=['user', '-created_at'])]
+
+    def __str__(self):
+        return f'Pedido archivado {self.id}'
+
+    @staticmethod
+    def pack(data):
+        return zlib.compress(json.dumps(data, separators=(',', ':')).encode('utf-8'), 9)
+
+    @cached_property
+    def data(self):
+        return json.loads(zlib.decompress(bytes(self.payload)))
+
+    @property
+    def shipping_address(self):
+        return self.data['shipping_address']
+
+    @property
+    def phone(self):
+        return self.data['phone']
+
+    @property
+    def customer_name(self):
+        return self.data.get('customer_name', '')
+
+    @property
+    def customer_email(self):
+        return self.data.get('customer_email', '')
+
+    @cached_property
+    def lines(self):
+        """Líneas con la misma interfaz que `OrderItem` en las plantillas."""
+        lines = []
+        for item in self.data['items']:
+            price = Decimal(item['price'])
+            lines.append(SimpleNamespace(
+                product=SimpleNamespace(id=item['product_id'], name=item['product_name']),
+                product_id=item['product_id'],
+                quantity=item['quantity'],
+                price=price,
+                get_cost=price * item['quantity'],
+            ))
+        return lines
+
+
+class CustomerSegment(models.Model):
+    """Segmento RFM de cada cliente, recalculado por `manage.py analyze_customers`."""
+    SEGMENT_CHOICES = [
+        ('champions', 'Campeones'),
+        ('loyal', 'Leales'),
+        ('new', 'Nuevos'),
+        ('potential', 'Prometedores'),
+        ('at_risk', 'En riesgo'),
+        ('hibernating', 'Dormidos'),
+        ('lost', 'Perdidos'),
+    ]
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='segment')
+    segment = models.CharField(max_length=20, choices=SEGMENT_CHOICES, db_index=True)
+    recency_days = models.PositiveIntegerField()
+    frequency = models.PositiveIntegerField()
+    monetary = models.DecimalField(max_digits=12, decimal_places=2)
+    r_score = models.PositiveSmallIntegerField()
+    f_score = models.PositiveSmallIntegerField()
+    m_score = models.PositiveSmallIntegerField()
+    first_order_at = models.DateTimeField()
+    last_order_at = models.DateTimeField()
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['-monetary']
+        verbose_name = 'Segmento de cliente'
+        verbose_name_plural = 'Segmentos de clientes (RFM)'
+
+    def __str__(self):
+        return f'{self.user_id}: {self.get_segment_display()}'
+
+
+class CohortRetention(models.Model):
+    """Clientes de la cohorte (mes del primer pedido) que vuelven a comprar N meses después."""
+    cohort = models.DateField(help_text='Primer día del mes del primer pedido')
+    months_since = models.PositiveSmallIntegerField()
+    customers = models.PositiveIntegerField()
+    retained = models.PositiveIntegerField()
+    rate = models.FloatField()
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['cohort', 'months_since']
+        verbose_name = 'Retención por cohorte'
+        verbose_name_plural = 'Retención por cohortes'
+        constraints = [models.UniqueConstraint(fields=['cohort', 'months_since'], name='unique_cohort_month')]
+
+    def __str__(self):
+        return f'{self.cohort:%Y-%m} +{self.months_since}: {self.rate:.0%}'
+
+
+class PriceRule(models.Model):
+    """Cambio de precio por lotes aplicado por `manage.py apply_price_rules` (ver myshop/pricing.py).
+
+    Afecta a los productos de `category` (todos si está vacía) cuyo nombre
+    contiene `name_contains`. `value` lleva signo: -20 con `percent` es un 20 %
+    de descuento; -5 con `fixed` resta 5 al precio.
+    """
+    KIND_CHOICES = [
+        ('percent', 'Porcentaje'),
+        ('fixed', 'Importe fijo'),
+    ]
+
+    name = models.CharField(max_length=100)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, default='percent')
+    value = models.DecimalField(max_digits=8, decimal_places=2)
+    category = models.CharField(max_length=20, choices=Product.CATEGORY_CHOICES, blank=True)
+    name_contains = models.CharField(max_length=100, blank=True)
+    starts_at = models.DateTimeField(default=timezone.now)
+    ends_at = models.DateTimeField(null=True, blank=True, help_text='Vacío: el cambio es permanente')
+    applied_at = models.DateTimeField(null=True, blank=True, editable=False)
+    reverted_at = models.DateTimeField(null=True, blank=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-starts_at']
+        verbose_name = 'Regla de precios'
+        verbose_name_plural = 'Reglas de precios'
+
+    def __str__(self):
+        return self.name
+
+    def clean(self):
+        if self.kind == 'percent' and self.value is not None and self.value <= -100:
+            raise ValidationError({'value': 'Un descuento debe ser menor del 100 %.'})
+        if self.ends_at and self.starts_at and self.ends_at <= self.starts_at:
+            raise ValidationError({'ends_at': 'El fin debe ser posterior al inicio.'})
+
+    @property
+    def status(self):
+        if self.reverted_at:
+            return 'Revertida'
+        if self.applied_at:
+            return 'Aplicada'
+        if self.ends_at and self.ends_at <= timezone.now():
+            return 'Caducada'
+        return 'Programada'
+
+
+class PriceHistory(models.Model):
+    """Precio de cada producto antes y después de aplicar una regla."""
+    rule = models.ForeignKey(PriceRule, related_name='history', on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, related_name='price_history', on_delete=models.CASCADE)
+    old_price = models.DecimalField(max_digits=8, decimal_places=2)
+    new_price = models.DecimalField(max_digits=8, decimal_places=2, null=True)
+
+    class Meta:
+        verbose_name = 'Histórico de precio'
+        verbose_name_plural = 'Histórico de precios'
+        constraints = [models.UniqueConstraint(fields=['rule', 'product'], name='unique_rule_product')]
+
+    def __str__(self):
+        return f'{self.product_id}: {self.old_price} → {self.new_price}'
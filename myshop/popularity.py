@@ -0,0 +1,103 @@
+"""Contadores de visitas y de "Añadir al carrito" con escritura diferida.
+
+Los eventos se acumulan en memoria del proceso y se vuelcan cada
+`POPULARITY_FLUSH_INTERVAL` segundos (o al superar
+`POPULARITY_FLUSH_MAX_PENDING` productos pendientes) con un único
+`UPDATE ... SET col = col + CASE id WHEN ... END`. Así `product_detail` sigue
+siendo una página de solo lectura.
+
+`Product.popularity` es una suma de eventos ponderados con decaimiento
+exponencial: el volcado suma los eventos nuevos y el comando
+`update_popularity` aplica el decaimiento y suma las ventas recientes.
+"""
+import logging
+import threading
+import time
+from collections import Counter
+from functools import wraps
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import Case, F, FloatField, IntegerField, Value, When
+
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WEIGHTS = {'view': 1.0, 'cart_add': 5.0, 'sale': 20.0}
+
+_lock = threading.Lock()
+_views = Counter()
+_cart_adds = Counter()
+_last_flush = time.monotonic()
+
+
+def weights():
+    return {**DEFAULT_WEIGHTS, **getattr(settings, 'POPULARITY_WEIGHTS', {})}
+
+
+def record_view(product_id):
+    _record(_views, product_id)
+
+
+def record_cart_add(product_id):
+    _record(_cart_adds, product_id)
+
+
+def _record(counter, product_id):
+    with _lock:
+        counter[product_id] += 1
+        pending = len(_views.keys() | _cart_adds.keys())
+        due = (
+            time.monotonic() - _last_flush >= getattr(settings, 'POPULARITY_FLUSH_INTERVAL', 30)
+            or pending >= getattr(settings, 'POPULARITY_FLUSH_MAX_PENDING', 500)
+        )
+    if due:
+        flush()
+
+
+def case_by_id(values, output_field):
+    """CASE id WHEN <id> THEN <valor> ... ELSE 0 END para un UPDATE por lotes."""
+    return Case(
+        *[When(pk=pk, then=Value(value)) for pk, value in values.items()],
+        default=Value(0), output_field=output_field,
+    )
+
+
+def flush():
+    """Vuelca los contadores pendientes en un solo UPDATE. Devuelve las filas afectadas."""
+    global _last_flush
+    with _lock:
+        views, cart_adds = _views.copy(), _cart_adds.copy()
+        _views.clear()
+        _cart_adds.clear()
+        _last_flush = time.monotonic()
+
+    product_ids = views.keys() | cart_adds.keys()
+    if not product_ids:
+        return 0
+    w = weights()
+    scores = {pk: views[pk] * w['view'] + cart_adds[pk] * w['cart_add'] for pk in product_ids}
+    try:
+        return Product.objects.filter(pk__in=product_ids).update(
+            view_count=F('view_count') + case_by_id(views, IntegerField()),
+            cart_add_count=F('cart_add_count') + case_by_id(cart_adds, IntegerField()),
+            popularity=F('popularity') + case_by_id(scores, FloatField()),
+        )
+    except DatabaseError:
+        # Devolver los eventos al buffer para el siguiente intento
+        logger.exception('No se pudieron volcar los contadores de popularidad')
+        with _lock:
+            _views.update(views)
+            _cart_adds.update(cart_adds)
+        return 0
+
+
+def track_product_view(view_func):
+    """Cuenta las visitas GET de una vista de producto, incluidas las servidas desde caché."""
+    @wraps(view_func)
+    def _wrapped(request, product_id, *args, **kwargs):
+        if request.method == 'GET':
+            record_view(product_id)
+        return view_func(request, product_id, *args, **kwargs)
+    return _wrapped
@@ -0,0 +1,132 @@
+"""Cambios de precio por lotes con histórico (`PriceRule` / `PriceHistory`).
+
+Aplicar una regla son cuatro consultas, sin importar cuántos productos
+afecte: leer los precios actuales, guardarlos con `bulk_create` en
+`PriceHistory`, un único UPDATE con el nuevo precio calculado en SQL y otro
+que copia ese precio al histórico. Revertir es un UPDATE con una subconsulta
+sobre el histórico que solo toca los productos cuyo precio sigue siendo el
+que puso la regla: si alguien lo cambió después (a mano o con otra regla),
+se respeta. Si lo cambió otra regla posterior que sigue activa, esa regla
+hereda el precio anterior de la que termina, para que al revertirse vuelva
+al precio de antes de ambas y no al de la primera rebaja.
+
+`manage.py apply_price_rules` aplica las reglas cuyo inicio ha llegado y
+revierte las que han terminado, así que las vistas no tienen que comprobar
+ninguna fecha.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import DecimalField, Exists, F, OuterRef, Subquery, Value
+from django.db.models.functions import Greatest, Now, Round
+from django.utils import timezone
+
+from . import changefeed
+from .cache import bump_catalog_generation
+from .models import PriceHistory, PriceRule, Product
+
+MIN_PRICE = Decimal('0.01')
+PUBLISH_BATCH = 500
+
+
+def rule_products(rule):
+    products = Product.objects.all()
+    if rule.category:
+        products = products.filter(category=rule.category)
+    if rule.name_contains:
+        products = products.filter(name__icontains=rule.name_contains)
+    return products
+
+
+def new_price_expression(rule):
+    """Precio resultante de la regla, como expresión SQL (nunca por debajo de 0.01)."""
+    output = DecimalField(max_digits=8, decimal_places=2)
+    if rule.kind == 'percent':
+        # Factor ya dividido: en SQLite, `price * 85 / 100` sería una división entera
+        factor = (100 + Decimal(rule.value)) / 100
+        price = Round(F('price') * Value(factor, output_field=output), 2, output_field=output)
+    else:
+        price = F('price') + Value(rule.value)
+    return Greatest(price, Value(MIN_PRICE), output_field=output)
+
+
+def _after_commit(product_ids):
+    # `update()` no emite señales: invalidar el catálogo y avisar a las páginas abiertas
+    def notify():
+        bump_catalog_generation()
+        for start in range(0, len(product_ids), PUBLISH_BATCH):
+            changefeed.publish_products(product_ids[start:start + PUBLISH_BATCH])
+    transaction.on_commit(notify)
+
+
+def apply_rule(rule, batch_size=2000):
+    """Aplica la regla una sola vez. Devuelve el número de productos cambiados."""
+    with transaction.atomic():
+        rule = PriceRule.objects.select_for_update().get(pk=rule.pk)
+        if rule.applied_at or rule.reverted_at:
+            return 0
+        current = list(rule_products(rule).values_list('id', 'price'))
+        PriceHistory.objects.bulk_create(
+            (PriceHistory(rule=rule, product_id=product_id, old_price=price) for product_id, price in current),
+            batch_size=batch_size,
+        )
+        changed = Product.objects.filter(price_history__rule=rule).update(
+            price=new_price_expression(rule), updated_at=Now(),
+        )
+        rule.history.update(new_price=Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('price')[:1]))
+        rule.applied_at = timezone.now()
+        rule.save(update_fields=['applied_at'])
+        _after_commit([product_id for product_id, _ in current])
+    return changed
+
+
+def revert_rule(rule):
+    """Devuelve el precio anterior a los productos que siguen con el precio de la regla.
+
+    Devuelve (restaurados, omitidos); los omitidos cambiaron de precio después.
+    """
+    with transaction.atomic():
+        rule = PriceRule.objects.select_for_update().get(pk=rule.pk)
+        if not rule.applied_at or rule.reverted_at:
+            return 0, 0
+        history = PriceHistory.objects.filter(rule=rule, product=OuterRef('pk'))
+        untouched = Product.objects.filter(Exists(history.filter(new_price=OuterRef('price'))))
+        product_ids = list(untouched.values_list('id', flat=True))
+        restored = Product.objects.filter(pk__in=product_ids).update(
+            price=Subquery(history.values('old_price')[:1]), updated_at=Now(),
+        )
+        own = PriceHistory.objects.filter(rule=rule, product=OuterRef('product'))
+        PriceHistory.objects.filter(
+            rule__applied_at__gte=rule.applied_at, rule__reverted_at__isnull=True,
+            old_price=Subquery(own.values('new_price')[:1]),
+        ).exclude(rule=rule).exclude(product__in=product_ids).update(old_price=Subquery(own.values('old_price')[:1]))
+        rule.reverted_at = timezone.now()
+        rule.save(update_fields=['reverted_at'])
+        _after_commit(product_ids)
+    return restored, rule.history.count() - restored
+
+
+def due_rules(now=None):
+    """(reglas por aplicar, reglas por revertir) en el momento `now`."""
+    now = now or timezone.now()
+    pending = PriceRule.objects.filter(applied_at__isnull=True, reverted_at__isnull=True, starts_at__lte=now)
+    to_apply = pending.exclude(ends_at__lte=now).order_by('starts_at', 'id')
+    to_revert = PriceRule.objects.filter(
+        applied_at__isnull=False, reverted_at__isnull=True, ends_at__lte=now,
+    ).order_by('-applied_at', '-id')
+    return list(to_apply), list(to_revert)
+
+
+def run_schedule(now=None):
+    """Revierte las reglas terminadas (de la más reciente a la más antigua) y aplica las que empiezan.
+
+    Devuelve [(regla, acción, productos cambiados, productos omitidos)].
+    """
+    to_apply, to_revert = due_rules(now)
+    results = []
+    for rule in to_revert:
+        restored, skipped = revert_rule(rule)
+        results.append((rule, 'revert', restored, skipped))
+    for rule in to_apply:
+        results.append((rule, 'apply', apply_rule(rule), 0))
+    return results
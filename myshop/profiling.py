@@ -0,0 +1,257 @@
+"""Perfilado bajo demanda de peticiones en producción.
+
+`ProfilingMiddleware` perfila una petición solo si:
+
+- la pide un usuario staff con `?_profile=1` (o `?_profile=cprofile`),
+- trae la cabecera `X-Profile` con un token firmado (`manage.py profiling_token`),
+  útil desde curl sin sesión de staff, o
+- cae en el muestreo 1 de cada `PROFILING_SAMPLE_RATE` peticiones (0 = nunca).
+
+Modos:
+
+- `sample` (por defecto): un hilo lee la pila del hilo de la petición cada
+  `PROFILING_SAMPLE_INTERVAL` segundos con `sys._current_frames()` y guarda las
+  pilas en formato "collapsed" (`a;b;c 12`), la entrada de flamegraph.pl o
+  speedscope. El sobrecoste no depende de cuántas funciones se llamen.
+- `cprofile`: `cProfile` determinista, volcado como `.prof` (snakeviz,
+  `python -m pstats`).
+
+Cada perfil se guarda en `PROFILING_DIR` junto a un `.json` con la vista, la
+ruta y los tiempos (total, CPU, SQL). Se conservan los `PROFILING_KEEP` más
+recientes; `admin/profiles/` los lista para el staff.
+"""
+import cProfile
+import json
+import logging
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core import signing
+from django.db import connections
+from django.http import FileResponse, Http404
+from django.shortcuts import render
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+MODES = ('sample', 'cprofile')
+HEADER = 'HTTP_X_PROFILE'
+QUERY_PARAM = '_profile'
+_SIGNING_SALT = 'myshop.profiling'
+
+# cProfile usa el hook de perfilado del intérprete: uno a la vez por proceso
+_cprofile_lock = threading.Lock()
+
+
+def profiles_dir():
+    return Path(getattr(settings, 'PROFILING_DIR', Path(settings.BASE_DIR) / 'profiles'))
+
+
+def make_token(mode='sample'):
+    """Token para la cabecera X-Profile; caduca a los PROFILING_TOKEN_MAX_AGE segundos."""
+    return signing.TimestampSigner(salt=_SIGNING_SALT).sign(mode)
+
+
+def _mode_from_token(token):
+    try:
+        mode = signing.TimestampSigner(salt=_SIGNING_SALT).unsign(
+            token, max_age=getattr(settings, 'PROFILING_TOKEN_MAX_AGE', 3600)
+        )
+    except signing.BadSignature:
+        return None
+    return mode if mode in MODES else None
+
+
+def requested_mode(request):
+    """Modo de perfilado pedido para esta petición, o None."""
+    token = request.META.get(HEADER)
+    if token:
+        return _mode_from_token(token)
+    flag = request.GET.get(QUERY_PARAM)
+    if flag:
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_active and user.is_staff:
+            return flag if flag in MODES else 'sample'
+        return None
+    rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0)
+    if rate and random.random() < 1 / rate:
+        return 'sample'
+    return None
+
+
+class StackSampler(threading.Thread):
+    """Muestrea la pila de otro hilo a intervalos fijos."""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name='profiling-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f'{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})')
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(names))] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+class _QueryTimer:
+    """execute_wrapper que cuenta las consultas SQL y el tiempo pasado en ellas."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        mode = requested_mode(request)
+        if mode is None:
+            return self.get_response(request)
+        if mode == 'cprofile' and not _cprofile_lock.acquire(blocking=False):
+            mode = 'sample'
+        try:
+            return self._profile(request, mode)
+        finally:
+            if mode == 'cprofile':
+                _cprofile_lock.release()
+
+    def _profile(self, request, mode):
+        timer = _QueryTimer()
+        profiler = sampler = None
+        if mode == 'cprofile':
+            profiler = cProfile.Profile()
+        else:
+            sampler = StackSampler(threading.get_ident(), getattr(settings, 'PROFILING_SAMPLE_INTERVAL', 0.005))
+
+        wrappers = [connections[alias].execute_wrapper(timer) for alias in connections]
+        for wrapper in wrappers:
+            wrapper.__enter__()
+        started, cpu_started = time.perf_counter(), time.thread_time()
+        try:
+            if profiler is not None:
+                response = profiler.runcall(self.get_response, request)
+            else:
+                sampler.start()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    sampler.stop()
+        finally:
+            wall, cpu = time.perf_counter() - started, time.thread_time() - cpu_started
+            for wrapper in reversed(wrappers):
+                wrapper.__exit__(None, None, None)
+
+        match = getattr(request, 'resolver_match', None)
+        meta = {
+            'path': request.path,
+            'method': request.method,
+            'view': (match.view_name or match._func_path) if match else '',
+            'status': response.status_code,
+            'mode': mode,
+            'wall_ms': round(wall * 1000, 2),
+            'cpu_ms': round(cpu * 1000, 2),
+            'sql_count': timer.count,
+            'sql_ms': round(timer.seconds * 1000, 2),
+            'samples': sampler.samples if sampler else None,
+            'user': getattr(getattr(request, 'user', None), 'username', '') or '',
+        }
+        try:
+            profile_id = save_profile(meta, profiler=profiler, sampler=sampler)
+        except OSError:
+            logger.exception('No se pudo guardar el perfil de %s', request.path)
+        else:
+            response['X-Profile-Id'] = profile_id
+        return response
+
+
+def save_profile(meta, profiler=None, sampler=None):
+    directory = profiles_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    created_at = timezone.now()
+    profile_id = f'{created_at:%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}'
+    if profiler is not None:
+        filename = f'{profile_id}.prof'
+        profiler.dump_stats(directory / filename)
+    else:
+        filename = f'{profile_id}.collapsed'
+        (directory / filename).write_text(sampler.collapsed(), encoding='utf-8')
+    meta = {**meta, 'id': profile_id, 'file': filename, 'created_at': created_at.isoformat()}
+    (directory / f'{profile_id}.json').write_text(json.dumps(meta), encoding='utf-8')
+    _prune(directory)
+    return profile_id
+
+
+def _prune(directory):
+    keep = getattr(settings, 'PROFILING_KEEP', 200)
+    for old in sorted(directory.glob('*.json'), reverse=True)[keep:]:
+        for path in directory.glob(f'{old.stem}.*'):
+            path.unlink(missing_ok=True)
+
+
+def list_profiles(limit=100):
+    directory = profiles_dir()
+    if not directory.is_dir():
+        return []
+    profiles = []
+    for path in sorted(directory.glob('*.json'), reverse=True)[:limit]:
+        try:
+            profiles.append(json.loads(path.read_text(encoding='utf-8')))
+        except (OSError, ValueError):
+            continue
+    return profiles
+
+
+@staff_member_required
+def profile_list(request):
+    return render(request, 'admin/profiles.html', {
+        'title': 'Perfiles de peticiones',
+        'profiles': list_profiles(),
+        'profiling_dir': profiles_dir(),
+        'sample_rate': getattr(settings, 'PROFILING_SAMPLE_RATE', 0),
+    })
+
+
+@staff_member_required
+def profile_download(request, filename):
+    # Solo nombres generados por save_profile, nunca rutas
+    if Path(filename).name != filename or Path(filename).suffix not in ('.prof', '.collapsed', '.json'):
+        raise Http404
+    path = profiles_dir() / filename
+    if not path.is_file():
+        raise Http404
+    return FileResponse(path.open('rb'), as_attachment=True, filename=filename)
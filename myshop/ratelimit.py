@@ -0,0 +1,101 @@
+"""Limitación de peticiones con token bucket guardado en la caché.
+
+Cada vista se identifica por un nombre y sus límites se configuran en
+`settings.RATE_LIMITS`, por ejemplo::
+
+    RATE_LIMITS = {
+        'login': {'ip': '10/m', 'username': '5/m'},
+    }
+
+Ámbitos disponibles: `ip` (dirección del cliente), `user` (usuario
+autenticado) y `username` (nombre enviado en el formulario, para frenar
+ataques de credenciales contra una cuenta). La lectura y escritura del bucket
+no es atómica: bajo concurrencia pueden admitirse unas pocas peticiones de
+más, lo que es aceptable para proteger CPU y base de datos.
+"""
+import math
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+
+KEY_PREFIX = 'shop:ratelimit'
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """'30/m' -> (capacidad, tokens repuestos por segundo)."""
+    count, period = rate.split('/')
+    count = int(count)
+    return count, count / PERIODS[period.strip().lower()[0]]
+
+
+def client_ip(request):
+    if getattr(settings, 'RATE_LIMIT_TRUST_X_FORWARDED_FOR', False):
+        forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '')
+        if forwarded:
+            return forwarded.split(',')[0].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def take_token(key, rate, now=None):
+    """Consume un token del bucket `key`.
+
+    Devuelve (permitido, segundos_hasta_el_siguiente_token).
+    """
+    capacity, refill = parse_rate(rate)
+    now = time.time() if now is None else now
+    tokens, updated = cache.get(key, (capacity, now))
+    tokens = min(capacity, tokens + (now - updated) * refill)
+    allowed = tokens >= 1
+    if allowed:
+        tokens -= 1
+    # El bucket se olvida cuando ya estaría lleno de nuevo
+    cache.set(key, (tokens, now), math.ceil(capacity / refill))
+    retry_after = 0 if allowed else math.ceil((1 - tokens) / refill)
+    return allowed, retry_after
+
+
+def _identities(request, scopes):
+    for scope in scopes:
+        if scope == 'ip':
+            yield scope, client_ip(request)
+        elif scope == 'user' and request.user.is_authenticated:
+            yield scope, str(request.user.pk)
+        elif scope == 'username' and request.POST.get('username'):
+            yield scope, request.POST['username'].strip().lower()
+
+
+def rate_limit(name, methods=('POST',), json=False):
+    """Aplica los límites de `settings.RATE_LIMITS[name]` a la vista.
+
+    Si se supera algún límite responde 429 con `Retry-After` (cuerpo JSON
+    para los endpoints JSON).
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def _wrapped(request, *args, **kwargs):
+            limits = getattr(settings, 'RATE_LIMITS', {}).get(name)
+            if limits and request.method in methods:
+                retry_after = 0
+                for scope, ident in _identities(request, limits):
+                    allowed, wait = take_token(f'{KEY_PREFIX}:{name}:{scope}:{ident}', limits[scope])
+                    if not allowed:
+                        retry_after = max(retry_after, wait)
+                if retry_after:
+                    return _too_many_requests(retry_after, json)
+            return view_func(request, *args, **kwargs)
+        return _wrapped
+    return decorator
+
+
+def _too_many_requests(retry_after, json):
+    message = 'Demasiadas peticiones. Intenta de nuevo en unos segundos.'
+    if json:
+        response = JsonResponse({'error': message}, status=429)
+    else:
+        response = HttpResponse(message, status=429, content_type='text/plain; charset=utf-8')
+    response['Retry-After'] = str(retry_after)
+    return response
@@ -0,0 +1,105 @@
+"""Router de base de datos: lecturas del catálogo en réplicas.
+
+- Las lecturas de `Product` y `Review` van a los alias de
+  `settings.DATABASE_REPLICAS` en round-robin, saltando las réplicas que no
+  responden (se vuelven a comprobar cada `REPLICA_HEALTH_CHECK_INTERVAL` s).
+- Las escrituras, y cualquier lectura dentro de una transacción en curso
+  (checkout), van a la base principal.
+- `ReplicaPinningMiddleware` fija la petición a la principal durante
+  `REPLICA_PIN_SECONDS` tras una escritura del usuario (read-your-writes).
+"""
+import contextvars
+import itertools
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+CATALOG_MODELS = {('myshop', 'product'), ('myshop', 'review')}
+PIN_COOKIE = 'db_primary'
+
+_pinned = contextvars.ContextVar('db_pinned_to_primary', default=False)
+_health = {}
+_counter = itertools.count()
+
+
+@contextmanager
+def use_primary():
+    """Fuerza las lecturas del catálogo a la base principal dentro del bloque."""
+    token = _pinned.set(True)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+def _is_healthy(alias):
+    interval = getattr(settings, 'REPLICA_HEALTH_CHECK_INTERVAL', 30)
+    healthy, checked_at = _health.get(alias, (True, 0))
+    now = time.monotonic()
+    if now - checked_at < interval:
+        return healthy
+    try:
+        connections[alias].ensure_connection()
+        healthy = True
+    except DatabaseError:
+        healthy = False
+    _health[alias] = (healthy, now)
+    return healthy
+
+
+def choose_replica():
+    """Siguiente réplica sana en round-robin, o la principal si no hay ninguna."""
+    replicas = list(getattr(settings, 'DATABASE_REPLICAS', []))
+    if not replicas:
+        return DEFAULT_DB_ALIAS
+    start = next(_counter) % len(replicas)
+    for alias in replicas[start:] + replicas[:start]:
+        if _is_healthy(alias):
+            return alias
+    return DEFAULT_DB_ALIAS
+
+
+class CatalogReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if (model._meta.app_label, model._meta.model_name) not in CATALOG_MODELS:
+            return None
+        if _pinned.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return choose_replica()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Las réplicas son copias de la principal: las relaciones son válidas
+        databases = {DEFAULT_DB_ALIAS, *getattr(settings, 'DATABASE_REPLICAS', [])}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
+
+
+class ReplicaPinningMiddleware:
+    """Lecturas desde la principal en peticiones que escriben y durante unos
+    segundos después (cookie), para que el usuario vea sus propios cambios."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        writes = request.method not in ('GET', 'HEAD', 'OPTIONS')
+        token = _pinned.set(writes or PIN_COOKIE in request.COOKIES)
+        try:
+            response = self.get_response(request)
+        finally:
+            _pinned.reset(token)
+        if writes:
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=getattr(settings, 'REPLICA_PIN_SECONDS', 5),
+                httponly=True, samesite='Lax',
+            )
+        return response
@@ -0,0 +1,268 @@
+"""Índice de prefijos en memoria para las sugerencias de búsqueda.
+
+Un array ordenado de (término, id_producto) consultado con `bisect`: cada
+tecla se resuelve en microsegundos sin tocar la base de datos. Los términos son
+el nombre completo normalizado (minúsculas, sin acentos) y cada palabra del
+nombre. Se construye al arrancar (en el maestro de gunicorn, antes del fork).
+
+Solo el nombre y la categoría afectan al índice, así que no depende de la
+generación del catálogo (que cambia con cada venta o valoración). Cuando se
+crea, renombra, recategoriza o borra un producto, el cambio se anota en la
+caché compartida con un número de versión propio (`VERSION_KEY`). Cada
+`SEARCH_INDEX_CHECK_INTERVAL` segundos, cada proceso aplica de forma
+incremental los cambios que le faltan, con una o dos lecturas de caché y sin
+consultas. Si faltan cambios (caché vaciada o caducados) o el índice supera
+`SEARCH_INDEX_MAX_AGE` segundos, se reconstruye en un hilo aparte mientras se
+sigue sirviendo el índice anterior: nunca dentro de una petición.
+
+Con la caché en memoria de cada proceso ese registro no sale del worker que
+hizo el cambio. En ese caso, cada `SEARCH_INDEX_CHECK_INTERVAL` segundos un
+hilo aparte compara el número de productos y el `updated_at` más reciente
+con los del momento de la carga, y reconstruye si han cambiado.
+`SEARCH_INDEX_MAX_BYTES` limita la memoria: se indexan primero los productos
+más populares.
+"""
+import bisect
+import logging
+import sys
+import threading
+import time
+import unicodedata
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max
+
+from .cache import cache_is_shared
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'shop:search:version'
+CHANGE_KEY = 'shop:search:change:{}'
+CHANGE_TTL = 3600
+
+# Sobrecoste aproximado de una tupla (término, id) dentro de la lista
+_ENTRY_OVERHEAD = 64 + 8
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(char for char in text if not unicodedata.combining(char)).strip()
+
+
+def _terms(name):
+    normalized = normalize(name)
+    words = {word for word in normalized.split() if len(word) > 1}
+    return {normalized} | words
+
+
+class PrefixIndex:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.truncated = False
+        self.version = 0
+        # (productos, último updated_at) al cargar; solo sin caché compartida
+        self.db_state = None
+        self.built_at = time.monotonic()
+        self._keys = []
+        self._products = {}
+
+    def add(self, product_id, name, category, keep_sorted=True):
+        self.remove(product_id)
+        terms = _terms(name)
+        cost = sum(sys.getsizeof(term) + _ENTRY_OVERHEAD for term in terms) + sys.getsizeof(name) * 2
+        if self.size + cost > self.max_bytes:
+            self.truncated = True
+            return False
+        self._products[product_id] = (name, category, terms, cost)
+        if keep_sorted:
+            for term in terms:
+                bisect.insort(self._keys, (term, product_id))
+        else:
+            # Carga inicial: se añade al final y se ordena una sola vez
+            self._keys.extend((term, product_id) for term in terms)
+        self.size += cost
+        return True
+
+    def entry(self, product_id):
+        """(nombre, categoría) indexados para el producto, o None."""
+        entry = self._products.get(product_id)
+        return entry[:2] if entry is not None else None
+
+    def apply(self, change):
+        if change[0] == 'save':
+            self.add(*change[1:])
+        else:
+            self.remove(change[1])
+
+    def remove(self, product_id):
+        entry = self._products.pop(product_id, None)
+        if entry is None:
+            return
+        for term in entry[2]:
+            position = bisect.bisect_left(self._keys, (term, product_id))
+            if position < len(self._keys) and self._keys[position] == (term, product_id):
+                del self._keys[position]
+        self.size -= entry[3]
+
+    def search(self, query, limit=8):
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        results, seen = [], set()
+        position = bisect.bisect_left(self._keys, (prefix,))
+        # Tope de entradas recorridas para que el coste no dependa del catálogo
+        for term, product_id in self._keys[position:position + limit * 20]:
+            if not term.startswith(prefix):
+                break
+            entry = self._products.get(product_id)
+            if entry is not None and product_id not in seen:
+                seen.add(product_id)
+                name, category, _, _ = entry
+                results.append({'id': product_id, 'name': name, 'category': category, 'url': Product.url_for(product_id)})
+                if len(results) >= limit:
+                    break
+        return results
+
+    def __len__(self):
+        return len(self._products)
+
+
+_index = None
+_lock = threading.Lock()
+_last_check = 0.0
+_rebuilding = threading.Event()
+
+
+def current_version():
+    return cache.get(VERSION_KEY, 0)
+
+
+def _publish(change):
+    """Anota un cambio para el resto de procesos y devuelve su versión."""
+    try:
+        version = cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, 0, None)
+        version = cache.incr(VERSION_KEY)
+    cache.set(CHANGE_KEY.format(version), change, CHANGE_TTL)
+    return version
+
+
+def db_state():
+    """(número de productos, `updated_at` más reciente): cambia con altas, bajas y ediciones."""
+    state = Product.objects.aggregate(count=Count('id'), latest=Max('updated_at'))
+    return state['count'], state['latest']
+
+
+def build():
+    """Construye un índice nuevo desde la base (productos más populares primero)."""
+    index = PrefixIndex(getattr(settings, 'SEARCH_INDEX_MAX_BYTES', 8 * 1024 * 1024))
+    # Antes de leer: un cambio hecho durante la carga se vuelve a aplicar después
+    index.version = current_version()
+    if not cache_is_shared():
+        index.db_state = db_state()
+    products = Product.objects.order_by('-popularity', '-id').values_list('id', 'name', 'category')
+    for product_id, name, category in products.iterator(chunk_size=2000):
+        if not index.add(product_id, name, category, keep_sorted=False):
+            break
+    index._keys.sort()
+    if index.truncated:
+        logger.warning('Índice de búsqueda truncado a %s productos por SEARCH_INDEX_MAX_BYTES', len(index))
+    return index
+
+
+def warm():
+    global _index
+    index = build()
+    with _lock:
+        _index = index
+    return index
+
+
+def _rebuild_in_background(unless_state=None):
+    """Reconstruye en otro hilo; con `unless_state`, solo si la base ya no coincide."""
+    if _rebuilding.is_set():
+        return
+    _rebuilding.set()
+
+    def run():
+        from django.db import connection
+        try:
+            if unless_state is None or db_state() != unless_state:
+                warm()
+        except Exception:
+            logger.exception('No se pudo reconstruir el índice de búsqueda')
+        finally:
+            connection.close()
+            _rebuilding.clear()
+
+    threading.Thread(target=run, name='search-index', daemon=True).start()
+
+
+def sync(index):
+    """Aplica los cambios publicados desde `index.version`. False si faltan cambios."""
+    version = current_version()
+    if version == index.version:
+        return True
+    if version < index.version:
+        # La caché se vació: no se sabe qué cambió
+        return False
+    keys = [CHANGE_KEY.format(n) for n in range(index.version + 1, version + 1)]
+    changes = cache.get_many(keys)
+    if len(changes) < len(keys):
+        return False
+    with _lock:
+        for key in keys:
+            index.apply(changes[key])
+        index.version = version
+    return True
+
+
+def get_index():
+    """Índice del proceso, al día con los cambios de los demás procesos.
+
+    Nunca consulta la base en la petición: sin índice todavía (sin precarga
+    en `when_ready`) o si hay que reconstruirlo, lo hace un hilo aparte y
+    mientras tanto se responde con lo que haya.
+    """
+    global _last_check
+    index = _index
+    if index is None:
+        _rebuild_in_background()
+        return PrefixIndex(0)
+    now = time.monotonic()
+    if now - _last_check >= getattr(settings, 'SEARCH_INDEX_CHECK_INTERVAL', 5):
+        _last_check = now
+        stale = now - index.built_at >= getattr(settings, 'SEARCH_INDEX_MAX_AGE', 600)
+        if stale:
+            _rebuild_in_background()
+        elif index.db_state is not None:
+            # Caché local: los cambios de otros procesos solo se ven en la base
+            _rebuild_in_background(unless_state=index.db_state)
+        elif not sync(index):
+            _rebuild_in_background()
+    return index
+
+
+def product_saved(product):
+    """Tras guardar un producto: publica y aplica el cambio si afecta al índice."""
+    change = ('save', product.id, product.name, product.category)
+    index = _index
+    if index is not None and index.entry(product.id) == change[2:]:
+        # Cambió el stock, el precio, la popularidad...: nada que indexar
+        return
+    _publish(change)
+    if index is not None:
+        with _lock:
+            index.apply(change)
+
+
+def product_deleted(product_id):
+    _publish(('delete', product_id))
+    index = _index
+    if index is not None:
+        with _lock:
+            index.remove(product_id)
@@ -0,0 +1,57 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import changefeed, search_index
+from .cache import bump_catalog_generation
+from .inventory import return_order_stock
+from .models import Product, Review, Order, StockMovement
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Review)
+def invalidate_catalog_cache(sender, **kwargs):
+    """Invalida las páginas cacheadas del catálogo una vez confirmada la escritura."""
+    transaction.on_commit(bump_catalog_generation)
+
+
+@receiver(post_save, sender=Product)
+def record_initial_stock(sender, instance, created, raw=False, **kwargs):
+    """El stock con el que se crea un producto entra al libro mayor como reposición."""
+    if created and not raw and instance.stock:
+        StockMovement.objects.create(product=instance, kind='restock', quantity=instance.stock, note='Stock inicial')
+
+
+@receiver(post_save, sender=Order)
+def return_stock_on_cancel(sender, instance, created, raw=False, **kwargs):
+    """Al pasar un pedido a 'cancelled' se devuelve su stock a través del libro mayor."""
+    previous = getattr(instance, '_loaded_status', None)
+    instance._loaded_status = instance.status
+    if not created and not raw and instance.status == 'cancelled' and previous != 'cancelled':
+        return_order_stock(instance)
+
+
+@receiver(post_delete, sender=Review)
+def remove_review_from_histogram(sender, instance, **kwargs):
+    Product.apply_rating_delta(instance.product_id, removed=instance.rating)
+
+
+@receiver(post_save, sender=Product)
+def update_search_index(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Solo el nombre y la categoría están en el índice
+    if raw or (update_fields is not None and not {'name', 'category'} & set(update_fields)):
+        return
+    transaction.on_commit(lambda: search_index.product_saved(instance))
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_search_index(sender, instance, **kwargs):
+    product_id = instance.pk
+    transaction.on_commit(lambda: search_index.product_deleted(product_id))
+
+
+@receiver(post_save, sender=Product)
+def publish_product_change(sender, instance, created, raw=False, **kwargs):
+    """Cambios de precio (p. ej. desde el admin) a las páginas abiertas; el stock lo publica el inventario."""
+    if not created and not raw:
+        transaction.on_commit(lambda: changefeed.publish_products([instance.pk]))
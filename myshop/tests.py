@@ -1,15 +1,78 @@
-from django.test import TestCase, Client, override_settings
-from django.urls import reverse
+import gzip
+import io
+import json
+import os
+import re
+import runpy
+import sqlite3
+import sys
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock, skipIf
+
+from django.conf import settings
+from django.contrib import admin
 from django.contrib.auth import get_user_model
-from myshop.models import Product, Cart, CartItem, Order, OrderItem, Review
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.test import TestCase, Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from myshop import (
+    analytics, backup, changefeed, feeds, inventory, popularity, pricing, profiling, receipts, search_index,
+)
+from myshop.archive import archive_batch, archive_orders, restore_order
+from myshop.assets import minify_css
+from myshop.cache import catalog_generation, shared_cache_warning
+from myshop.feeds import build_feeds, shard_stats
+from myshop.inventory import cancel_orders, ledger_totals, record_sale, return_order_stock
+from myshop.models import (
+    Product, Cart, CartItem, Order, OrderItem, Review, ArchivedOrder, CohortRetention, CustomerSegment,
+    PriceHistory, PriceRule, StockMovement,
+)
+from myshop.routers import CatalogReplicaRouter, ReplicaPinningMiddleware, PIN_COOKIE, _pinned, use_primary
+from myshop.views import ORDERS_PER_PAGE
+from shopproject.settings import _postgres_profile
 
+try:
+    import pandas
+except ImportError:
+    pandas = None
 
 User = get_user_model()
 
 
+class TempDirMixin:
+    """Directorio temporal propio de cada test en `self.dir`, borrado al terminar."""
+
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+
+    def use_settings(self, **overrides):
+        """Aplica `override_settings` hasta el final del test."""
+        override = override_settings(**overrides)
+        override.enable()
+        self.addCleanup(override.disable)
+
+
 @override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
 class ShopIntegrationTests(TestCase):
     def setUp(self):
+        cache.clear()
         # crear usuario
         self.user = User.objects.create_user(username='buyer', password='pass123', email='buyer@example.com')
         # crear productos
@@ -68,7 +131,6 @@ class ShopIntegrationTests(TestCase):
         self.assertEqual(cart.items.count(), 0)
 
         # email enviado
-        from django.core import mail
         self.assertEqual(len(mail.outbox), 1)
 
     def test_review_submission_updates_product_rating(self):
@@ -108,3 +170,1133 @@ class ShopIntegrationTests(TestCase):
         resp = self.client.post(checkout_url, {'shipping_address': '', 'phone': ''}, follow=True)
         self.assertEqual(resp.status_code, 200)
         self.assertFalse(Order.objects.filter(user=self.user).exists())
+
+
+class AssetBundleTests(TestCase):
+    def test_minify_css_strips_comments_and_whitespace(self):
+        css = '/* comentario */\nbody {\n    margin: 0;\n    padding: 0;\n}\n'
+        self.assertEqual(minify_css(css), 'body{margin: 0;padding: 0}')
+
+    def test_pages_use_shared_cart_script(self):
+        Product.objects.create(name='Figura A', price=15.00, stock=10)
+        resp = self.client.get(reverse('myshop:index'))
+        self.assertContains(resp, 'js/cart.js')
+        self.assertNotContains(resp, 'X-CSRFToken')
+        # Las páginas anónimas no incluyen un token CSRF por visitante
+        self.assertNotContains(resp, 'name="csrf-token"')
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = Product.objects.create(name='Figura A', price=15.00, stock=10)
+        self.user = User.objects.create_user(username='buyer', password='pass123')
+
+    def test_anonymous_pages_are_cached_with_normalized_params(self):
+        url = reverse('myshop:index')
+        resp = self.client.get(url, {'sort': 'name', 'q': ''})
+        self.assertEqual(resp['X-Cache'], 'MISS')
+        # Parámetros vacíos o desconocidos no cambian la clave
+        resp = self.client.get(url, {'utm_source': 'x', 'sort': 'name'})
+        self.assertEqual(resp['X-Cache'], 'HIT')
+        self.assertContains(resp, 'Figura A')
+
+    def test_authenticated_requests_bypass_cache(self):
+        self.client.login(username='buyer', password='pass123')
+        url = reverse('myshop:product_detail', kwargs={'product_id': self.product.id})
+        self.client.get(url)
+        resp = self.client.get(url)
+        self.assertFalse(resp.has_header('X-Cache'))
+
+    def test_product_write_purges_cached_pages(self):
+        url = reverse('myshop:product_detail', kwargs={'product_id': self.product.id})
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = 'Figura renombrada'
+            self.product.save()
+        resp = self.client.get(url)
+        self.assertEqual(resp['X-Cache'], 'MISS')
+        self.assertContains(resp, 'Figura renombrada')
+
+    @override_settings(RESPONSE_CACHE_TIMEOUT=0)
+    def test_stale_entry_served_while_another_request_revalidates(self):
+        url = reverse('myshop:index')
+        self.client.get(url)
+        # Simular otra petición que tiene el lock de regeneración
+        with mock.patch('myshop.cache.cache.add', return_value=False):
+            resp = self.client.get(url)
+        self.assertEqual(resp['X-Cache'], 'STALE')
+
+    def test_startup_warns_when_workers_do_not_share_the_cache(self):
+        self.assertIn('REDIS_URL', shared_cache_warning(3))
+        self.assertIsNone(shared_cache_warning(1))
+        redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+                             'LOCATION': 'redis://localhost:6379/0'}}
+        with override_settings(CACHES=redis):
+            self.assertIsNone(shared_cache_warning(3))
+
+    def test_gunicorn_disables_the_response_cache_for_workers_without_redis(self):
+        config = Path(settings.BASE_DIR) / 'gunicorn.conf.py'
+
+        def load(env):
+            with mock.patch.dict(os.environ, env):
+                for name in ('REDIS_URL', 'RESPONSE_CACHE_ENABLED'):
+                    if name not in env:
+                        os.environ.pop(name, None)
+                exec(compile(config.read_text(encoding='utf-8'), str(config), 'exec'), {})
+                return os.environ.get('RESPONSE_CACHE_ENABLED')
+
+        self.assertEqual(load({'WEB_CONCURRENCY': '3'}), 'False')
+        self.assertIsNone(load({'WEB_CONCURRENCY': '1'}))
+        self.assertIsNone(load({'WEB_CONCURRENCY': '3', 'REDIS_URL': 'redis://localhost:6379/0'}))
+        self.assertEqual(load({'WEB_CONCURRENCY': '3', 'RESPONSE_CACHE_ENABLED': 'True'}), 'True')
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class InventoryLedgerTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='pass123', email='buyer@example.com')
+        self.product = Product.objects.create(name='Figura A', price=15.00, stock=10)
+
+    def _checkout(self, quantity):
+        self.client.login(username='buyer', password='pass123')
+        cart, _ = Cart.objects.get_or_create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=quantity)
+        self.client.post(reverse('myshop:checkout'), {'shipping_address': 'Calle 1', 'phone': '555'})
+        return Order.objects.get(user=self.user)
+
+    def test_checkout_and_cancellation_go_through_ledger(self):
+
+        order = self._checkout(3)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 7)
+        self.assertTrue(StockMovement.objects.filter(order=order, kind='sale', quantity=-3).exists())
+
+        order.status = 'cancelled'
+        order.save()
+        # Guardar de nuevo un pedido ya cancelado no devuelve el stock dos veces
+        order.save()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 10)
+        self.assertEqual(ledger_totals()[self.product.id], 10)
+
+    def test_concurrent_checkout_cannot_drive_stock_negative(self):
+
+        def sold_out_meanwhile(order, items):
+            # Otra compra se lleva casi todo entre la comprobación y el descuento
+            Product.objects.filter(pk=self.product.pk).update(stock=1)
+            return inventory.record_sale(order, items)
+
+        with mock.patch('myshop.views.record_sale', side_effect=sold_out_meanwhile):
+            self.client.login(username='buyer', password='pass123')
+            cart, _ = Cart.objects.get_or_create(user=self.user)
+            CartItem.objects.create(cart=cart, product=self.product, quantity=3)
+            resp = self.client.post(reverse('myshop:checkout'), {'shipping_address': 'Calle 1', 'phone': '555'})
+
+        self.assertRedirects(resp, reverse('myshop:cart'), fetch_redirect_response=False)
+        # Se deshace la transacción entera (aquí también la compra simulada): nunca queda en negativo
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 10)
+        self.assertFalse(Order.objects.filter(user=self.user).exists())
+        self.assertFalse(StockMovement.objects.filter(kind='sale').exists())
+        self.assertEqual(cart.items.count(), 1)
+
+    def test_bulk_cancellation_returns_stock(self):
+
+        order = self._checkout(3)
+        self.assertEqual(cancel_orders(Order.objects.filter(pk=order.pk)), 1)
+        self.assertEqual(cancel_orders(Order.objects.filter(pk=order.pk)), 0)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 10)
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'cancelled')
+
+    def test_reconcile_restores_stock_from_ledger(self):
+        Product.objects.filter(pk=self.product.pk).update(stock=99)
+        call_command('reconcile_stock', stdout=io.StringIO())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 10)
+
+
+class RateLimitTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='buyer', password='pass123')
+        self.product = Product.objects.create(name='Figura A', price=15.00, stock=10)
+
+    @override_settings(RATE_LIMITS={'login': {'ip': '2/m'}})
+    def test_login_burst_gets_429_with_retry_after(self):
+        url = reverse('myshop:login')
+        for _ in range(2):
+            resp = self.client.post(url, {'username': 'buyer', 'password': 'mala'})
+            self.assertEqual(resp.status_code, 200)
+        resp = self.client.post(url, {'username': 'buyer', 'password': 'mala'})
+        self.assertEqual(resp.status_code, 429)
+        self.assertGreater(int(resp['Retry-After']), 0)
+
+    @override_settings(CART_ADD_COALESCE_WINDOW=5, RATE_LIMITS={})
+    @mock.patch('myshop.coalesce.coalescing_window', return_value=5)  # como con Redis
+    def test_repeated_add_to_cart_is_coalesced_into_one_delta(self, window):
+        self.client.login(username='buyer', password='pass123')
+        url = reverse('myshop:add_to_cart', kwargs={'product_id': self.product.id})
+        self.client.post(url)
+        for _ in range(3):
+            resp = self.client.post(url)
+            self.assertEqual(resp.status_code, 200)
+        item = CartItem.objects.get(cart__user=self.user, product=self.product)
+        self.assertEqual(item.quantity, 1)
+        # Al ver el carrito se aplican los clics acumulados
+        self.client.get(reverse('myshop:cart'))
+        item.refresh_from_db()
+        self.assertEqual(item.quantity, 4)
+
+        # Producto borrado con clics pendientes: el carrito sigue funcionando
+        self.client.post(url)
+        Product.objects.filter(pk=self.product.pk).delete()
+        self.assertEqual(self.client.get(reverse('myshop:cart')).status_code, 200)
+
+    @override_settings(CART_ADD_COALESCE_WINDOW=5, RATE_LIMITS={})
+    def test_coalescing_is_off_with_a_per_process_cache(self):
+        self.client.login(username='buyer', password='pass123')
+        url = reverse('myshop:add_to_cart', kwargs={'product_id': self.product.id})
+        for _ in range(3):
+            self.client.post(url)
+        self.assertEqual(CartItem.objects.get(cart__user=self.user, product=self.product).quantity, 3)
+
+
+class ReviewPagingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = Product.objects.create(name='Figura A', price=15.00, stock=10)
+        self.users = [User.objects.create(username=f'user{i}') for i in range(25)]
+
+    def _review_all(self, users):
+        for user in users:
+            Review.objects.create(product=self.product, user=user, rating=user.id % 5 + 1, comment='ok')
+
+    def test_histogram_is_updated_incrementally(self):
+        review = Review.objects.create(product=self.product, user=self.users[0], rating=5, comment='ok')
+        Review.objects.create(product=self.product, user=self.users[1], rating=3, comment='ok')
+        review = Review.objects.get(pk=review.pk)
+        review.rating = 1
+        review.save()
+        self.product.refresh_from_db()
+        self.assertEqual(
+            [self.product.rating_1_count, self.product.rating_3_count, self.product.rating_5_count], [1, 1, 0]
+        )
+        self.assertEqual(float(self.product.average_rating), 2.0)
+
+        review.delete()
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.review_count, self.product.rating_1_count), (1, 0))
+        self.assertEqual(float(self.product.average_rating), 3.0)
+
+    def test_detail_query_count_does_not_grow_with_reviews(self):
+        url = reverse('myshop:product_detail', kwargs={'product_id': self.product.id})
+        self.client.force_login(self.users[0])
+        self._review_all(self.users[:2])
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(url)
+        self._review_all(self.users[2:])
+        with CaptureQueriesContext(connection) as many:
+            resp = self.client.get(url)
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(len(resp.context['reviews']), 10)
+        self.assertEqual(resp.context['user_review'].user, self.users[0])
+
+    def test_cursor_walks_every_review_once(self):
+        self._review_all(self.users)
+        url = reverse('myshop:product_detail', kwargs={'product_id': self.product.id})
+        seen, params = [], {}
+        while True:
+            resp = self.client.get(url, params)
+            seen.extend(review.id for review in resp.context['reviews'])
+            if not resp.context['next_cursor']:
+                break
+            params = {'after': resp.context['next_cursor']}
+        self.assertEqual(sorted(seen), sorted(Review.objects.values_list('id', flat=True)))
+
+
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2'])
+class ReplicaRouterTests(TestCase):
+    def setUp(self):
+        self.router = CatalogReplicaRouter()
+
+    @mock.patch.object(connection, 'in_atomic_block', False)
+    def test_catalog_reads_round_robin_and_skip_unhealthy_replicas(self):
+        with mock.patch('myshop.routers._is_healthy', return_value=True):
+            aliases = {self.router.db_for_read(Product) for _ in range(4)}
+        self.assertEqual(aliases, {'replica1', 'replica2'})
+
+        with mock.patch('myshop.routers._is_healthy', side_effect=lambda alias: alias == 'replica2'):
+            self.assertEqual({self.router.db_for_read(Review) for _ in range(4)}, {'replica2'})
+        with mock.patch('myshop.routers._is_healthy', return_value=False):
+            self.assertEqual(self.router.db_for_read(Product), 'default')
+
+    def test_writes_transactions_and_pinned_requests_use_primary(self):
+
+        self.assertIsNone(self.router.db_for_read(Order))
+        self.assertEqual(self.router.db_for_write(Product), 'default')
+        with mock.patch('myshop.routers._is_healthy', return_value=True):
+            with use_primary():
+                self.assertEqual(self.router.db_for_read(Product), 'default')
+            # TestCase ya abre una transacción: simular una petición fuera de ella
+            with mock.patch.object(connection, 'in_atomic_block', False):
+                self.assertIn(self.router.db_for_read(Product), ('replica1', 'replica2'))
+            with transaction.atomic():
+                self.assertEqual(self.router.db_for_read(Product), 'default')
+
+    def test_middleware_pins_after_a_write(self):
+
+        seen = []
+        middleware = ReplicaPinningMiddleware(lambda request: seen.append(_pinned.get()) or HttpResponse())
+        response = middleware(RequestFactory().post('/cart/add/1/'))
+        self.assertIn(PIN_COOKIE, response.cookies)
+        request = RequestFactory().get('/')
+        request.COOKIES[PIN_COOKIE] = '1'
+        middleware(request)
+        middleware(RequestFactory().get('/'))
+        self.assertEqual(seen, [True, True, False])
+
+
+class SessionWriteTests(TestCase):
+    """Consultas a django_session por petición al navegar el catálogo."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='buyer', password='pass123')
+        self.product = Product.objects.create(name='Figura A', price=15.00, stock=10)
+
+    def _browse(self):
+        self.client.login(username='buyer', password='pass123')
+        urls = [
+            reverse('myshop:index'),
+            reverse('myshop:product_detail', kwargs={'product_id': self.product.id}),
+            reverse('myshop:cart'),
+            reverse('myshop:orders'),
+        ] * 3
+        self.client.get(urls[0])  # precalentar caché de sesión
+        with CaptureQueriesContext(connection) as queries:
+            for url in urls:
+                self.client.get(url)
+            self.client.post(reverse('myshop:add_to_cart', kwargs={'product_id': self.product.id}))
+        session_queries = [q['sql'] for q in queries.captured_queries if 'django_session' in q['sql']]
+        writes = [sql for sql in session_queries if sql.startswith(('INSERT', 'UPDATE'))]
+        return len(urls) + 1, len(session_queries), len(writes)
+
+    def test_json_add_to_cart_does_not_queue_a_flash_message(self):
+        self.client.login(username='buyer', password='pass123')
+        resp = self.client.post(reverse('myshop:add_to_cart', kwargs={'product_id': self.product.id}))
+        self.assertNotIn('messages', resp.cookies)
+
+    def test_default_db_sessions_read_on_every_request(self):
+        requests, session_queries, writes = self._browse()
+        self.assertEqual(session_queries, requests)
+        self.assertEqual(writes, 0)
+
+    @override_settings(
+        SESSION_ENGINE='django.contrib.sessions.backends.cached_db',
+        MESSAGE_STORAGE='django.contrib.messages.storage.cookie.CookieStorage',
+    )
+    def test_cached_db_sessions_do_not_touch_the_database_while_browsing(self):
+        requests, session_queries, writes = self._browse()
+        self.assertEqual((session_queries, writes), (0, 0))
+
+
+class PopularityTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        popularity.flush()
+        self.a = Product.objects.create(name='Figura A', price=15.00, stock=10)
+        self.b = Product.objects.create(name='Figura B', price=10.00, stock=10)
+
+    def test_views_are_buffered_and_flushed_in_one_update(self):
+        url = reverse('myshop:product_detail', kwargs={'product_id': self.b.id})
+        with override_settings(POPULARITY_FLUSH_INTERVAL=3600):
+            for _ in range(3):
+                self.client.get(url)
+            popularity.record_cart_add(self.a.id)
+        self.b.refresh_from_db()
+        self.assertEqual(self.b.view_count, 0)
+
+        with CaptureQueriesContext(connection) as queries:
+            popularity.flush()
+        self.assertEqual(len(queries), 1)
+        self.b.refresh_from_db()
+        self.a.refresh_from_db()
+        self.assertEqual((self.b.view_count, self.a.cart_add_count), (3, 1))
+        self.assertEqual((self.b.popularity, self.a.popularity), (3.0, 5.0))
+
+        resp = self.client.get(reverse('myshop:index'), {'sort': 'popular'})
+        self.assertEqual([p.id for p in resp.context['products']], [self.a.id, self.b.id])
+
+    def test_update_popularity_decays_and_adds_recent_sales(self):
+        Product.objects.filter(pk=self.a.pk).update(popularity=100)
+        user = User.objects.create(username='buyer')
+        order = Order.objects.create(user=user, total=30, shipping_address='x', phone='1')
+        OrderItem.objects.create(order=order, product=self.b, quantity=2, price=10)
+        with override_settings(POPULARITY_HALF_LIFE_DAYS=1):
+            call_command('update_popularity', interval_hours=24, stdout=io.StringIO())
+        self.a.refresh_from_db()
+        self.b.refresh_from_db()
+        self.assertAlmostEqual(self.a.popularity, 50.0)
+        self.assertAlmostEqual(self.b.popularity, 40.0)
+
+
+class SearchSuggestTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.dragon = Product.objects.create(name='Dragón articulado', price=15.00, stock=10, category='figure')
+        self.gear = Product.objects.create(name='Engranaje de repuesto', price=5.00, stock=10, category='spare')
+
+    def test_prefix_matches_any_word_ignoring_accents(self):
+        index = search_index.warm()
+        self.assertEqual([r['id'] for r in index.search('drag')], [self.dragon.id])
+        self.assertEqual([r['id'] for r in index.search('ARTIC')], [self.dragon.id])
+        self.assertEqual([r['id'] for r in index.search('repu')], [self.gear.id])
+        self.assertEqual(index.search('x'), [])
+
+    def test_endpoint_answers_from_memory_without_queries(self):
+        search_index.warm()
+        url = reverse('myshop:search_suggest')
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get(url, {'q': 'engr'})
+        self.assertEqual(len(queries), 0)
+        data = resp.json()
+        self.assertEqual(data['products'][0]['url'], reverse('myshop:product_detail', kwargs={'product_id': self.gear.id}))
+        self.assertIn('public', resp['Cache-Control'])
+
+    def test_saves_and_deletes_update_the_index_incrementally(self):
+        index = search_index.warm()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.dragon.name = 'Wyvern articulado'
+            self.dragon.save()
+            self.gear.delete()
+        self.assertIs(search_index.get_index(), index)
+        self.assertEqual(index.search('drag'), [])
+        self.assertEqual([r['id'] for r in index.search('wyv')], [self.dragon.id])
+        self.assertEqual(index.search('engr'), [])
+
+    @override_settings(SEARCH_INDEX_CHECK_INTERVAL=0)
+    def test_other_processes_changes_are_applied_without_rebuilding(self):
+        # La caché en memoria hace aquí de caché compartida
+        shared = mock.patch.object(search_index, 'cache_is_shared', return_value=True)
+        shared.start()
+        self.addCleanup(shared.stop)
+        index = search_index.warm()
+        version = search_index.current_version()
+        # Precio y stock no tocan el índice ni su versión
+        with self.captureOnCommitCallbacks(execute=True):
+            self.dragon.price = 20
+            self.dragon.save()
+            self.dragon.stock = 3
+            self.dragon.save(update_fields=['stock'])
+        self.assertEqual(search_index.current_version(), version)
+
+        # Cambio publicado por otro proceso: se aplica sin consultas ni reconstrucción
+        search_index._publish(('save', 999, 'Kraken', 'figure'))
+        with mock.patch.object(search_index, '_rebuild_in_background') as rebuild, \
+                CaptureQueriesContext(connection) as queries:
+            self.assertIs(search_index.get_index(), index)
+        rebuild.assert_not_called()
+        self.assertEqual(len(queries), 0)
+        self.assertEqual([r['id'] for r in index.search('krak')], [999])
+
+        # Si se perdieron cambios, se reconstruye en segundo plano
+        search_index._publish(('delete', 999))
+        cache.delete(search_index.CHANGE_KEY.format(search_index.current_version()))
+        with mock.patch.object(search_index, '_rebuild_in_background') as rebuild:
+            self.assertIs(search_index.get_index(), index)
+        rebuild.assert_called_once()
+
+    @override_settings(SEARCH_INDEX_CHECK_INTERVAL=0)
+    def test_without_a_shared_cache_other_processes_changes_are_read_from_the_database(self):
+        index = search_index.warm()
+        self.assertEqual(index.db_state, search_index.db_state())
+        # Otro worker renombra: su registro de cambios se queda en su propia caché
+        Product.objects.filter(pk=self.dragon.pk).update(
+            name='Wyvern articulado', updated_at=timezone.now() + timedelta(seconds=1),
+        )
+        self.assertNotEqual(search_index.db_state(), index.db_state)
+        with mock.patch.object(search_index, '_rebuild_in_background') as rebuild, \
+                CaptureQueriesContext(connection) as queries:
+            self.assertIs(search_index.get_index(), index)
+        # La comprobación contra la base la hace el hilo de reconstrucción, no la petición
+        self.assertEqual(len(queries), 0)
+        rebuild.assert_called_once_with(unless_state=index.db_state)
+        self.assertEqual([r['id'] for r in search_index.build().search('wyv')], [self.dragon.id])
+
+    def test_memory_budget_keeps_the_most_popular_products(self):
+        Product.objects.filter(pk=self.gear.pk).update(popularity=10)
+        with override_settings(SEARCH_INDEX_MAX_BYTES=800):
+            index = search_index.build()
+        self.assertTrue(index.truncated)
+        self.assertLessEqual(index.size, 800)
+        self.assertEqual([r['id'] for r in index.search('engr')], [self.gear.id])
+        self.assertEqual(index.search('drag'), [])
+
+
+class ProfilingTests(TempDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.use_settings(PROFILING_DIR=self.dir, PROFILING_SAMPLE_RATE=0)
+        self.staff = User.objects.create_user(username='admin', password='pass123', is_staff=True)
+        Product.objects.create(name='Figura A', price=15.00, stock=10)
+
+    def test_flag_is_ignored_for_non_staff_users(self):
+        resp = self.client.get(reverse('myshop:index'), {'_profile': '1'})
+        self.assertNotIn('X-Profile-Id', resp)
+        self.assertEqual(profiling.list_profiles(), [])
+
+    def test_staff_flag_stores_a_collapsed_stack_profile(self):
+        self.client.login(username='admin', password='pass123')
+        with override_settings(PROFILING_SAMPLE_INTERVAL=0.0005):
+            resp = self.client.get(reverse('myshop:index'), {'_profile': '1'})
+        [meta] = profiling.list_profiles()
+        self.assertEqual(resp['X-Profile-Id'], meta['id'])
+        self.assertEqual((meta['view'], meta['mode'], meta['status']), ('myshop:index', 'sample', 200))
+        self.assertGreater(meta['sql_count'], 0)
+        self.assertTrue(meta['file'].endswith('.collapsed'))
+
+        listing = self.client.get(reverse('profile_list'))
+        self.assertContains(listing, meta['file'])
+        download = self.client.get(reverse('profile_download', args=[meta['file']]))
+        self.assertEqual(download.status_code, 200)
+
+    def test_signed_header_profiles_anonymous_requests_with_cprofile(self):
+        resp = self.client.get(reverse('myshop:index'), HTTP_X_PROFILE=profiling.make_token('cprofile'))
+        [meta] = profiling.list_profiles()
+        self.assertEqual((resp['X-Profile-Id'], meta['mode']), (meta['id'], 'cprofile'))
+
+        resp = self.client.get(reverse('myshop:index'), HTTP_X_PROFILE='cprofile:forjado:firma')
+        self.assertNotIn('X-Profile-Id', resp)
+
+    def test_listing_is_staff_only(self):
+        resp = self.client.get(reverse('profile_list'))
+        self.assertEqual(resp.status_code, 302)
+
+
+class OrderArchiveTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='buyer', password='pass123')
+        self.product = Product.objects.create(name='Figura A', price=15.00, stock=10)
+        self.old = self._order('delivered', timezone.now() - timedelta(days=400))
+        self.recent = self._order('delivered', timezone.now())
+        self.old_pending = self._order('pending', timezone.now() - timedelta(days=400))
+
+    def _order(self, status, created_at):
+        order = Order.objects.create(user=self.user, total=30, shipping_address='Calle 1', phone='123', status=status)
+        OrderItem.objects.create(order=order, product=self.product, quantity=2, price=15)
+        Order.objects.filter(pk=order.pk).update(created_at=created_at)
+        return order
+
+    def test_archives_only_old_finished_orders_in_batches(self):
+        out = io.StringIO()
+        call_command('archive_orders', before_days=365, batch_size=1, stdout=out)
+        self.assertEqual(list(ArchivedOrder.objects.values_list('id', flat=True)), [self.old.id])
+        self.assertEqual(set(Order.objects.values_list('id', flat=True)), {self.recent.id, self.old_pending.id})
+        self.assertFalse(OrderItem.objects.filter(order_id=self.old.id).exists())
+        archived = ArchivedOrder.objects.get()
+        self.assertEqual([(line.product.name, line.quantity, line.get_cost) for line in archived.lines],
+                         [('Figura A', 2, 30)])
+
+    def test_order_pages_fall_back_to_the_archive(self):
+        list(archive_orders(timezone.now() - timedelta(days=365)))
+        self.client.login(username='buyer', password='pass123')
+        resp = self.client.get(reverse('myshop:order_detail', kwargs={'order_id': self.old.id}))
+        self.assertContains(resp, 'Pedido archivado')
+        self.assertContains(resp, 'Figura A')
+        resp = self.client.get(reverse('myshop:orders'))
+        self.assertEqual([o.id for o in resp.context['orders']], [self.recent.id, self.old_pending.id])
+        self.assertEqual([o.id for o in resp.context['archived']], [self.old.id])
+        self.assertContains(resp, 'Pedidos archivados')
+
+        other = User.objects.create_user(username='other', password='pass123')
+        self.client.force_login(other)
+        resp = self.client.get(reverse('myshop:order_detail', kwargs={'order_id': self.old.id}))
+        self.assertEqual(resp.status_code, 404)
+
+    def test_order_lists_are_paginated_in_the_database(self):
+        for _ in range(ORDERS_PER_PAGE):
+            self._order('pending', timezone.now())
+        # Se archivan los dos entregados; quedan activos old_pending y los nuevos
+        list(archive_orders(timezone.now()))
+        self.client.login(username='buyer', password='pass123')
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get(reverse('myshop:orders'), {'page': 2})
+        self.assertEqual([o.id for o in resp.context['orders']], [self.old_pending.id])
+        self.assertEqual([o.id for o in resp.context['archived']], [self.recent.id, self.old.id])
+        listing = [q['sql'] for q in queries if 'ORDER BY' in q['sql'] and 'created_at' in q['sql']]
+        self.assertTrue(listing)
+        self.assertTrue(all('LIMIT' in sql for sql in listing))
+
+    def test_restore_brings_back_the_original_order(self):
+        created_at = Order.objects.get(pk=self.old.pk).created_at
+        list(archive_orders(timezone.now() - timedelta(days=365)))
+        call_command('restore_orders', self.old.id, stdout=io.StringIO())
+        self.assertFalse(ArchivedOrder.objects.exists())
+        order = Order.objects.get(pk=self.old.id)
+        self.assertEqual((order.status, order.created_at, order.items.get().quantity), ('delivered', created_at, 2))
+
+    def test_restored_cancelled_order_does_not_return_stock_twice(self):
+        order = self._order('cancelled', timezone.now() - timedelta(days=400))
+        record_sale(order, order.items.all())
+        return_order_stock(order)
+        list(archive_orders(timezone.now() - timedelta(days=365)))
+        self.assertFalse(StockMovement.objects.filter(order=order.pk).exists())
+
+        restore_order(ArchivedOrder.objects.get(pk=order.pk))
+        self.assertEqual(StockMovement.objects.filter(order=order.pk).count(), 2)
+        order = Order.objects.get(pk=order.pk)
+        order.status = 'pending'
+        order.save()
+        order.status = 'cancelled'
+        order.save()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 10)
+
+    def test_batch_skips_orders_that_no_longer_match(self):
+        cutoff = timezone.now() - timedelta(days=365)
+        # Reabierto después de elegir el lote
+        Order.objects.filter(pk=self.old.pk).update(status='processing')
+        self.assertEqual(archive_batch([self.old.id, self.recent.id, self.old_pending.id], cutoff)[0], 0)
+        self.assertEqual(Order.objects.count(), 3)
+
+
+class BackupTests(TempDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.source = self.dir / 'shop.sqlite3'
+        db = sqlite3.connect(self.source)
+        db.execute('CREATE TABLE t (id INTEGER PRIMARY KEY, v TEXT)')
+        db.executemany('INSERT INTO t (v) VALUES (?)', [('x' * 500,)] * 2000)
+        db.commit()
+        db.close()
+
+    def test_command_writes_a_verified_compressed_snapshot_and_prunes(self):
+        out_dir = self.dir / 'backups'
+        out_dir.mkdir()
+        for stamp in ('20200101-000000', '20200102-000000'):
+            (out_dir / f'db-{stamp}.sqlite3.gz').write_bytes(b'')
+        out = io.StringIO()
+        call_command('backup_db', source=str(self.source), output_dir=str(out_dir), pages=8, sleep=0,
+                     keep=2, stdout=out)
+        self.assertIn('Espera máxima de un escritor', out.getvalue())
+        snapshots = sorted(p.name for p in out_dir.iterdir())
+        self.assertEqual(len(snapshots), 2)
+        self.assertEqual(snapshots[0], 'db-20200102-000000.sqlite3.gz')
+
+        restored = self.dir / 'restored.sqlite3'
+        restored.write_bytes(gzip.decompress((out_dir / snapshots[1]).read_bytes()))
+        db = sqlite3.connect(restored)
+        self.assertEqual(db.execute('SELECT count(*) FROM t').fetchone()[0], 2000)
+        db.close()
+
+    def test_concurrent_writes_force_a_final_single_step_copy(self):
+        writer = sqlite3.connect(self.source, check_same_thread=False)
+        def progress_writer(*args):
+            # Un checkout entre cada paso de la copia
+            writer.execute('INSERT INTO t (v) VALUES (?)', ('y' * 5000,))
+            writer.commit()
+        with mock.patch.object(backup.time, 'sleep', side_effect=progress_writer):
+            result = backup.online_backup(self.source, self.dir / 'copy.sqlite3', pages=8, sleep=0.01,
+                                          probe=False, max_restarts=2)
+        writer.close()
+        self.assertTrue(result.forced)
+        self.assertEqual(result.restarts, 3)
+        self.assertEqual(backup.integrity_check(self.dir / 'copy.sqlite3'), 'ok')
+
+    def test_probe_counts_real_writers_apart_from_stalls(self):
+        writer = sqlite3.connect(self.source, isolation_level=None)
+        writer.execute('BEGIN EXCLUSIVE')
+        probe = backup.WriterStallProbe(self.source, interval=0.01, timeout=0.05)
+        probe.start()
+        # Una transacción larga de otro escritor: la sonda se rinde y no la anota como espera
+        time.sleep(0.3)
+        writer.execute('ROLLBACK')
+        writer.close()
+        time.sleep(0.05)
+        probe.stop()
+        self.assertGreaterEqual(probe.contended, 2)
+        self.assertTrue(probe.stalls)
+        self.assertLess(max(probe.stalls), 0.2)
+
+
+@override_settings(CHANGEFEED_BROKER='myshop.changefeed.InProcessBroker')
+class ChangeFeedTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='buyer', password='pass123')
+        self.product = Product.objects.create(name='Figura A', price=15.00, stock=3)
+
+    def test_checkout_publishes_the_new_stock(self):
+        subscription = changefeed.subscribe([self.product.id])
+        self.addCleanup(subscription.close)
+        self.client.login(username='buyer', password='pass123')
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('myshop:checkout'), {'shipping_address': 'Calle 1', 'phone': '123'})
+        self.assertEqual(subscription.get(timeout=0), {'id': self.product.id, 'stock': 1, 'price': '15.00'})
+
+    def test_stream_sends_snapshot_then_changes(self):
+        with override_settings(CHANGEFEED_KEEPALIVE=1, CHANGEFEED_MAX_STREAM_SECONDS=2):
+            resp = self.client.get(reverse('myshop:product_stream'), {'ids': f'{self.product.id},999999'})
+        self.addCleanup(resp.close)
+        self.assertEqual(resp['Content-Type'], 'text/event-stream')
+        chunks = iter(resp.streaming_content)
+        self.assertTrue(next(chunks).startswith(b'retry:'))
+        snapshot = next(chunks).decode()
+        self.assertEqual(json.loads(snapshot.split('data: ')[1])['stock'], 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.price = 12
+            self.product.save()
+        event = json.loads(next(chunks).decode().split('data: ')[1])
+        self.assertEqual((event['id'], event['price']), (self.product.id, '12.00'))
+
+    def test_stream_subscription_is_released_when_the_response_is_closed(self):
+        url = reverse('myshop:product_stream')
+        # Respuesta descartada sin llegar a enviarse
+        self.client.get(url, {'ids': self.product.id}).close()
+        self.assertEqual(len(changefeed.hub), 0)
+
+        resp = self.client.get(url, {'ids': self.product.id})
+        next(iter(resp.streaming_content))
+        self.assertEqual(len(changefeed.hub), 1)
+        resp.close()
+        self.assertEqual(len(changefeed.hub), 0)
+
+    @override_settings(CHANGEFEED_MAX_STREAMS=1)
+    def test_streams_over_the_per_process_limit_are_refused(self):
+        subscription = changefeed.subscribe([self.product.id])
+        self.addCleanup(subscription.close)
+        resp = self.client.get(reverse('myshop:product_stream'), {'ids': self.product.id})
+        # Estado actual y reconexión más tarde (sondeo), no un 204 que deja la página estática
+        self.assertEqual(resp.status_code, 200)
+        self.assertFalse(resp.streaming)
+        body = resp.content.decode()
+        self.assertTrue(body.startswith('retry: 30000\n\n'))
+        self.assertIn('"stock": 3', body)
+        self.assertEqual(len(changefeed.hub), 1)
+
+    @override_settings(CHANGEFEED_BROKER='myshop.changefeed.CacheBroker')
+    def test_cache_broker_is_disabled_with_a_per_process_cache(self):
+        broker = changefeed.CacheBroker(changefeed.Hub())
+        self.assertFalse(broker.live)
+        broker.publish([{'id': self.product.id, 'stock': 0, 'price': '15.00'}])
+        self.assertIsNone(cache.get(changefeed.SEQUENCE_KEY))
+
+        resp = self.client.get(reverse('myshop:product_stream'), {'ids': self.product.id})
+        self.assertFalse(resp.streaming)
+        self.assertIn('"stock": 3', resp.content.decode())
+        self.assertEqual(len(changefeed.hub), 0)
+
+    def test_cache_broker_reads_the_feed_once_per_process(self):
+        hub = changefeed.Hub()
+        broker = changefeed.CacheBroker(hub)
+        # La caché en memoria hace aquí de caché compartida (un solo proceso)
+        broker.live = True
+        broker._last_seen = 0
+        subscriptions = [hub.subscribe([self.product.id]) for _ in range(3)]
+        broker.publish([{'id': self.product.id, 'stock': 0, 'price': '15.00'}])
+        with mock.patch.object(changefeed.cache, 'get_many', wraps=changefeed.cache.get_many) as get_many:
+            self.assertEqual(broker.poll(), 1)
+            self.assertEqual(broker.poll(), 0)
+        self.assertEqual(get_many.call_count, 1)
+        self.assertEqual([s.get(timeout=0)['stock'] for s in subscriptions], [0, 0, 0])
+
+
+class FeedTests(TempDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.use_settings(FEEDS_DIR=self.dir, FEEDS_SHARD_SIZE=2, SITE_URL='https://tienda.test')
+        self.products = [Product.objects.create(name=f'Figura {n}', price=10, stock=n) for n in range(5)]
+
+    def _read(self, name):
+        return gzip.decompress((self.dir / name).read_bytes()).decode()
+
+    def test_only_shards_with_changed_products_are_rewritten(self):
+        shards = sorted(shard_stats(2))
+        self.assertEqual(build_feeds()[0], shards)
+        self.assertEqual(build_feeds()[0], [])
+
+        changed = self.products[-1]
+        changed.price = 12
+        changed.save()
+        rewritten, unchanged, removed = build_feeds()
+        self.assertEqual(rewritten, [changed.id // 2])
+        self.assertIn('12.00 USD', self._read(f'feed-{changed.id // 2:04d}.csv.gz'))
+
+        # Un shard sin productos pierde sus archivos
+        emptied = self.products[0].id // 2
+        Product.objects.filter(id__gte=emptied * 2, id__lt=emptied * 2 + 2).delete()
+        self.assertEqual(build_feeds()[2], [emptied])
+        self.assertFalse((self.dir / f'feed-{emptied:04d}.csv.gz').exists())
+
+    def test_oversized_shard_leaves_no_partial_files(self):
+        feeds.build_feeds()
+        published = sorted(path.name for path in self.dir.iterdir())
+        self.products[0].save()
+        with mock.patch.object(feeds, 'MAX_SITEMAP_BYTES', 100), self.assertRaises(ValueError):
+            feeds.build_feeds()
+        self.assertEqual(sorted(path.name for path in self.dir.iterdir()), published)
+
+    def test_long_descriptions_do_not_hit_the_sitemap_size_limit(self):
+        Product.objects.filter(pk=self.products[0].pk).update(description='x' * 5000)
+        # El sitemap del shard cabe; el CSV lo supera y no tiene límite de bytes
+        with mock.patch.object(feeds, 'MAX_SITEMAP_BYTES', 2000):
+            feeds.build_feeds()
+        shard = self.products[0].id // 2
+        self.assertIn('x' * 5000, self._read(f'feed-{shard:04d}.csv.gz'))
+
+    def test_product_urls_come_from_the_model(self):
+        product = self.products[0]
+        self.assertEqual(product.get_absolute_url(), reverse('myshop:product_detail', kwargs={'product_id': product.id}))
+        self.assertEqual(Product.url_for(product.id), product.get_absolute_url())
+
+    def test_sitemap_is_served_from_disk_with_last_modified(self):
+        build_feeds()
+        with self.assertNumQueries(0):
+            resp = self.client.get('/sitemap.xml')
+        self.assertEqual(resp.status_code, 200)
+        index = b''.join(resp.streaming_content).decode()
+        self.assertIn('https://tienda.test/sitemap-', index)
+
+        shard = self.products[0].id // 2
+        resp = self.client.get(f'/sitemap-{shard:04d}.xml.gz')
+        self.assertEqual(resp['Content-Type'], 'application/gzip')
+        self.assertIn(f'https://tienda.test/product/{self.products[0].id}/', self._read(f'sitemap-{shard:04d}.xml.gz'))
+        resp = self.client.get(f'/sitemap-{shard:04d}.xml.gz', HTTP_IF_MODIFIED_SINCE=resp['Last-Modified'])
+        self.assertEqual(resp.status_code, 304)
+
+
+@skipIf(pandas is None, 'pandas no está instalado (requirements-tools.txt)')
+class CustomerAnalyticsTests(TestCase):
+    def _order(self, user, days_ago, total=10, status='delivered'):
+        order = Order.objects.create(user=user, total=total, shipping_address='x', phone='1', status=status)
+        Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - timedelta(days=days_ago))
+
+    def test_segments_and_cohorts_are_stored_for_the_admin(self):
+        loyal = User.objects.create(username='loyal')
+        lapsed = User.objects.create(username='lapsed')
+        newcomer = User.objects.create(username='newcomer')
+        for days_ago in (1, 35, 70, 100):
+            self._order(loyal, days_ago, total=50)
+        self._order(lapsed, 400)
+        self._order(lapsed, 10, status='cancelled')
+        self._order(newcomer, 2)
+        for n in range(4):
+            self._order(User.objects.create(username=f'other{n}'), 20 + n * 10)
+
+        call_command('analyze_customers', chunk_size=2, stdout=io.StringIO())
+        segments = {s.user.username: s for s in CustomerSegment.objects.select_related('user')}
+        self.assertEqual(segments['loyal'].frequency, 4)
+        self.assertEqual(segments['loyal'].monetary, 200)
+        self.assertEqual(segments['loyal'].segment, 'champions')
+        self.assertEqual(segments['lapsed'].segment, 'lost')
+        self.assertEqual(segments['lapsed'].frequency, 1)
+        self.assertEqual(segments['newcomer'].segment, 'new')
+
+        first_cohort = CohortRetention.objects.filter(months_since=0).order_by('cohort').first()
+        self.assertEqual((first_cohort.customers, first_cohort.rate), (1, 1.0))
+
+        staff = User.objects.create_user(username='admin', password='pass123', is_staff=True, is_superuser=True)
+        self.client.force_login(staff)
+        resp = self.client.get(reverse('admin:myshop_cohortretention_changelist'))
+        self.assertContains(resp, '100%')
+        resp = self.client.get(reverse('admin:myshop_customersegment_changelist'))
+        self.assertContains(resp, 'Campeones')
+
+    def test_chunked_result_matches_a_single_chunk(self):
+        users = [User.objects.create(username=f'u{n}') for n in range(6)]
+        for n, user in enumerate(users):
+            for days_ago in range(0, 300, 40 + n * 15):
+                self._order(user, days_ago, total=5 + n)
+        whole = analytics.compute(chunk_size=10000)
+        chunked = analytics.compute(chunk_size=3)
+        self.assertEqual(whole[2], chunked[2])
+        self.assertTrue(whole[0].sort_index().equals(chunked[0].sort_index()))
+        key = ['cohort', 'months_since']
+        self.assertTrue(whole[1].sort_values(key).reset_index(drop=True).equals(
+            chunked[1].sort_values(key).reset_index(drop=True)))
+
+
+class ReceiptTests(TempDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.use_settings(RECEIPTS_DIR=self.dir, RECEIPTS_SENDFILE_HEADER='')
+        self.user = User.objects.create_user(username='buyer', password='pass123')
+        self.product = Product.objects.create(name='Engranaje (M2)', price=15.00, stock=10)
+        self.order = Order.objects.create(user=self.user, total=30, shipping_address='Calle Mayor 1\nMadrid',
+                                          phone='123', status='delivered')
+        self.item = OrderItem.objects.create(order=self.order, product=self.product, quantity=2, price=15)
+
+    def _pdfs(self):
+        return sorted(path.name for path in self.dir.rglob('*.pdf'))
+
+    def test_pdf_is_well_formed(self):
+        data = receipts.receipt_data(self.order)
+        data['lines'] *= 80  # varias páginas
+        pdf = receipts.render_pdf(data)
+        self.assertEqual(pdf, receipts.render_pdf(data))
+        self.assertIn(rb'(Engranaje \(M2\))', pdf)
+        self.assertIn('(Envío: Calle Mayor 1)'.encode('cp1252'), pdf)
+        self.assertEqual(pdf.count(b'/Type /Page '), 3)
+        # Cada entrada de la tabla xref apunta a su objeto
+        start = int(re.search(rb'startxref\n(\d+)', pdf).group(1))
+        self.assertTrue(pdf[start:].startswith(b'xref'))
+        offsets = [int(offset) for offset in re.findall(rb'(\d{10}) 00000 n', pdf)]
+        for number, offset in enumerate(offsets, 1):
+            self.assertTrue(pdf[offset:].startswith(b'%d 0 obj' % number))
+
+    def test_receipt_is_cached_until_the_order_changes(self):
+        url = reverse('myshop:order_receipt', args=[self.order.id])
+        self.client.login(username='buyer', password='pass123')
+        resp = self.client.get(url)
+        self.assertEqual(resp['Content-Type'], 'application/pdf')
+        self.assertTrue(b''.join(resp.streaming_content).startswith(b'%PDF-1.4'))
+        first = self._pdfs()
+        self.assertEqual(len(first), 1)
+
+        with mock.patch.object(receipts, 'render_pdf') as render:
+            self.client.get(url)
+        render.assert_not_called()
+
+        self.item.quantity = 3
+        self.item.save()
+        self.client.get(url)
+        # La versión anterior se acaba de servir: se conserva durante RECEIPTS_STALE_GRACE
+        self.assertEqual(len(self._pdfs()), 2)
+        with override_settings(RECEIPTS_STALE_GRACE=0):
+            self.client.get(url)
+        self.assertEqual(len(self._pdfs()), 1)
+        self.assertNotEqual(self._pdfs(), first)
+
+        other = User.objects.create_user(username='other', password='pass123')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_concurrent_writers_and_readers_of_a_receipt(self):
+        data = receipts.receipt_data(Order.objects.prefetch_related('items__product').get(pk=self.order.pk))
+        # Varios hilos del mismo proceso generan a la vez el mismo recibo
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            paths = {path for path, _ in pool.map(receipts.write_receipt, [data] * 32)}
+        [path] = paths
+        self.assertEqual([entry.name for entry in Path(path).parent.iterdir()], [Path(path).name])
+
+        # Otro hilo borra la versión recién escrita antes de abrirla: se regenera
+        real_write = receipts.write_receipt
+
+        def write_then_lose(data, directory=None):
+            path, created = real_write(data, directory)
+            if write.call_count == 1:
+                Path(path).unlink()
+            return path, created
+
+        with mock.patch.object(receipts, 'write_receipt', side_effect=write_then_lose) as write:
+            path, source = receipts.open_receipt(data)
+        with source:
+            self.assertTrue(source.read().startswith(b'%PDF-1.4'))
+        self.assertEqual(write.call_count, 2)
+
+    def test_receipt_keeps_the_customer_details_of_the_order(self):
+        Order.objects.filter(pk=self.order.pk).update(customer_name='Ana Pérez', customer_email='ana@example.com')
+        order = Order.objects.prefetch_related('items__product').get(pk=self.order.pk)
+        data = receipts.receipt_data(order)
+        self.assertEqual((data['customer'], data['email']), ('Ana Pérez', 'ana@example.com'))
+
+        self.user.first_name, self.user.email = 'Otro', 'otro@example.com'
+        self.user.save()
+        self.assertEqual(receipts.receipt_data(Order.objects.get(pk=self.order.pk)), data)
+        archive_batch([self.order.pk], timezone.now())
+        self.assertEqual(receipts.receipt_data(ArchivedOrder.objects.get(pk=self.order.pk)), data)
+
+    def test_checkout_stores_the_customer_details(self):
+        self.user.first_name, self.user.last_name, self.user.email = 'Ana', 'Pérez', 'ana@example.com'
+        self.user.save()
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=1)
+        self.client.login(username='buyer', password='pass123')
+        self.client.post(reverse('myshop:checkout'), {'shipping_address': 'Calle 1', 'phone': '600'})
+        order = Order.objects.latest('id')
+        self.assertEqual((order.customer_name, order.customer_email), ('Ana Pérez', 'ana@example.com'))
+
+    @override_settings(RECEIPTS_SENDFILE_HEADER='X-Accel-Redirect', RECEIPTS_ACCEL_PREFIX='/protected/receipts/')
+    def test_sendfile_header_leaves_the_transfer_to_the_web_server(self):
+        self.client.login(username='buyer', password='pass123')
+        resp = self.client.get(reverse('myshop:order_receipt', args=[self.order.id]))
+        self.assertEqual(resp.content, b'')
+        self.assertRegex(resp['X-Accel-Redirect'], rf'^/protected/receipts/0/{self.order.id}/[0-9a-f]+\.pdf$')
+
+    def test_batch_command_and_monthly_zip_include_archived_orders(self):
+        old = Order.objects.create(user=self.user, total=15, shipping_address='x', phone='1', status='delivered')
+        OrderItem.objects.create(order=old, product=self.product, quantity=1, price=15)
+        created = timezone.now() - timedelta(days=400)
+        Order.objects.filter(pk=old.pk).update(created_at=created)
+        Order.objects.filter(pk=self.order.pk).update(created_at=created + timedelta(minutes=1))
+        call_command('archive_orders', before_days=365, stdout=io.StringIO())
+        self.assertFalse(Order.objects.filter(pk=old.pk).exists())
+
+        out = io.StringIO()
+        month = timezone.localtime(created).strftime('%Y-%m')
+        call_command('build_receipts', month=month, workers=2, stdout=out)
+        self.assertIn('2 recibo(s) generados', out.getvalue())
+        call_command('build_receipts', month=month, workers=1, stdout=out)
+        self.assertIn('0 recibo(s) generados y 2 ya en caché', out.getvalue())
+
+        staff = User.objects.create_user(username='admin', password='pass123', is_staff=True)
+        self.client.force_login(staff)
+        local = timezone.localtime(created)
+        resp = self.client.get(reverse('receipt_bundle', args=[local.year, local.month]))
+        bundle = zipfile.ZipFile(io.BytesIO(b''.join(resp.streaming_content)))
+        self.assertEqual(sorted(bundle.namelist()), sorted(f'recibo-{pk}.pdf' for pk in (old.pk, self.order.pk)))
+        self.assertTrue(bundle.read(f'recibo-{old.pk}.pdf').startswith(b'%PDF'))
+
+
+class PriceRuleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.figures = [Product.objects.create(name=f'Figura {n}', price=10, category='figure') for n in range(3)]
+        self.spare = Product.objects.create(name='Repuesto', price=8, category='spare')
+        self.past = timezone.now() - timedelta(hours=1)
+
+    def _prices(self):
+        return {product.name: product.price for product in Product.objects.all()}
+
+    def test_apply_is_set_based_and_revert_keeps_later_changes(self):
+        rule = PriceRule.objects.create(name='Rebajas', kind='percent', value=-15, category='figure',
+                                        starts_at=self.past)
+        generation = catalog_generation()
+        with self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as few:
+                self.assertEqual(pricing.apply_rule(rule), 3)
+        self.assertGreater(catalog_generation(), generation)
+        self.assertEqual(pricing.apply_rule(rule), 0)
+
+        prices = self._prices()
+        self.assertEqual(prices['Figura 0'], Decimal('8.50'))
+        self.assertEqual(prices['Repuesto'], Decimal('8.00'))
+        self.assertEqual(rule.history.filter(new_price=Decimal('8.50')).count(), 3)
+
+        # Mismo número de consultas con más productos
+        for n in range(3, 20):
+            Product.objects.create(name=f'Figura {n}', price=10, category='figure')
+        bigger = PriceRule.objects.create(name='Más', kind='fixed', value=-1, category='figure', starts_at=self.past)
+        with CaptureQueriesContext(connection) as many:
+            self.assertEqual(pricing.apply_rule(bigger), 20)
+        self.assertEqual(len(many), len(few))
+
+        self.assertEqual(pricing.revert_rule(bigger), (20, 0))
+        manual = self.figures[0]
+        manual.price = 12
+        manual.save()
+        self.assertEqual(pricing.revert_rule(rule), (2, 1))
+        prices = self._prices()
+        self.assertEqual((prices['Figura 0'], prices['Figura 1'], prices['Figura 19']),
+                         (Decimal('12.00'), Decimal('10.00'), Decimal('10.00')))
+
+    def test_command_applies_and_reverts_on_schedule(self):
+        sale = PriceRule.objects.create(name='Fin de semana', kind='fixed', value=-9.99, name_contains='repuesto',
+                                        starts_at=self.past, ends_at=timezone.now() + timedelta(days=2))
+        future = PriceRule.objects.create(name='Navidad', value=10, starts_at=timezone.now() + timedelta(days=30))
+        out = io.StringIO()
+        call_command('apply_price_rules', stdout=out)
+        self.assertIn('Aplicada "Fin de semana": 1 productos', out.getvalue())
+        self.assertEqual(Product.objects.get(pk=self.spare.pk).price, Decimal('0.01'))
+        future.refresh_from_db()
+        self.assertIsNone(future.applied_at)
+
+        PriceRule.objects.filter(pk=sale.pk).update(ends_at=timezone.now() - timedelta(minutes=1))
+        call_command('apply_price_rules', stdout=out)
+        self.assertIn('Revertida "Fin de semana": 1 productos', out.getvalue())
+        self.assertEqual(Product.objects.get(pk=self.spare.pk).price, Decimal('8.00'))
+        self.assertEqual(sale.history.get().old_price, Decimal('8.00'))
+
+    def test_overlapping_rules_restore_the_original_price(self):
+        product = Product.objects.create(name='Dragón', price=100, category='custom')
+        first = PriceRule.objects.create(name='A', kind='percent', value=-10, category='custom', starts_at=self.past)
+        second = PriceRule.objects.create(name='B', kind='percent', value=-50, category='custom', starts_at=self.past)
+        pricing.apply_rule(first)
+        pricing.apply_rule(second)
+        product.refresh_from_db()
+        self.assertEqual(product.price, Decimal('45.00'))
+
+        # A termina antes: el precio sigue siendo el de B, que hereda el precio de antes de A
+        self.assertEqual(pricing.revert_rule(first), (0, 1))
+        product.refresh_from_db()
+        self.assertEqual(product.price, Decimal('45.00'))
+        self.assertEqual(pricing.revert_rule(second), (1, 0))
+        product.refresh_from_db()
+        self.assertEqual(product.price, Decimal('100.00'))
+
+    def test_stock_ledger_and_price_history_are_read_only_in_admin(self):
+        request = RequestFactory().get('/')
+        request.user = User.objects.create_superuser(username='admin', password='pass123')
+        for model in (StockMovement, PriceHistory):
+            model_admin = admin.site._registry[model]
+            self.assertFalse(model_admin.has_change_permission(request), model)
+            self.assertFalse(model_admin.has_delete_permission(request), model)
+        self.assertFalse(admin.site._registry[PriceHistory].has_add_permission(request))
+
+
+class PostgresProfileTests(TestCase):
+    def _profile(self, env, url='postgres://shop:secret@db:5432/shop'):
+        db = {'ENGINE': 'django.db.backends.postgresql', 'NAME': 'shop', 'OPTIONS': {}}
+        with mock.patch.dict(os.environ, env, clear=False):
+            for name in ('DB_POOL', 'DB_CONN_MAX_AGE', 'DB_STATEMENT_TIMEOUT_MS'):
+                if name not in env:
+                    os.environ.pop(name, None)
+            return _postgres_profile(db)
+
+    def test_persistent_connections_with_health_checks_by_default(self):
+        db = self._profile({})
+        self.assertEqual((db['CONN_MAX_AGE'], db['CONN_HEALTH_CHECKS']), (60, True))
+        self.assertNotIn('pool', db['OPTIONS'])
+        self.assertNotIn('options', db['OPTIONS'])
+        sqlite = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': 'x'}
+        self.assertEqual(_postgres_profile(dict(sqlite)), sqlite)
+
+    def test_pool_and_statement_timeout(self):
+        db = self._profile({'DB_POOL': 'True', 'DB_STATEMENT_TIMEOUT_MS': '5000', 'GUNICORN_THREADS': '8'})
+        self.assertEqual(db['CONN_MAX_AGE'], 0)
+        self.assertEqual(db['OPTIONS']['pool']['max_size'], 8)
+        self.assertEqual(db['OPTIONS']['options'], '-c statement_timeout=5000')
+
+    def test_pool_shape_and_existing_libpq_options(self):
+        db = {'ENGINE': 'django.db.backends.postgresql', 'NAME': 'shop',
+              'OPTIONS': {'options': '-c search_path=shop'}}
+        env = {'DB_POOL': 'True', 'DB_CONN_MAX_AGE': '600', 'DB_STATEMENT_TIMEOUT_MS': '30000',
+               'DB_POOL_MIN_SIZE': '2', 'DB_POOL_MAX_SIZE': '6', 'DB_POOL_TIMEOUT': '5'}
+        with mock.patch.dict(os.environ, env):
+            db = _postgres_profile(db)
+        # El pool excluye las conexiones persistentes aunque DB_CONN_MAX_AGE esté definido
+        self.assertEqual(db['CONN_MAX_AGE'], 0)
+        self.assertEqual(db['OPTIONS']['pool'], {'min_size': 2, 'max_size': 6, 'timeout': 5})
+        self.assertEqual(db['OPTIONS']['options'], '-c search_path=shop -c statement_timeout=30000')
+        self.assertIs(db['CONN_HEALTH_CHECKS'], True)
+        self.assertIs(db['DISABLE_SERVER_SIDE_CURSORS'], False)
+
+    def test_invalid_profile_values_stop_the_settings_from_loading(self):
+        fake = SimpleNamespace(parse=lambda url: {'ENGINE': 'django.db.backends.postgresql', 'NAME': 'shop', 'OPTIONS': {}})
+        path = str(settings.BASE_DIR / 'shopproject' / 'settings.py')
+        env = {'DATABASE_URL': 'postgres://shop:secret@db:5432/shop', 'DATABASE_REPLICA_URLS': ''}
+        with mock.patch.dict(sys.modules, {'dj_database_url': fake}), mock.patch.dict(os.environ, env):
+            os.environ.pop('DB_CONN_MAX_AGE', None)
+            loaded = runpy.run_path(path)
+            self.assertEqual(loaded['DATABASES']['default']['ENGINE'], 'django.db.backends.postgresql')
+            os.environ['DB_CONN_MAX_AGE'] = 'abc'
+            with self.assertRaises(ValueError):
+                runpy.run_path(path)
+
+    def test_gunicorn_sets_the_statement_timeout_for_web_workers(self):
+        config = Path(settings.BASE_DIR) / 'gunicorn.conf.py'
+        with mock.patch.dict(os.environ, {'GUNICORN_TIMEOUT': '20'}):
+            os.environ.pop('DB_STATEMENT_TIMEOUT_MS', None)
+            exec(compile(config.read_text(encoding='utf-8'), str(config), 'exec'), {})
+            self.assertEqual(os.environ['DB_STATEMENT_TIMEOUT_MS'], '20000')
+            db = self._profile({'DB_STATEMENT_TIMEOUT_MS': os.environ['DB_STATEMENT_TIMEOUT_MS']})
+        self.assertEqual(db['OPTIONS']['options'], '-c statement_timeout=20000')
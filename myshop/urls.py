@@ -1,10 +1,11 @@
-from django.urls import path
-from . import views
+from django.urls import path, re_path
+from . import feeds, views
 
 app_name = 'myshop'
 
 urlpatterns = [
     path('', views.index, name='index'),
+    path('search/suggest/', views.search_suggest, name='search_suggest'),
 
     # Autenticación
     path('signup/', views.signup, name='signup'),
@@ -22,8 +23,14 @@ urlpatterns = [
 
     # Productos
     path('product/<int:product_id>/', views.product_detail, name='product_detail'),
+    path('products/stream/', views.product_stream, name='product_stream'),
+
+    # Sitemap y feed de productos (archivos generados por build_feeds)
+    re_path(r'^(?P<filename>sitemap(?:-\d{4})?\.xml(?:\.gz)?)$', feeds.feed_file, name='sitemap'),
+    re_path(r'^feeds/(?P<filename>feed-\d{4}\.csv\.gz)$', feeds.feed_file, name='product_feed'),
 
     # Pedidos
     path('orders/', views.orders, name='orders'),
     path('orders/<int:order_id>/', views.order_detail, name='order_detail'),
+    path('orders/<int:order_id>/receipt.pdf', views.order_receipt, name='order_receipt'),
 ]
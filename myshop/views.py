@@ -2,17 +2,26 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse
-from django.db.models import Q
-from datetime import datetime
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.db.models import F, Q, Case, When, Value, IntegerField
+from datetime import datetime, timedelta, timezone as dt_timezone
 from django.urls import reverse  # ✅ Import corregido
 from django.core.paginator import Paginator
 from django.db import transaction
+from django.conf import settings
+import time
 
+from . import changefeed, receipts, search_index
+from .cache import cache_response
+from .coalesce import coalesce_cart_add, buffered_cart_items, open_cart_add_window, flush_pending_cart_adds
 from .forms import CustomUserCreationForm, CustomAuthenticationForm
-from .models import Product, Cart, CartItem, Review, Order, OrderItem
+from .inventory import InsufficientStock, record_sale
+from .models import Product, Cart, CartItem, Review, Order, OrderItem, ArchivedOrder
+from .popularity import record_cart_add, track_product_view
+from .ratelimit import rate_limit
 
 
+@cache_response(params=('q', 'category', 'sort', 'page'))
 def index(request):
     # Sistema de búsqueda y filtrado
     query = request.GET.get('q')
@@ -40,6 +49,8 @@ def index(request):
         products = products.order_by('-price')
     elif sort == 'name':
         products = products.order_by('name')
+    elif sort == 'popular':
+        products = products.order_by('-popularity', '-id')
     else:
         products = products.order_by('-created_at')
 
@@ -58,6 +69,26 @@ def index(request):
     return render(request, "index.html", context)
 
 
+def search_suggest(request):
+    """Sugerencias de búsqueda (JSON) desde el índice en memoria, sin consultar la base."""
+    query = request.GET.get('q', '')[:100]
+    limit = request.GET.get('limit', '')
+    limit = min(int(limit), 20) if limit.isdigit() else 8
+    prefix = search_index.normalize(query)
+    categories = [
+        {'value': value, 'label': label}
+        for value, label in Product.CATEGORY_CHOICES
+        if prefix and search_index.normalize(label).startswith(prefix)
+    ]
+    response = JsonResponse({
+        'query': query,
+        'products': search_index.get_index().search(query, limit),
+        'categories': categories,
+    })
+    response['Cache-Control'] = 'public, max-age=60'
+    return response
+
+
 def signup(request):
     if request.method == 'POST':
         form = CustomUserCreationForm(request.POST)
@@ -79,6 +110,7 @@ def signup(request):
     return render(request, 'registration/signup.html', {'form': form, 'year': datetime.now().year})
 
 
+@rate_limit('login')
 def login_view(request):
     if request.method == 'POST':
         form = CustomAuthenticationForm(request, data=request.POST)
@@ -103,13 +135,69 @@ def logout_view(request):
     return redirect('myshop:index')
 
 
-def product_detail(request, product_id):
-    product = get_object_or_404(Product, id=product_id)
-    reviews = Review.objects.filter(product=product).order_by('-created_at')
+REVIEWS_PER_PAGE = 10
+
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def _encode_review_cursor(review):
+    # Aritmética entera para que el cursor sea exacto al microsegundo
+    return f'{(review.created_at - _EPOCH) // timedelta(microseconds=1)}-{review.id}'
+
+
+def _decode_review_cursor(value):
+    """'<microsegundos>-<id>' -> (created_at, id), o None si no es válido."""
+    try:
+        micros, review_id = (int(part) for part in value.split('-'))
+        created_at = _EPOCH + timedelta(microseconds=micros)
+    except (AttributeError, ValueError, OverflowError, OSError):
+        return None
+    return created_at, review_id
+
+
+def _review_page(product, user, cursor):
+    """Una página de valoraciones y la del propio usuario en una sola consulta.
+
+    Paginación por cursor sobre (created_at, id): el coste no depende de
+    cuántas valoraciones tenga el producto.
+    """
+    reviews = Review.objects.filter(product=product).select_related('user')
+    in_page = Q()
+    if cursor:
+        created_at, review_id = cursor
+        in_page = Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=review_id)
+
+    def is_in_page(review):
+        return cursor is None or (review.created_at, review.id) < cursor
+
     user_review = None
+    if user.is_authenticated:
+        # Q() | Q(...) descartaría el Q vacío: sin cursor no se filtra nada
+        candidates = reviews.filter(in_page | Q(user=user)) if cursor else reviews
+        rows = list(
+            candidates
+            .annotate(is_own=Case(When(user=user, then=Value(1)), default=Value(0), output_field=IntegerField()))
+            .order_by('-is_own', '-created_at', '-id')[:REVIEWS_PER_PAGE + 2]
+        )
+        if rows and rows[0].is_own:
+            user_review = rows[0]
+        rows = sorted((r for r in rows if is_in_page(r)), key=lambda r: (r.created_at, r.id), reverse=True)
+    else:
+        rows = list(reviews.filter(in_page).order_by('-created_at', '-id')[:REVIEWS_PER_PAGE + 1])
+
+    page = rows[:REVIEWS_PER_PAGE]
+    next_cursor = _encode_review_cursor(page[-1]) if len(rows) > REVIEWS_PER_PAGE else None
+    return page, user_review, next_cursor
 
-    if request.user.is_authenticated:
-        user_review = Review.objects.filter(product=product, user=request.user).first()
+
+@track_product_view
+@cache_response(params=('after',))
+def product_detail(request, product_id):
+    product = get_object_or_404(Product, id=product_id)
+    reviews, user_review, next_cursor = _review_page(
+        product, request.user, _decode_review_cursor(request.GET.get('after'))
+    )
 
     if request.method == 'POST' and request.user.is_authenticated:
         rating = request.POST.get('rating')
@@ -130,36 +218,107 @@ def product_detail(request, product_id):
         'product': product,
         'reviews': reviews,
         'user_review': user_review,
+        'next_cursor': next_cursor,
         'year': datetime.now().year,
     }
     return render(request, 'product_detail.html', context)
 
 
+def product_stream(request):
+    """Server-sent events con el stock y el precio de `?ids=1,2,3`.
+
+    Envía primero el estado actual y luego los cambios publicados en el feed.
+    La conexión se cierra tras `CHANGEFEED_MAX_STREAM_SECONDS` para no ocupar
+    un hilo indefinidamente; EventSource reconecta solo.
+
+    Si el feed no llega a todos los procesos (caché local) o este proceso ya
+    tiene `CHANGEFEED_MAX_STREAMS` conexiones, se envía solo el estado actual
+    con `retry: CHANGEFEED_FALLBACK_RETRY` y se cierra: EventSource vuelve a
+    conectar pasado ese tiempo y la página se actualiza por sondeo.
+    """
+    product_ids = {int(value) for value in request.GET.get('ids', '').split(',') if value.isdigit()}
+    product_ids = sorted(product_ids)[:50]
+    if not product_ids:
+        return JsonResponse({'error': 'Parámetro ids requerido'}, status=400)
+
+    # Cada conexión abierta ocupa un hilo del worker
+    if not changefeed.streaming_enabled() or len(changefeed.hub) >= getattr(settings, 'CHANGEFEED_MAX_STREAMS', 2):
+        retry = getattr(settings, 'CHANGEFEED_FALLBACK_RETRY', 30)
+        body = f'retry: {retry * 1000}\n\n' + ''.join(
+            changefeed.format_event(event) for event in changefeed.snapshot(product_ids)
+        )
+        response = HttpResponse(body, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+    keepalive = getattr(settings, 'CHANGEFEED_KEEPALIVE', 15)
+    max_seconds = getattr(settings, 'CHANGEFEED_MAX_STREAM_SECONDS', 300)
+
+    def events():
+        # Suscripción dentro del generador: si la respuesta se descarta antes de
+        # empezar a enviarse (cliente desconectado, error de middleware), el
+        # generador nunca arranca y no queda una suscripción sin cerrar. Al
+        # cerrar la respuesta, close() del generador ejecuta el finally.
+        subscription = changefeed.subscribe(product_ids)
+        try:
+            # El estado inicial se lee después de suscribirse para no perder cambios
+            initial = changefeed.snapshot(product_ids)
+            yield f'retry: {keepalive * 1000}\n\n'
+            for event in initial:
+                yield changefeed.format_event(event)
+            deadline = time.monotonic() + max_seconds
+            while time.monotonic() < deadline:
+                event = subscription.get(timeout=min(keepalive, max(deadline - time.monotonic(), 0)))
+                yield changefeed.format_event(event) if event else ': ping\n\n'
+        finally:
+            subscription.close()
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @login_required
 def cart_view(request):
+    flush_pending_cart_adds(request.user.pk)
     cart, _ = Cart.objects.get_or_create(user=request.user)
     return render(request, 'cart.html', {'cart': cart, 'year': datetime.now().year})
 
 
 @login_required
+@rate_limit('add_to_cart', json=True)
 def add_to_cart(request, product_id):
+    record_cart_add(product_id)
+    # Clics repetidos dentro de la ventana: solo se acumula el delta en la caché
+    if coalesce_cart_add(request.user.pk, product_id):
+        return JsonResponse({
+            'message': 'Producto agregado al carrito',
+            'cart_items': buffered_cart_items(request.user.pk)
+        })
+
     product = get_object_or_404(Product, id=product_id)
+    flush_pending_cart_adds(request.user.pk)
     cart, _ = Cart.objects.get_or_create(user=request.user)
     cart_item, created = CartItem.objects.get_or_create(cart=cart, product=product)
 
     if not created:
-        cart_item.quantity += 1
-        cart_item.save()
+        # Incremento atómico: dos clics simultáneos no se pisan
+        CartItem.objects.filter(pk=cart_item.pk).update(quantity=F('quantity') + 1)
 
-    messages.success(request, f'{product.name} agregado al carrito')
+    cart_items = cart.get_total_items()
+    open_cart_add_window(request.user.pk, product.id, cart_items)
+    # Endpoint JSON: el aviso lo muestra el propio JS, no se guarda un mensaje
+    # flash (evita escribir el mensaje en la cookie/sesión en cada clic)
     return JsonResponse({
         'message': 'Producto agregado al carrito',
-        'cart_items': cart.get_total_items()
+        'cart_items': cart_items
     })
 
 
 @login_required
 def remove_from_cart(request, item_id):
+    flush_pending_cart_adds(request.user.pk)
     cart_item = get_object_or_404(CartItem, id=item_id, cart__user=request.user)
     cart_item.delete()
     messages.success(request, 'Producto eliminado del carrito')
@@ -167,7 +326,9 @@ def remove_from_cart(request, item_id):
 
 
 @login_required
+@rate_limit('update_cart', json=True)
 def update_cart(request, item_id):
+    flush_pending_cart_adds(request.user.pk)
     cart_item = get_object_or_404(CartItem, id=item_id, cart__user=request.user)
     quantity = int(request.POST.get('quantity', 1))
     cart = cart_item.cart  # Guardamos el carrito antes de modificar
@@ -187,6 +348,7 @@ def update_cart(request, item_id):
 
 @login_required
 def checkout(request):
+    flush_pending_cart_adds(request.user.pk)
     cart = get_object_or_404(Cart, user=request.user)
 
     if request.method == 'POST':
@@ -221,18 +383,22 @@ def checkout(request):
                     user=request.user,
                     shipping_address=shipping_address,
                     phone=phone,
+                    customer_name=request.user.get_full_name() or request.user.username,
+                    customer_email=request.user.email,
                     total=total
                 )
 
-                for item in items:
+                order_items = [
                     OrderItem.objects.create(
                         order=order,
                         product=item.product,
                         quantity=item.quantity,
                         price=item.product.price
                     )
-                    item.product.stock = max(0, item.product.stock - item.quantity)
-                    item.product.save()
+                    for item in items
+                ]
+                # Salida de stock a través del libro mayor (UPDATE atómico por producto)
+                record_sale(order, order_items)
 
                 cart.items.all().delete()
 
@@ -245,6 +411,11 @@ def checkout(request):
             messages.success(request, '¡Tu pedido ha sido procesado con éxito!')
             return redirect(reverse('myshop:order_detail', kwargs={'order_id': order.id}))
 
+        except InsufficientStock as exc:
+            # Otra compra se llevó las unidades después de la comprobación: no se creó nada
+            product = next(item.product for item in items if item.product_id == exc.product_id)
+            messages.error(request, f'No hay suficiente stock para {product.name}')
+            return redirect('myshop:cart')
         except Exception:
             messages.error(request, 'Ocurrió un error al procesar tu pedido. Intenta nuevamente.')
             return redirect('myshop:checkout')
@@ -252,13 +423,40 @@ def checkout(request):
     return render(request, 'checkout.html', {'cart': cart, 'year': datetime.now().year})
 
 
+ORDERS_PER_PAGE = 20
+
+
 @login_required
 def orders(request):
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
-    return render(request, 'orders.html', {'orders': orders, 'year': datetime.now().year})
+    orders = Order.objects.filter(user=request.user).order_by('-created_at', '-id')
+    # Los archivados van en su propia lista paginada: cada página es un LIMIT/OFFSET
+    # en su tabla (sin descomprimir el detalle), en vez de mezclar ambas en memoria
+    archived = ArchivedOrder.objects.filter(user=request.user).defer('payload').order_by('-created_at', '-id')
+    return render(request, 'orders.html', {
+        'orders': Paginator(orders, ORDERS_PER_PAGE).get_page(request.GET.get('page')),
+        'archived': Paginator(archived, ORDERS_PER_PAGE).get_page(request.GET.get('archived_page')),
+        'year': datetime.now().year,
+    })
 
 
 @login_required
 def order_detail(request, order_id):
-    order = get_object_or_404(Order, id=order_id, user=request.user)
-    return render(request, 'order_detail.html', {'order': order, 'year': datetime.now().year})
+    order = Order.objects.filter(id=order_id, user=request.user).first()
+    if order is None:
+        # Pedido antiguo: se busca en el archivo por el mismo id
+        order = get_object_or_404(ArchivedOrder, id=order_id, user=request.user)
+        items = order.lines
+    else:
+        items = order.items.select_related('product')
+    return render(request, 'order_detail.html', {'order': order, 'items': items, 'year': datetime.now().year})
+
+
+@login_required
+def order_receipt(request, order_id):
+    order = (
+        Order.objects.filter(id=order_id, user=request.user)
+        .select_related('user').prefetch_related('items__product').first()
+    )
+    if order is None:
+        order = get_object_or_404(ArchivedOrder.objects.select_related('user'), id=order_id, user=request.user)
+    return receipts.receipt_response(order)
@@ -26,6 +26,8 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # Perfilado bajo demanda (myshop/profiling.py); no hace nada si no se pide
+    'myshop.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -50,13 +52,22 @@ TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'myshop.context_processors.assets',
+            ],
+            # Loader cacheado explícito: cada plantilla se compila una sola vez
+            # por proceso. En DEBUG el autoreloader de Django vacía la caché
+            # cuando cambia un archivo, así que se puede usar siempre.
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
             ],
         },
     },
@@ -71,14 +82,189 @@ DATABASES = {
     }
 }
 
+
+def _parse_database_url(url):
+    try:
+        import dj_database_url
+        return dj_database_url.parse(url)
+    except ImportError:
+        # Sin dj_database_url solo se entienden URLs sqlite:///ruta (desarrollo local)
+        if url.startswith('sqlite:///'):
+            return {'ENGINE': 'django.db.backends.sqlite3', 'NAME': url[len('sqlite:///'):]}
+        raise
+
+
+def _postgres_profile(db):
+    """Conexiones reutilizadas y límite de duración de las consultas en PostgreSQL.
+
+    Sin esto cada petición abre (y cierra) su propia conexión a Postgres, que
+    cuesta más que las consultas de las vistas JSON baratas. Con DB_POOL=True
+    cada proceso usa el pool de psycopg 3 (requiere psycopg[pool]); si no, las
+    conexiones se reutilizan DB_CONN_MAX_AGE segundos y se comprueban antes de
+    usarlas (CONN_HEALTH_CHECKS).
+    """
+    if 'postgresql' not in db.get('ENGINE', ''):
+        return db
+    options = db.setdefault('OPTIONS', {})
+    # gunicorn.conf.py lo fija para los workers web; los comandos de manage.py
+    # (exportaciones y trabajos por lotes) quedan sin límite salvo que se defina
+    timeout = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0))
+    if timeout:
+        options['options'] = f"{options.get('options', '')} -c statement_timeout={timeout}".strip()
+    if os.environ.get('DB_POOL', 'False') == 'True':
+        options['pool'] = {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 1)),
+            # Un hilo de gunicorn usa como mucho una conexión a la vez
+            'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', os.environ.get('GUNICORN_THREADS', 4))),
+            'timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        }
+        # Django no admite conexiones persistentes junto con el pool
+        db['CONN_MAX_AGE'] = 0
+    else:
+        db['CONN_MAX_AGE'] = int(os.environ.get('DB_CONN_MAX_AGE', 60))
+    db['CONN_HEALTH_CHECKS'] = True
+    # Detrás de PgBouncer en modo transacción los cursores de servidor de
+    # `.iterator()` no sobreviven entre consultas: hay que desactivarlos
+    db['DISABLE_SERVER_SIDE_CURSORS'] = os.environ.get('DB_DISABLE_SERVER_SIDE_CURSORS', 'False') == 'True'
+    return db
+
+
 # Si se provee DATABASE_URL (ej. en Render), usarla para configurar la base de datos
 if os.environ.get('DATABASE_URL'):
     try:
-        import dj_database_url
-        DATABASES['default'] = dj_database_url.parse(os.environ.get('DATABASE_URL'))
-    except Exception:
+        _default_database = _parse_database_url(os.environ.get('DATABASE_URL'))
+    except ImportError:
         # dj_database_url no está instalado; dejar sqlite como fallback
-        pass
+        _default_database = None
+    if _default_database is not None:
+        # Fuera del try: un valor mal escrito (DB_CONN_MAX_AGE=abc) debe impedir
+        # el arranque, no dejar producción funcionando sobre SQLite
+        DATABASES['default'] = _postgres_profile(_default_database)
+
+# Réplicas de solo lectura para el catálogo (myshop/routers.py). Lista de URLs
+# separadas por comas, en el mismo formato que DATABASE_URL. Para probar en
+# local basta una copia del archivo: DATABASE_REPLICA_URLS=sqlite:///replica.sqlite3
+DATABASE_REPLICAS = []
+for _index, _url in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_URLS', '').split(',')), start=1):
+    _alias = f'replica{_index}'
+    DATABASES[_alias] = _postgres_profile(_parse_database_url(_url.strip()))
+    # En los tests las réplicas apuntan a la base de test principal
+    DATABASES[_alias]['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(_alias)
+
+if DATABASE_REPLICAS:
+    DATABASE_ROUTERS = ['myshop.routers.CatalogReplicaRouter']
+    MIDDLEWARE.insert(
+        MIDDLEWARE.index('django.contrib.auth.middleware.AuthenticationMiddleware') + 1,
+        'myshop.routers.ReplicaPinningMiddleware',
+    )
+# Segundos que un usuario lee de la principal tras escribir
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 5))
+REPLICA_HEALTH_CHECK_INTERVAL = 30
+
+# Caché: Redis si se define REDIS_URL (compartida entre workers), si no
+# memoria local del proceso.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'myshop',
+        }
+    }
+
+# Caché de respuestas de `index` y `product_detail` para visitantes anónimos
+# (ver myshop/cache.py). Tiempos en segundos.
+RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', 'True') == 'True'
+RESPONSE_CACHE_TIMEOUT = int(os.environ.get('RESPONSE_CACHE_TIMEOUT', 60))
+RESPONSE_CACHE_STALE = int(os.environ.get('RESPONSE_CACHE_STALE', 300))
+RESPONSE_CACHE_LOCK_TIMEOUT = 10
+RESPONSE_CACHE_LOCK_WAIT = 2
+
+# Límites por vista (token bucket en la caché, ver myshop/ratelimit.py).
+# Formato 'N/s', 'N/m', 'N/h'. Ámbitos: ip, user, username.
+RATE_LIMITS = {
+    'login': {'ip': '20/m', 'username': '5/m'},
+    'add_to_cart': {'ip': '120/m', 'user': '60/m'},
+    'update_cart': {'ip': '120/m', 'user': '60/m'},
+}
+# Detrás del proxy de Render la IP real llega en X-Forwarded-For
+RATE_LIMIT_TRUST_X_FORWARDED_FOR = os.environ.get('RATE_LIMIT_TRUST_X_FORWARDED_FOR', 'False') == 'True'
+# Segundos durante los que los clics repetidos en "Añadir al carrito" se agrupan
+# en la caché. Requiere una caché compartida (REDIS_URL): con la caché en
+# memoria de cada proceso no se activa (ver myshop/coalesce.py)
+CART_ADD_COALESCE_WINDOW = int(os.environ.get('CART_ADD_COALESCE_WINDOW', 0))
+
+# Almacenamiento de sesiones: 'db' (por defecto de Django), 'cached_db'
+# (lecturas desde la caché, la base solo al escribir) o 'signed_cookies'
+# (sin estado en el servidor; los datos de sesión viajan firmados en la cookie).
+SESSION_MODE = os.environ.get('SESSION_MODE', 'db')
+SESSION_ENGINE = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}[SESSION_MODE]
+if SESSION_MODE != 'db':
+    # Mensajes flash solo en cookie: nunca marcan la sesión como modificada
+    MESSAGE_STORAGE = 'django.contrib.messages.storage.cookie.CookieStorage'
+
+# Popularidad del catálogo (myshop/popularity.py)
+POPULARITY_FLUSH_INTERVAL = int(os.environ.get('POPULARITY_FLUSH_INTERVAL', 30))
+POPULARITY_FLUSH_MAX_PENDING = 500
+POPULARITY_WEIGHTS = {'view': 1.0, 'cart_add': 5.0, 'sale': 20.0}
+POPULARITY_HALF_LIFE_DAYS = 7
+
+# Índice en memoria para /search/suggest/ (myshop/search_index.py)
+SEARCH_INDEX_MAX_BYTES = int(os.environ.get('SEARCH_INDEX_MAX_BYTES', 8 * 1024 * 1024))
+SEARCH_INDEX_CHECK_INTERVAL = 5
+SEARCH_INDEX_MAX_AGE = 600
+
+# Perfilado de peticiones (myshop/profiling.py)
+PROFILING_DIR = Path(os.environ.get('PROFILING_DIR', BASE_DIR / 'profiles'))
+# Perfilar 1 de cada N peticiones (0 = solo bajo demanda)
+PROFILING_SAMPLE_RATE = int(os.environ.get('PROFILING_SAMPLE_RATE', 0))
+PROFILING_SAMPLE_INTERVAL = 0.005
+PROFILING_KEEP = 200
+PROFILING_TOKEN_MAX_AGE = 3600
+
+# Copias de seguridad de SQLite (manage.py backup_db)
+BACKUP_DIR = Path(os.environ.get('BACKUP_DIR', BASE_DIR / 'backups'))
+BACKUP_KEEP = int(os.environ.get('BACKUP_KEEP', 14))
+
+# Feed de cambios de stock/precio y SSE (myshop/changefeed.py)
+CHANGEFEED_BROKER = os.environ.get('CHANGEFEED_BROKER', 'myshop.changefeed.CacheBroker')
+CHANGEFEED_POLL_INTERVAL = 0.5
+CHANGEFEED_EVENT_TTL = 60
+CHANGEFEED_KEEPALIVE = 15
+CHANGEFEED_MAX_STREAM_SECONDS = int(os.environ.get('CHANGEFEED_MAX_STREAM_SECONDS', 300))
+# Conexiones SSE simultáneas por proceso; cada una ocupa un hilo de gunicorn
+# (GUNICORN_THREADS), así que debe quedar por debajo de ese número
+CHANGEFEED_MAX_STREAMS = int(os.environ.get('CHANGEFEED_MAX_STREAMS', 2))
+# Sin feed compartido o sin conexiones libres, la página recibe el estado
+# actual y vuelve a pedirlo pasados estos segundos
+CHANGEFEED_FALLBACK_RETRY = int(os.environ.get('CHANGEFEED_FALLBACK_RETRY', 30))
+
+# Sitemap y feed de productos (manage.py build_feeds)
+SITE_URL = os.environ.get('SITE_URL', 'http://localhost:8000')
+FEEDS_DIR = Path(os.environ.get('FEEDS_DIR', BASE_DIR / 'feeds'))
+FEEDS_SHARD_SIZE = 10000
+FEEDS_CURRENCY = os.environ.get('FEEDS_CURRENCY', 'USD')
+FEEDS_MAX_AGE = 3600
+
+# Recibos en PDF (myshop/receipts.py, manage.py build_receipts)
+RECEIPTS_DIR = Path(os.environ.get('RECEIPTS_DIR', BASE_DIR / 'media' / 'receipts'))
+RECEIPTS_SHOP_NAME = os.environ.get('RECEIPTS_SHOP_NAME', 'Impresión 3D')
+# 'X-Sendfile' (Apache) o 'X-Accel-Redirect' (nginx); vacío = FileResponse desde Django
+RECEIPTS_SENDFILE_HEADER = os.environ.get('RECEIPTS_SENDFILE_HEADER', '')
+RECEIPTS_ACCEL_PREFIX = os.environ.get('RECEIPTS_ACCEL_PREFIX', '/protected/receipts/')
+# Segundos que se conserva una versión anterior del recibo desde que se sirvió por última vez
+RECEIPTS_STALE_GRACE = 300
 
 AUTH_PASSWORD_VALIDATORS = []
 
@@ -92,11 +278,28 @@ STATICFILES_DIRS = [BASE_DIR / 'static']
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
-# Almacenamiento recomendado para producción con WhiteNoise
-STATICFILES_STORAGE = os.environ.get(
-    'STATICFILES_STORAGE',
-    'whitenoise.storage.CompressedManifestStaticFilesStorage'
-)
+# Almacenamiento recomendado para producción con WhiteNoise (nombres con hash
+# y versiones .gz/.br). Django 5.1+ ya no lee STATICFILES_STORAGE: se configura
+# mediante STORAGES (la variable de entorno conserva su nombre). En DEBUG se usa
+# el storage simple para no exigir `collectstatic` en desarrollo ni en los tests.
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': os.environ.get(
+            'STATICFILES_STORAGE',
+            'django.contrib.staticfiles.storage.StaticFilesStorage' if DEBUG
+            else 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+        ),
+    },
+}
+
+# Bundles minificados de CSS/JS (generados con `python manage.py build_assets`
+# antes de `collectstatic`). Los archivos con hash se sirven con caché de un año
+# (`immutable`) y WhiteNoise entrega las versiones .br/.gz precomprimidas.
+ASSET_BUNDLES = os.environ.get('ASSET_BUNDLES', 'False') == 'True'
+WHITENOISE_MAX_AGE = int(os.environ.get('WHITENOISE_MAX_AGE', 0 if DEBUG else 60 * 60))
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
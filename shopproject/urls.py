@@ -4,7 +4,13 @@ from django.views.generic import RedirectView
 from django.conf import settings
 from django.conf.urls.static import static
 
+from myshop import profiling, receipts
+
 urlpatterns = [
+    # Perfiles de peticiones (solo staff); antes de admin.site.urls
+    path('admin/profiles/', profiling.profile_list, name='profile_list'),
+    path('admin/profiles/<str:filename>', profiling.profile_download, name='profile_download'),
+    path('admin/receipts/<int:year>/<int:month>/', receipts.receipt_bundle, name='receipt_bundle'),
     path('admin/', admin.site.urls),
     path('', include('myshop.urls')),
     # Redirigir favicon.ico al archivo estático
@@ -0,0 +1,43 @@
+/* Botones "Añadir al carrito" compartidos por index.html y product_detail.html */
+document.addEventListener('DOMContentLoaded', function() {
+    const csrfMeta = document.querySelector('meta[name="csrf-token"]');
+    const loginMeta = document.querySelector('meta[name="login-url"]');
+
+    document.querySelectorAll('.add-to-cart').forEach(button => {
+        button.addEventListener('click', function() {
+            // Sin token CSRF el visitante es anónimo: mandarlo a iniciar sesión
+            if (!csrfMeta) {
+                if (loginMeta) {
+                    window.location.href = loginMeta.content;
+                }
+                return;
+            }
+
+            const productId = this.dataset.productId;
+
+            fetch(`/cart/add/${productId}/`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/x-www-form-urlencoded',
+                    'X-CSRFToken': csrfMeta.content
+                }
+            })
+            .then(response => response.json())
+            .then(data => {
+                if (data.message) {
+                    // Mostrar mensaje de éxito
+                    const alert = document.createElement('div');
+                    alert.className = 'alert alert-success position-fixed top-0 start-50 translate-middle-x mt-3';
+                    alert.style.zIndex = '1000';
+                    alert.textContent = data.message;
+                    document.body.appendChild(alert);
+
+                    // Eliminar el mensaje después de 3 segundos
+                    setTimeout(() => {
+                        alert.remove();
+                    }, 3000);
+                }
+            });
+        });
+    });
+});
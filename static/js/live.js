@@ -0,0 +1,38 @@
+/* Stock y precio en vivo (server-sent events) en product_detail.html y cart.html */
+document.addEventListener('DOMContentLoaded', function() {
+    const nodes = document.querySelectorAll('[data-live-product]');
+    const streamMeta = document.querySelector('meta[name="product-stream-url"]');
+    if (!nodes.length || !streamMeta || !window.EventSource) {
+        return;
+    }
+
+    const ids = [...new Set([...nodes].map(node => node.dataset.liveProduct))];
+    const source = new EventSource(`${streamMeta.content}?ids=${ids.join(',')}`);
+
+    source.addEventListener('product', function(message) {
+        const product = JSON.parse(message.data);
+
+        document.querySelectorAll(`[data-live-stock="${product.id}"]`).forEach(badge => {
+            const inStock = product.stock > 0;
+            badge.textContent = inStock ? `En stock (${product.stock})` : 'Agotado';
+            badge.classList.toggle('bg-success', inStock);
+            badge.classList.toggle('bg-danger', !inStock);
+        });
+
+        document.querySelectorAll(`[data-live-price="${product.id}"]`).forEach(price => {
+            price.textContent = `$${product.price}`;
+        });
+
+        document.querySelectorAll(`.add-to-cart[data-product-id="${product.id}"]`).forEach(button => {
+            button.disabled = product.stock <= 0;
+        });
+
+        // Carrito: avisar si ya no queda stock suficiente para la cantidad elegida
+        document.querySelectorAll(`[data-live-shortage="${product.id}"]`).forEach(warning => {
+            const row = warning.closest('tr');
+            const quantity = parseInt(row.querySelector('.quantity').textContent, 10);
+            warning.textContent = product.stock <= 0 ? 'Agotado' : `Solo quedan ${product.stock}`;
+            warning.classList.toggle('d-none', product.stock >= quantity);
+        });
+    });
+});
@@ -0,0 +1,74 @@
+/* Sugerencias mientras se escribe en el buscador de index.html */
+document.addEventListener('DOMContentLoaded', function() {
+    const input = document.getElementById('search-input');
+    if (!input || !input.dataset.suggestUrl) {
+        return;
+    }
+
+    const list = document.createElement('div');
+    list.className = 'list-group position-absolute w-100 shadow-sm d-none';
+    list.style.zIndex = '1000';
+    list.style.top = '100%';
+    input.parentElement.classList.add('position-relative');
+    input.parentElement.appendChild(list);
+
+    let timer = null;
+    let controller = null;
+
+    function hide() {
+        list.classList.add('d-none');
+        list.replaceChildren();
+    }
+
+    function addItem(label, href, muted) {
+        const item = document.createElement('a');
+        item.className = 'list-group-item list-group-item-action' + (muted ? ' text-muted' : '');
+        item.href = href;
+        item.textContent = label;
+        list.appendChild(item);
+    }
+
+    function suggest() {
+        const query = input.value.trim();
+        if (query.length < 2) {
+            hide();
+            return;
+        }
+        // Solo cuenta la última petición: las anteriores se cancelan
+        if (controller) {
+            controller.abort();
+        }
+        controller = new AbortController();
+
+        fetch(`${input.dataset.suggestUrl}?q=${encodeURIComponent(query)}`, {signal: controller.signal})
+            .then(response => response.json())
+            .then(data => {
+                list.replaceChildren();
+                data.categories.forEach(category => {
+                    addItem(`Categoría: ${category.label}`, `?category=${encodeURIComponent(category.value)}`, true);
+                });
+                data.products.forEach(product => addItem(product.name, product.url, false));
+                list.classList.toggle('d-none', list.children.length === 0);
+            })
+            .catch(error => {
+                if (error.name !== 'AbortError') {
+                    hide();
+                }
+            });
+    }
+
+    input.addEventListener('input', function() {
+        clearTimeout(timer);
+        timer = setTimeout(suggest, 150);
+    });
+    input.addEventListener('keydown', function(event) {
+        if (event.key === 'Escape') {
+            hide();
+        }
+    });
+    document.addEventListener('click', function(event) {
+        if (!input.parentElement.contains(event.target)) {
+            hide();
+        }
+    });
+});